@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+__author__ = "Ashesh Vasalya"
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import itertools
+import platform
+import tempfile
+import tracemalloc
+import numpy
+
+from libs.lidarutils import (
+    GetFlightPathFromFile,
+    GetLidarMeasurementsFromFile,
+    ExtractSweepsFromMeasurements,
+    GetSweepPointsInSensorFrame,
+    logHandle,
+)
+from libs.mapping import lidar_to_grid_map
+from libs.mapping.distance_field import DistanceField
+from libs.render import SweepFrameRenderer
+
+DESCRIPTION = (
+    "Benchmark the parse, segment, ray cast and render stages of the lidar pipeline"
+)
+# differences below these are timer and allocator noise, never regressions
+NOISE_FLOOR = {"seconds": 0.002, "peakBytes": 64 << 10}
+
+
+def WriteScaledMission(lidarPoints, flightPath, scale, outputDir):
+    """
+    Writes a synthetic mission made of scale copies of a recorded one, with
+    renumbered sweep IDs and the flight path shifted for every copy.
+
+    Args:
+        lidarPoints (str): The lidar measurements file of the recorded mission.
+        flightPath (str): The flight path file of the recorded mission.
+        scale (int): Number of copies of the recorded mission.
+        outputDir (str): Directory of the written files.
+
+    Returns:
+        tuple: (lidarPoints, flightPath) names of the written files.
+    """
+    assert isinstance(scale, int) and scale > 0, "scale should be a positive integer"
+    with open(lidarPoints, "r") as fileHandler:
+        rows = fileHandler.read().splitlines()
+    with open(flightPath, "r") as fileHandler:
+        pathRows = fileHandler.read().splitlines()
+
+    # the header rows of the recorded mission, to renumber them in every copy
+    headerIndices = []
+    rowIndex = 0
+    while rowIndex < len(rows):
+        headerIndices.append(rowIndex)
+        rowIndex += int(float(rows[rowIndex].split(",")[1])) + 1
+    numSweeps = len(headerIndices)
+
+    scaledLidarPoints = os.path.join(outputDir, "LIDARPoints_x{}.csv".format(scale))
+    scaledFlightPath = os.path.join(outputDir, "FlightPath_x{}.csv".format(scale))
+    with open(scaledLidarPoints, "w") as fileHandler:
+        for copy in range(scale):
+            for sweepIndex, headerIndex in enumerate(headerIndices):
+                end = (
+                    headerIndices[sweepIndex + 1]
+                    if sweepIndex + 1 < numSweeps
+                    else len(rows)
+                )
+                numSamples = rows[headerIndex].split(",")[1]
+                fileHandler.write(
+                    "{},{}\n".format(copy * numSweeps + sweepIndex, numSamples)
+                )
+                fileHandler.write("\n".join(rows[headerIndex + 1 : end]) + "\n")
+
+    with open(scaledFlightPath, "w") as fileHandler:
+        for copy in range(scale):
+            for poseIndex in range(0, len(pathRows) - 1, 2):
+                sweepID = int(pathRows[poseIndex].split(",")[0])
+                x, y = (float(value) for value in pathRows[poseIndex + 1].split(","))
+                fileHandler.write("{},1\n".format(copy * numSweeps + sweepID))
+                fileHandler.write("{},{}\n".format(x + 30.0 * copy, y))
+
+    return scaledLidarPoints, scaledFlightPath
+
+
+def MeasureStage(function, repeat=3):
+    """
+    Times a stage and measures the peak memory it allocates.
+
+    The stage is timed repeat times and the fastest run is kept, then run once
+    more under tracemalloc, which slows it down, to measure its peak memory.
+
+    Args:
+        function (callable): The stage, called without arguments.
+        repeat (int): Number of timed runs.
+
+    Returns:
+        dict: "seconds" of the fastest run and "peakBytes" allocated.
+    """
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        function()
+        _, peakBytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"seconds": min(seconds), "peakBytes": peakBytes}
+
+
+def RunBenchmarks(lidarPoints, flightPath, scales, maxSweeps=8, repeat=3):
+    """
+    Runs every stage of the pipeline on the recorded mission scaled up.
+
+    Parsing and segmentation run on the whole scaled mission. Ray casting and
+    rendering run on the first maxSweeps sweeps and are reported per sweep, as
+    their cost does not depend on the size of the mission.
+
+    Args:
+        lidarPoints (str): The lidar measurements file of the recorded mission.
+        flightPath (str): The flight path file of the recorded mission.
+        scales (list): Scales of the synthetic missions, 1 is the recorded one.
+        maxSweeps (int): Number of sweeps ray cast and rendered.
+        repeat (int): Number of timed runs of every stage.
+
+    Returns:
+        dict: Results keyed by "x<scale>/<stage>".
+    """
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="lidar_benchmark_") as tempDir:
+        for scale in scales:
+            if scale == 1:
+                missionPoints, missionPath = lidarPoints, flightPath
+            else:
+                missionPoints, missionPath = WriteScaledMission(
+                    lidarPoints, flightPath, scale, tempDir
+                )
+            prefix = "x{}/".format(scale)
+            logHandle.log.info("Benchmarking the mission scaled x%s", scale)
+
+            results[prefix + "GetLidarMeasurementsFromFile"] = MeasureStage(
+                lambda: GetLidarMeasurementsFromFile(missionPoints), repeat
+            )
+            results[prefix + "GetFlightPathFromFile"] = MeasureStage(
+                lambda: GetFlightPathFromFile(missionPath), repeat
+            )
+            angles, distances = GetLidarMeasurementsFromFile(missionPoints)
+            results[prefix + "ExtractSweepsFromMeasurements"] = MeasureStage(
+                lambda: ExtractSweepsFromMeasurements(angles, distances), repeat
+            )
+            if scale != scales[0]:
+                continue
+
+            # per sweep stages, independent of the size of the mission
+            lidarSweepsList = ExtractSweepsFromMeasurements(angles, distances)
+            points = [
+                GetSweepPointsInSensorFrame(sweep)
+                for sweep in lidarSweepsList[:maxSweeps]
+            ]
+            for breshen in (True, False):
+                stage = "generate_ray_casting_grid_map(breshen={})".format(breshen)
+                result = MeasureStage(
+                    lambda: [
+                        lidar_to_grid_map.generate_ray_casting_grid_map(
+                            ox, oy, 0.02, sweepID, breshen
+                        )
+                        for sweepID, (ox, oy) in enumerate(points)
+                    ],
+                    repeat,
+                )
+                result["seconds"] /= len(points)
+                results["sweep/" + stage] = result
+
+            gridMaps = [
+                lidar_to_grid_map.generate_ray_casting_grid_map(ox, oy, 0.02)[0]
+                for ox, oy in points
+            ]
+            # a full distance transform of a sweep map, then the update after
+            # a small change of a wall, flipping a 4x4 block back and forth
+            gridMap = gridMaps[0]
+            results["sweep/DistanceField"] = MeasureStage(
+                lambda: DistanceField(gridMap, 0.02), repeat
+            )
+            walls = numpy.argwhere(gridMap > 0.5)
+            x, y = walls[len(walls) // 2]
+            changed = gridMap.copy()
+            changed[x : x + 4, y : y + 4] = 1.0 - changed[x : x + 4, y : y + 4]
+            field = DistanceField(gridMap, 0.02)
+            maps = itertools.cycle([changed, gridMap])
+            results["sweep/DistanceField.update"] = MeasureStage(
+                lambda: field.update(next(maps), (x, x + 4, y, y + 4)), repeat
+            )
+
+            renderer = SweepFrameRenderer()
+            frameFile = os.path.join(tempDir, "frame.png")
+            result = MeasureStage(
+                lambda: [
+                    renderer.Render(sweepID, gridMap, ox, oy, frameFile)
+                    for sweepID, (gridMap, (ox, oy)) in enumerate(zip(gridMaps, points))
+                ],
+                repeat,
+            )
+            result["seconds"] /= len(points)
+            results["sweep/SweepFrameRenderer.Render"] = result
+
+    return results
+
+
+def CompareWithBaseline(results, baseline, threshold=0.2):
+    """
+    Finds the stages slower, or using more memory, than their baseline, by
+    more than the threshold and more than the NOISE_FLOOR.
+
+    Args:
+        results (dict): Results of RunBenchmarks().
+        baseline (dict): Results of an earlier run.
+        threshold (float): Relative increase tolerated, 0.2 for 20%.
+
+    Returns:
+        list: (stage, metric, baselineValue, value) of every regression.
+    """
+    regressions = []
+    for stage in sorted(results):
+        if stage not in baseline:
+            continue
+        for metric in ("seconds", "peakBytes"):
+            value, baselineValue = results[stage][metric], baseline[stage][metric]
+            if value - baselineValue > max(
+                baselineValue * threshold, NOISE_FLOOR[metric]
+            ):
+                regressions.append((stage, metric, baselineValue, value))
+    return regressions
+
+
+def main(args):
+    """
+    Runs the benchmarks, writes their results, and compares them with a baseline.
+
+    Args:
+        args (argparse.Namespace): A namespace object containing command-line arguments.
+
+    Returns:
+        int: 1 if a stage regressed beyond the threshold, 0 otherwise.
+    """
+    assert os.path.isfile(args.lidarPoints), f"'{args.lidarPoints}' is not a file."
+    assert os.path.isfile(args.flightPath), f"'{args.flightPath}' is not a file."
+
+    # the per sweep logs of the pipeline would dominate the timings
+    logHandle.SetLevel(logging.WARNING)
+    results = RunBenchmarks(
+        args.lidarPoints, args.flightPath, args.scales, args.maxSweeps, args.repeat
+    )
+    for stage, result in results.items():
+        print(
+            "{:<60} {:>10.4f} s {:>10.1f} MiB".format(
+                stage, result["seconds"], result["peakBytes"] / 2**20
+            )
+        )
+
+    if args.output:
+        report = {
+            "python": platform.python_version(),
+            "numpy": numpy.__version__,
+            "machine": platform.machine(),
+            "results": results,
+        }
+        with open(args.output, "w") as fileHandler:
+            json.dump(report, fileHandler, indent=2, sort_keys=True)
+        print("Results written to {}".format(args.output))
+
+    if args.baseline:
+        with open(args.baseline, "r") as fileHandler:
+            baseline = json.load(fileHandler)["results"]
+        regressions = CompareWithBaseline(results, baseline, args.threshold)
+        for stage, metric, baselineValue, value in regressions:
+            print(
+                "REGRESSION {} {}: {:.4g} -> {:.4g} (+{:.0%})".format(
+                    stage, metric, baselineValue, value, value / baselineValue - 1.0
+                )
+            )
+        if regressions:
+            return 1
+        print("No regression beyond {:.0%} of {}".format(args.threshold, args.baseline))
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog=sys.argv[0],
+        description=DESCRIPTION,
+        epilog="python3 benchmark.py --scales 1 10 100 --output benchmark.json --baseline baseline.json",
+    )
+    parser.add_argument(
+        "--flightPath",
+        help="path to flight path .csv file",
+        type=str,
+        default="data/FlightPath.csv",
+    )
+    parser.add_argument(
+        "--lidarPoints",
+        help="path to lidar measurements .csv file",
+        type=str,
+        default="data/LIDARPoints.csv",
+    )
+    parser.add_argument(
+        "--scales",
+        help="scales of the synthetic missions, 1 is the recorded mission",
+        type=int,
+        nargs="+",
+        default=[1, 10, 100],
+    )
+    parser.add_argument(
+        "--maxSweeps",
+        help="number of sweeps ray cast and rendered",
+        type=int,
+        default=8,
+    )
+    parser.add_argument(
+        "--repeat", help="number of timed runs of every stage", type=int, default=3
+    )
+    parser.add_argument("--output", help="path to the results .json file", type=str)
+    parser.add_argument(
+        "--baseline", help="path to the results .json file to compare with", type=str
+    )
+    parser.add_argument(
+        "--threshold",
+        help="relative slow down or memory increase reported as a regression",
+        type=float,
+        default=0.2,
+    )
+    args = parser.parse_args()
+
+    sys.exit(main(args))
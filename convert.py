@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+__author__ = "Ashesh Vasalya"
+import sys
+import argparse
+
+from libs.loghandler import LEVEL_NAMES
+from libs.lidarutils import ConvertToSweepStore, logHandle
+
+DESCRIPTION = "Convert FlightPath and LIDARPoints CSV files into a binary sweep store"
+
+
+def main(args):
+    """
+    Converts flight path and LiDAR measurement files into a binary sweep store.
+
+    Args:
+        args (argparse.Namespace): A namespace object containing command-line arguments.
+
+    Raises:
+        AssertionError: If any required input arguments are missing or invalid.
+    """
+    assert args.flightPath, "No flight path filename provided."
+    assert args.lidarPoints, "No LiDAR measurement filename provided."
+    assert args.output, "No output filename provided."
+
+    ConvertToSweepStore(args.lidarPoints, args.flightPath, args.output)
+    logHandle.log.info("Sweep store written to %s", args.output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog=sys.argv[0],
+        description=DESCRIPTION,
+        epilog="python3 convert.py --flightPath <flight_path_file> "
+        "--lidarPoints <lidar_measurements_file> --output <mission.l1d>",
+    )
+    parser.add_argument("--flightPath", help="path to flight path .csv file", type=str)
+    parser.add_argument(
+        "--lidarPoints", help="path to lidar measurements .csv file", type=str
+    )
+    parser.add_argument("--output", help="path to the sweep store to write", type=str)
+    parser.add_argument(
+        "--logLevel",
+        help="level of the console log, LIDAR1D_LOG_LEVEL or DEBUG by default",
+        type=str.upper,
+        choices=LEVEL_NAMES,
+    )
+    args = parser.parse_args()
+    if args.logLevel:
+        logHandle.SetLevel(args.logLevel)
+
+    main(args)
+    logHandle.log.debug("******    end of program, exiting.  *******")
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+__author__ = "Ashesh Vasalya"
+
+import os
+import zlib
+import hashlib
+import tempfile
+import numpy
+from collections import OrderedDict
+
+from .mapping import lidar_to_grid_map
+
+""" Content-addressed cache of the per sweep occupancy grid maps.
+
+    A grid map is keyed by a hash of the sweep points and of the parameters of
+    generate_ray_casting_grid_map, so an unchanged sweep is never ray cast
+    twice. Recent maps are held in an in-memory LRU tier, and every map is
+    also written to a compressed on-disk tier, evicted oldest first once it
+    grows past its size limit, so repeated runs over the same mission skip ray
+    casting entirely.
+
+    Example usage:
+    from gridcache import GridMapCache
+    cache = GridMapCache("output/cache")
+    gridMap, minX, maxX, minY, maxY, xy_resolution = cache.GetOrCompute(ox, oy, 0.01)
+    print(cache.GetStats())
+"""
+
+# bump when the grid map computation changes, to invalidate older entries
+CACHE_VERSION = 2
+# fastest zlib level, higher levels cost more than ray casting the sweep again
+COMPRESSION_LEVEL = 1
+# on-disk entry header: shape of the grid map and its extent
+ENTRY_HEADER_DTYPE = numpy.dtype([("shape", "<i8", 2), ("extent", "<f8", 4)])
+
+
+def EncodeGridMap(gridMap):
+    """
+    Converts an occupancy grid map to a compact uint8 map, 0 free, 1 unknown
+    and 2 occupied.
+    """
+    gridMap = numpy.asarray(gridMap)
+    # cast while multiplying, without a float temporary of the size of the map
+    encoded = numpy.empty(gridMap.shape, dtype=numpy.uint8)
+    numpy.multiply(gridMap, 2, out=encoded, casting="unsafe")
+    return encoded
+
+
+def DecodeGridMap(gridMap, dtype=numpy.float32):
+    """
+    Converts a compact uint8 grid map back to occupancy values, 0.0 free, 0.5
+    unknown and 1.0 occupied.
+    """
+    return gridMap.astype(dtype) * dtype(0.5)
+
+
+def GetGridMapKey(ox, oy, xy_resolution, breshen=True, angularBin=None, maxRange=None):
+    """
+    Hashes the sweep points and the grid map parameters.
+
+    Args:
+        ox (numpy.ndarray): x coordinates of the samples around the lidar.
+        oy (numpy.ndarray): y coordinates of the samples around the lidar.
+        xy_resolution (float): Resolution of the grid map.
+        breshen (bool): If True bresenham ray casting, else flood fill.
+        angularBin (float): Optional angular bin of the downsampling, in degrees.
+        maxRange (float): Optional max range of a fixed extent grid map.
+
+    Returns:
+        str: The hexadecimal key of the grid map.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    parameters = (CACHE_VERSION, float(xy_resolution), bool(breshen))
+    # the keys of the maps without these options are left unchanged
+    if angularBin:
+        parameters += (float(angularBin),)
+    if maxRange is not None:
+        parameters += ("maxRange", float(maxRange))
+    digest.update(repr(parameters).encode())
+    for points in (ox, oy):
+        points = numpy.ascontiguousarray(points, dtype=numpy.float64)
+        digest.update(repr(points.shape).encode())
+        digest.update(points.tobytes())
+    return digest.hexdigest()
+
+
+class GridMapCache:
+    """
+    Two tier cache of compact grid maps, with hit and miss counters.
+
+    Entries are (gridMap, extent) pairs, gridMap being the uint8 map of
+    EncodeGridMap() and extent (minX, maxX, minY, maxY).
+    """
+
+    def __init__(self, cacheDir=None, maxMemoryEntries=64, maxDiskBytes=512 << 20):
+        """
+        Args:
+            cacheDir (str): Directory of the on-disk tier, None keeps the cache in memory.
+            maxMemoryEntries (int): Number of grid maps held in memory.
+            maxDiskBytes (int): Size of the on-disk tier before the least recently
+            used entries are evicted.
+        """
+        assert maxMemoryEntries >= 0, "maxMemoryEntries should not be negative"
+        assert maxDiskBytes >= 0, "maxDiskBytes should not be negative"
+        self.cacheDir = cacheDir
+        self.maxMemoryEntries = maxMemoryEntries
+        self.maxDiskBytes = maxDiskBytes
+        self.entries = OrderedDict()
+        self.memoryHits = 0
+        self.diskHits = 0
+        self.misses = 0
+
+        self.diskBytes = 0
+        if cacheDir is not None:
+            os.makedirs(cacheDir, exist_ok=True)
+            self.diskBytes = sum(size for _, _, size in self._ListDiskEntries())
+
+    def _GetPath(self, key):
+        return os.path.join(self.cacheDir, key + ".gmc")
+
+    def _ListDiskEntries(self):
+        """
+        Returns (mtime, path, size) of every entry of the on-disk tier.
+        """
+        entries = []
+        with os.scandir(self.cacheDir) as directory:
+            for entry in directory:
+                if entry.name.endswith(".gmc"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, entry.path, stat.st_size))
+        return entries
+
+    def _Remember(self, key, entry):
+        if self.maxMemoryEntries == 0:
+            return
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxMemoryEntries:
+            self.entries.popitem(last=False)
+
+    def Get(self, key):
+        """
+        Looks up a grid map, first in memory then on disk.
+
+        Args:
+            key (str): The key of GetGridMapKey().
+
+        Returns:
+            tuple: The (gridMap, extent) entry, or None on a miss.
+        """
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            self.memoryHits += 1
+            return entry
+
+        if self.cacheDir is not None:
+            path = self._GetPath(key)
+            try:
+                with open(path, "rb") as fileHandler:
+                    data = fileHandler.read()
+                header = numpy.frombuffer(data, ENTRY_HEADER_DTYPE, count=1)[0]
+                gridMap = numpy.frombuffer(
+                    zlib.decompress(data[ENTRY_HEADER_DTYPE.itemsize :]), numpy.uint8
+                ).reshape(header["shape"])
+                entry = (gridMap, tuple(header["extent"].tolist()))
+                # refresh the access time, the disk tier evicts the oldest entries
+                os.utime(path)
+            except (OSError, ValueError, zlib.error):
+                entry = None
+            if entry is not None:
+                self.diskHits += 1
+                self._Remember(key, entry)
+                return entry
+
+        self.misses += 1
+        return None
+
+    def Put(self, key, gridMap, extent):
+        """
+        Stores a compact grid map in both tiers.
+
+        Args:
+            key (str): The key of GetGridMapKey().
+            gridMap (numpy.ndarray): The uint8 map of EncodeGridMap().
+            extent (tuple): (minX, maxX, minY, maxY) of the map.
+        """
+        entry = (gridMap, tuple(extent))
+        self._Remember(key, entry)
+        if self.cacheDir is None:
+            return
+
+        # write next to the final file and rename, readers never see half an entry
+        fileHandle, tempPath = tempfile.mkstemp(dir=self.cacheDir, suffix=".tmp")
+        header = numpy.zeros(1, dtype=ENTRY_HEADER_DTYPE)
+        header["shape"] = gridMap.shape
+        header["extent"] = extent
+        with os.fdopen(fileHandle, "wb") as fileHandler:
+            fileHandler.write(header.tobytes())
+            fileHandler.write(
+                zlib.compress(
+                    numpy.ascontiguousarray(gridMap, numpy.uint8).tobytes(),
+                    COMPRESSION_LEVEL,
+                )
+            )
+        path = self._GetPath(key)
+        previousSize = os.path.getsize(path) if os.path.exists(path) else 0
+        os.replace(tempPath, path)
+        self.diskBytes += os.path.getsize(path) - previousSize
+        if self.diskBytes > self.maxDiskBytes:
+            self.Evict()
+
+    def Evict(self):
+        """
+        Removes the least recently used entries of the on-disk tier until it
+        fits in maxDiskBytes.
+        """
+        entries = sorted(self._ListDiskEntries())
+        self.diskBytes = sum(size for _, _, size in entries)
+        for _, path, size in entries:
+            if self.diskBytes <= self.maxDiskBytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.diskBytes -= size
+
+    def GetOrCompute(
+        self,
+        ox,
+        oy,
+        xy_resolution,
+        sweepID=None,
+        breshen=True,
+        angularBin=None,
+        maxRange=None,
+    ):
+        """
+        Returns the grid map of a sweep from the cache, ray casting it only on
+        a miss. Takes and returns the same values as
+        lidar_to_grid_map.generate_ray_casting_grid_map().
+        """
+        key = GetGridMapKey(ox, oy, xy_resolution, breshen, angularBin, maxRange)
+        entry = self.Get(key)
+        if entry is None:
+            gridMap, minX, maxX, minY, maxY, _ = (
+                lidar_to_grid_map.generate_ray_casting_grid_map(
+                    ox,
+                    oy,
+                    xy_resolution,
+                    sweepID,
+                    breshen,
+                    angular_bin=angularBin,
+                    max_range=maxRange,
+                )
+            )
+            entry = (EncodeGridMap(gridMap), (minX, maxX, minY, maxY))
+            self.Put(key, *entry)
+        gridMap, (minX, maxX, minY, maxY) = entry
+        return (
+            DecodeGridMap(gridMap, numpy.float64),
+            minX,
+            maxX,
+            minY,
+            maxY,
+            xy_resolution,
+        )
+
+    def GetStats(self):
+        """
+        Returns:
+            dict: Memory hits, disk hits, misses, hit ratio and disk tier size.
+        """
+        lookups = self.memoryHits + self.diskHits + self.misses
+        return {
+            "memoryHits": self.memoryHits,
+            "diskHits": self.diskHits,
+            "misses": self.misses,
+            "hitRatio": (self.memoryHits + self.diskHits) / lookups if lookups else 0.0,
+            "diskBytes": self.diskBytes,
+        }
@@ -3,12 +3,22 @@ __author__ = "Ashesh Vasalya"
 
 import os
 import csv
+import time
+import logging
+import warnings
 import numpy
+from concurrent.futures import ProcessPoolExecutor
 
 import matplotlib.pyplot as plt
 
 from .mapping import lidar_to_grid_map
+from .mapping import global_map
 from . import loghandler
+from . import sweepstore
+from .sweepset import SweepSet
+from .gridcache import DecodeGridMap, EncodeGridMap, GetGridMapKey
+from .profiling import Timed, profiler
+from .projection import ProjectSweepSet, ProjectToLocalFrame, ProjectToWorldFrame
 
 logHandle = loghandler.LogHandler()
 
@@ -21,7 +31,7 @@ def ReadFile(fileName):
         fileName (str): The name of the CSV file to be read.
 
     Returns:
-        csv.reader: A CSV reader object that can be used to iterate over the rows in the file.
+        list: The rows of the file, each row being a list of strings.
 
     Raises:
         AssertionError: If the input filename is None, empty, or invalid.
@@ -34,25 +44,33 @@ def ReadFile(fileName):
     assert os.path.exists(fileName), f"File '{fileName}' not found."
     assert os.path.isfile(fileName), f"'{fileName}' is not a file."
 
-    fileHandler = open(fileName, "r")
-    data = csv.reader(fileHandler)
+    with open(fileName, "r") as fileHandler:
+        data = list(csv.reader(fileHandler))
     return data
 
 
-def GetLidarMeasurementsFromFile(lidarPoints):
+@Timed()
+def GetLidarMeasurementsFromFile(lidarPoints, chunkSize=None, dtype=numpy.float64):
     """
     Reads a lidar measurements file and returns arrays of angles and distances.
 
+    The whole file is parsed in one pass by numpy's CSV reader. When chunkSize is
+    given, the file is parsed chunkSize rows at a time, so that the text of a
+    file larger than RAM never has to be held in memory at once.
+
     Args:
         lidarPoints (str): The name of the file containing the lidar measurements.
+        chunkSize (int): Optional number of rows to parse per chunk.
+        dtype (numpy.dtype): Floating point type of the returned arrays.
 
     Returns:
-        tuple: A tuple of two numpy arrays:
+        tuple: A tuple of two contiguous numpy arrays:
             - angles: an array of the angles at which measurements were taken
             - distances: an array of the distances returned by the lidar for each angle
 
     Raises:
         AssertionError: If the input filename is None, empty, or invalid.
+        AssertionError: If chunkSize is not a positive integer.
     """
 
     # Check if lidarPoints is None or empty
@@ -62,28 +80,79 @@ def GetLidarMeasurementsFromFile(lidarPoints):
     assert os.path.exists(lidarPoints), f"Lidar points file '{lidarPoints}' not found."
     assert os.path.isfile(lidarPoints), f"'{lidarPoints}' is not a file."
 
-    # Read the lidar measurements from the file
-    measurements = ReadFile(lidarPoints)
-
-    # Parse the measurements into angles and distances
-    angles = []
-    distances = []
-    for measurement in measurements:
-        angles.append(float(measurement[0]))
-        distances.append(float(measurement[1]))
-
-    # Convert the angles and distances to numpy arrays
-    angles = numpy.array(angles)
-    distances = numpy.array(distances)
+    if chunkSize is None:
+        # Parse the measurements into an (N, 2) array of angles and distances
+        measurements = numpy.loadtxt(
+            lidarPoints, delimiter=",", dtype=dtype, ndmin=2
+        ).reshape(-1, 2)
+        angles = numpy.ascontiguousarray(measurements[:, 0])
+        distances = numpy.ascontiguousarray(measurements[:, 1])
+    else:
+        anglesList = []
+        distancesList = []
+        for chunkAngles, chunkDistances in IterLidarMeasurementChunks(
+            lidarPoints, chunkSize, dtype
+        ):
+            anglesList.append(chunkAngles)
+            distancesList.append(chunkDistances)
+        angles = numpy.concatenate(anglesList) if anglesList else numpy.empty(0, dtype)
+        distances = (
+            numpy.concatenate(distancesList) if distancesList else numpy.empty(0, dtype)
+        )
 
     logHandle.log.debug(
-        f"In total, the drone collected {len(angles)} samples from all sweeps."
+        "In total, the drone collected %d samples from all sweeps.", len(angles)
     )
+    profiler.Count("samplesParsed", len(angles))
 
     # Return the arrays of angles and distances
     return angles, distances
 
 
+def IterLidarMeasurementChunks(lidarPoints, chunkSize, dtype=numpy.float64):
+    """
+    Reads a lidar measurements file in chunks of rows.
+
+    Args:
+        lidarPoints (str): The name of the file containing the lidar measurements.
+        chunkSize (int): Maximum number of rows to parse per chunk.
+        dtype (numpy.dtype): Floating point type of the yielded arrays.
+
+    Yields:
+        tuple: A tuple of two contiguous numpy arrays (angles, distances) holding
+        at most chunkSize samples each.
+
+    Raises:
+        AssertionError: If the input filename is None, empty, or invalid.
+        AssertionError: If chunkSize is not a positive integer.
+    """
+    assert lidarPoints, "No lidarPoints filename provided."
+    assert os.path.isfile(lidarPoints), f"'{lidarPoints}' is not a file."
+    assert (
+        isinstance(chunkSize, int) and chunkSize > 0
+    ), "chunkSize should be a positive integer"
+
+    with open(lidarPoints, "r") as fileHandler:
+        while True:
+            # numpy warns when the handle is exhausted, which is how we stop
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", UserWarning)
+                measurements = numpy.loadtxt(
+                    fileHandler,
+                    delimiter=",",
+                    dtype=dtype,
+                    ndmin=2,
+                    max_rows=chunkSize,
+                )
+            if measurements.shape[0] == 0:
+                break
+            yield (
+                numpy.ascontiguousarray(measurements[:, 0]),
+                numpy.ascontiguousarray(measurements[:, 1]),
+            )
+
+
+@Timed()
 def GetFlightPathFromFile(flightPath):
     """
     Reads a flight path file and returns arrays of sweep IDs and path coordinates.
@@ -106,7 +175,7 @@ def GetFlightPathFromFile(flightPath):
     assert os.path.exists(flightPath), f"Flight path file '{flightPath}' not found."
     assert os.path.isfile(flightPath), f"'{flightPath}' is not a file."
 
-    logHandle.log.debug(f"Reading flight coordinates from {flightPath}")
+    logHandle.log.debug("Reading flight coordinates from %s", flightPath)
     pathPoints = ReadFile(flightPath)
 
     # Parse the flight path into sweep IDs and path coordinates
@@ -114,12 +183,17 @@ def GetFlightPathFromFile(flightPath):
     for points in pathPoints:
         pointsList.append(points)
 
-    sweepIDs = numpy.array(pointsList[::2], dtype="uint8")[:, 0]
+    sweepIDs = numpy.array(pointsList[::2], dtype="int64")[:, 0]
     pathCoordinates = numpy.array(pointsList[1::2], dtype="float32")
 
+    profiler.Count("posesParsed", len(sweepIDs))
+
     # Print the sweep ID and location for each point in the flight path
-    for sweepID, point in zip(sweepIDs, pathCoordinates):
-        logHandle.log.info(f"At sweep {sweepID}: drone was at coordinates {point}")
+    if logHandle.log.isEnabledFor(logging.INFO):
+        for sweepID, point in zip(sweepIDs, pathCoordinates):
+            logHandle.log.info(
+                "At sweep %d: drone was at coordinates %s", sweepID, point
+            )
 
     # Return the arrays of sweep IDs and path coordinates
     return sweepIDs, pathCoordinates
@@ -152,23 +226,84 @@ def GetUnitConversionScale(inputUnit, outputUnit):
     return unitsDict[outputUnit] / unitsDict[inputUnit]
 
 
+def GetSweepIndexFromMeasurements(angles, distances):
+    """
+    Builds the sweep offset index from the sweep headers of lidar measurements.
+
+    Every sweep in a lidar measurements file starts with a header row
+    "sweepID,numSamples" followed by numSamples "angle,distance" rows. The index
+    is built by walking from one header to the next, so only the header rows
+    are visited and the cost is linear in the number of sweeps. A sample row that
+    happens to look like a header is never mistaken for one, as it is jumped over.
+
+    Args:
+        angles (numpy.ndarray): 1D array of angles in degrees, including header rows.
+        distances (numpy.ndarray): 1D array of distances, including header rows.
+
+    Returns:
+        tuple: A tuple of three numpy arrays of length numSweeps:
+            - sweepIDs: the sweep ID stored in each header
+            - startIndices: index of the first sample of each sweep
+            - numSamples: number of samples in each sweep
+
+    Raises:
+        AssertionError: If a header is malformed or a sweep runs past the end of the data.
+    """
+    numRows = len(angles)
+    sweepIDs = []
+    startIndices = []
+    numSamples = []
+
+    headerIndex = 0
+    while headerIndex < numRows:
+        sweepID = float(angles.item(headerIndex))
+        sweepLength = float(distances.item(headerIndex))
+        assert (
+            sweepID.is_integer() and sweepLength.is_integer()
+        ), "Malformed sweep header at row {}".format(headerIndex)
+        sweepID = int(sweepID)
+        sweepLength = int(sweepLength)
+        assert (
+            headerIndex + sweepLength < numRows
+        ), "Sweep {} at row {} runs past the end of the data".format(
+            sweepID, headerIndex
+        )
+        sweepIDs.append(sweepID)
+        startIndices.append(headerIndex + 1)
+        numSamples.append(sweepLength)
+        headerIndex += sweepLength + 1
+
+    return (
+        numpy.array(sweepIDs, dtype=numpy.int64),
+        numpy.array(startIndices, dtype=numpy.int64),
+        numpy.array(numSamples, dtype=numpy.int64),
+    )
+
+
+@Timed()
 def ExtractSweepsFromMeasurements(angles, distances):
     """
     Extracts lidar sweeps from measurements.
 
+    Sweeps are located with the header driven index of
+    GetSweepIndexFromMeasurements(). The header rows are dropped and the samples
+    are stored back to back in a SweepSet, distances are converted from mm to m in
+    place once for the whole recording, and every sweep is a view into the arrays.
+
     Args:
         angles (numpy.ndarray): 1D array of angles in degrees.
         distances (numpy.ndarray): 1D array of distances.
 
     Returns:
-        lidarSweepsList (list): List[Dict[str, numpy.ndarray]]
-        A list of dictionaries containing the LIDAR sweeps' information.
-        Each dictionary should contain keys "sweepID", "coordinates", "angles", and "distances".
+        lidarSweepsList (SweepSet): The LIDAR sweeps, without coordinates until
+        SetPoses() is called. Each sweep answers the keys "sweepID", "coordinates",
+        "angles", and "distances".
 
     Raises:
         AssertionError: If the input arrays are empty or not 1D.
         AssertionError: If the length of the input arrays do not match.
         AssertionError: If the angles array contains values outside the range [0, 360).
+        AssertionError: If the sweep headers are malformed.
 
     """
 
@@ -181,53 +316,379 @@ def ExtractSweepsFromMeasurements(angles, distances):
     assert len(angles) > 0, "angles array should not be empty"
     assert len(distances) > 0, "distances array should not be empty"
     assert (distances >= 0).all(), "distances should be positive"
-    assert (angles >= 0).all() and (
-        angles <= 360
-    ).all(), "angles should be in the range [0, 360]"
-
-    # statistically extract total samples per sweep
-    allZeroCrossingPoints = numpy.where(numpy.round(angles) == 0)[0]
-    possibleSamplesLength = numpy.diff(allZeroCrossingPoints)
-    sampleBins, sampleValues = numpy.histogram(possibleSamplesLength)
-    numSamples = sampleValues[numpy.argmax(sampleBins)]
-
-    # we rely on the fact that our lidar sensor is not perfect,
-    # and can have few samples more or less per sweep
-    possibleNumSamples = [
-        possibleNumSamples for possibleNumSamples in [-2, -1, 0, 1, 2]
-    ] + numSamples
-
-    numSweeps = 0
-    sweepSamplesLengthList = []
-    for distance in distances:
-        if distance in possibleNumSamples:
+    assert (angles >= 0).all(), "angles should be positive"
+
+    # locate every sweep from the header rows
+    sweepIDs, startIndices, numSamples = GetSweepIndexFromMeasurements(
+        angles, distances
+    )
+    profiler.Count("sweepsSegmented", len(sweepIDs))
+    # the per sweep lines are skipped as a whole on large missions logged at WARNING
+    if logHandle.log.isEnabledFor(logging.INFO):
+        for sweepID, sweepLength in zip(sweepIDs, numSamples):
+            logHandle.log.info("At sweep=%d, numSamples=%d", sweepID, sweepLength)
+
+    logHandle.log.debug("extract each sweep measurement data into one sweep set")
+    if logHandle.log.isEnabledFor(logging.INFO):
+        for sweepID, minIndex, sweepLength in zip(sweepIDs, startIndices, numSamples):
             logHandle.log.info(
-                "At sweep={}, numSamples={}".format(numSweeps, int(distance))
+                "For Sweep=%d data ranges from minIndex:maxIndex %d:%d",
+                sweepID,
+                minIndex,
+                minIndex + sweepLength,
+            )
+
+    # drop the header rows, the samples of consecutive sweeps become contiguous
+    angles = numpy.delete(angles, startIndices - 1)
+    distances = numpy.delete(distances, startIndices - 1).astype(float, copy=False)
+    # only the samples are angles, the header rows hold sweep IDs of any size
+    assert (angles <= 360).all(), "angles should be in the range [0, 360]"
+    sweepOffsets = numpy.concatenate(([0], numpy.cumsum(numSamples)))
+    lidarSweepsList = SweepSet(angles, distances, sweepOffsets, sweepIDs)
+
+    # convert the distances of all sweeps at once, in place
+    lidarSweepsList.ScaleDistances(GetUnitConversionScale("mm", "m"))
+
+    return lidarSweepsList
+
+
+def ConvertToSweepStore(lidarPoints, flightPath, sweepStoreFile):
+    """
+    Converts lidar measurements and flight path CSV files into a binary sweep store.
+
+    The sweep header rows are dropped, the samples of all sweeps are stored back to
+    back as float32 columns with the distances in meters, next to the sweep offset
+    table and the flight path poses.
+
+    Args:
+        lidarPoints (str): The name of the file containing the lidar measurements.
+        flightPath (str): The name of the file containing the flight path.
+        sweepStoreFile (str): The name of the sweep store file to write.
+
+    Raises:
+        AssertionError: If any of the input files is invalid.
+    """
+    poseSweepIDs, poses = GetFlightPathFromFile(flightPath)
+    angles, distances = GetLidarMeasurementsFromFile(lidarPoints)
+    sweepIDs, startIndices, numSamples = GetSweepIndexFromMeasurements(
+        angles, distances
+    )
+
+    # drop the header rows, the samples of consecutive sweeps become contiguous
+    angles = numpy.delete(angles, startIndices - 1)
+    distances = numpy.delete(distances, startIndices - 1)
+    distances *= GetUnitConversionScale("mm", "m")
+    sweepOffsets = numpy.concatenate(([0], numpy.cumsum(numSamples)))
+
+    logHandle.log.debug(
+        "Writing %d sweeps and %d poses to %s",
+        len(sweepIDs),
+        len(poses),
+        sweepStoreFile,
+    )
+    sweepstore.WriteSweepStore(
+        sweepStoreFile, angles, distances, sweepIDs, sweepOffsets, poseSweepIDs, poses
+    )
+
+
+@Timed()
+def GetSweepsFromSweepStore(sweepStoreFile):
+    """
+    Opens a binary sweep store memory-mapped and returns its sweeps.
+
+    Args:
+        sweepStoreFile (str): The name of the sweep store file.
+
+    Returns:
+        lidarSweepsList (SweepSet): The sweeps, answering the keys "sweepID",
+        "coordinates", "angles" and "distances". Angles and distances are
+        memory-mapped views into the file.
+
+    Raises:
+        AssertionError: If the file does not exist or is not a sweep store file.
+    """
+    store = sweepstore.OpenSweepStore(sweepStoreFile)
+    logHandle.log.debug(
+        "Opened %s: %d sweeps, %d samples.",
+        sweepStoreFile,
+        store.numSweeps,
+        store.numSamples,
+    )
+
+    lidarSweepsList = SweepSet(
+        store.angles, store.distances, store.sweepOffsets, store.sweepIDs
+    )
+
+    # Combine sweepID and drone position, like task1 does for CSV files
+    lidarSweepsList.SetPoses(store.poseSweepIDs, store.poses)
+
+    return lidarSweepsList
+
+
+@Timed()
+def FuseSweepsIntoGlobalMap(lidarSweepsList, xy_resolution=0.05, angularBin=None):
+    """
+    Ray casts every sweep from its flight path position and fuses them into one
+    global occupancy map.
+
+    Args:
+        lidarSweepsList (SweepSet): The sweeps, or a list of dictionaries with the
+        keys "coordinates", "angles" and "distances".
+        xy_resolution (float): Resolution of the global map in meters.
+        angularBin (float): If set, only the farthest sample of every angular bin
+        of that many degrees is ray cast.
+
+    Returns:
+        global_map.GlobalOccupancyMap: The fused map, sized to hold every sweep.
+
+    Raises:
+        AssertionError: If lidarSweepsList is empty or a sweep has no coordinates.
+    """
+    assert len(lidarSweepsList) > 0, "lidarSweepsList should not be empty"
+    lidarSweepsList = SweepSet.FromSweeps(lidarSweepsList)
+    assert not numpy.isnan(
+        lidarSweepsList.poses
+    ).any(), "every sweep should have coordinates"
+
+    # size the map to the bounding box of all sweeps in world coordinates
+    maxDistances = lidarSweepsList.GetMaxDistances()
+    minX, minY = (lidarSweepsList.poses - maxDistances[:, None]).min(axis=0)
+    maxX, maxY = (lidarSweepsList.poses + maxDistances[:, None]).max(axis=0)
+    margin = lidar_to_grid_map.EXTEND_AREA / 2.0
+    globalMap = global_map.GlobalOccupancyMap(
+        minX - margin,
+        minY - margin,
+        maxX + margin,
+        maxY + margin,
+        xy_resolution,
+        angular_bin=angularBin,
+    )
+
+    for sweep in lidarSweepsList:
+        with profiler.Timer("GlobalOccupancyMap.add_sweep", sweep.sweepID):
+            numCells = globalMap.add_sweep(
+                sweep["angles"], sweep["distances"], sweep["coordinates"]
             )
-            numSweeps += 1
-            sweepSamplesLengthList.append(int(distance))
-    sweepSamplesLengthList = numpy.array(sweepSamplesLengthList)
-
-    logHandle.log.debug("extract each sweep measurement data and create list per sweep")
-    lidarSweepsList = []
-    for sweepID in range(numSweeps):
-        minIndex = (
-            sweepSamplesLengthList[:sweepID].sum() + sweepID + 1 if sweepID > 0 else 0
+        logHandle.log.debug(
+            "Fused sweepID=%d into the global map, %d cells updated",
+            sweep.get("sweepID"),
+            numCells,
         )
-        maxIndex = sweepSamplesLengthList[: (sweepID + 1)].sum() + sweepID + 1
-        logHandle.log.info(
-            "For Sweep={} data ranges from minIndex:maxIndex {}:{}".format(
-                sweepID, minIndex, maxIndex
+
+    return globalMap
+
+
+def DrawGlobalMap(fig, ax, globalMap):
+    """
+    Draws the occupancy probability of a global map into a matplotlib axes,
+    interactive or not.
+
+    Args:
+        fig (matplotlib.figure.Figure): The figure holding the axes, for the colorbar.
+        ax (matplotlib.axes.Axes): The axes to draw into.
+        globalMap (global_map.GlobalOccupancyMap): The map to draw.
+    """
+    minX, maxX, minY, maxY = globalMap.extent()
+    image = ax.imshow(
+        globalMap.probability().T,
+        origin="lower",
+        extent=(minX, maxX, minY, maxY),
+        cmap="RdYlGn_r",
+        vmin=0.0,
+        vmax=1.0,
+    )
+    fig.colorbar(image, ax=ax)
+    ax.set_xlabel("X")
+    ax.set_ylabel("Y")
+    ax.set_title("Global occupancy map of {} sweeps".format(globalMap.num_sweeps))
+
+
+def VisualizeGlobalMap(globalMap, show=False, dumpViz=False):
+    """
+    Visualizes the occupancy probability of a global map.
+
+    Args:
+        globalMap (global_map.GlobalOccupancyMap): The map to visualize.
+        show (bool): If True, show the visualization window.
+        dumpViz (bool): If True, dump the visualization to disk.
+    """
+    if show:
+        logHandle.log.debug("Visualizing the global occupancy map")
+        fig, ax = plt.subplots(figsize=(10, 8))
+        DrawGlobalMap(fig, ax, globalMap)
+        fig.canvas.draw_idle()
+        plt.pause(0.001)
+        if dumpViz:
+            plt.savefig(os.path.join("output", "globalMap.png"))
+
+        input("Press [enter] to exit.")
+
+
+def GetSweepPointsInSensorFrame(sweep):
+    """
+    Converts the angles and distances of one sweep to x, y coordinates around
+    the lidar, as used by the grid map.
+
+    Args:
+        sweep (dict): A dictionary with the keys "angles" in degrees and "distances".
+
+    Returns:
+        tuple: (ox, oy) 1D arrays of the coordinates of every sample.
+    """
+    points = ProjectToLocalFrame(sweep["angles"], sweep["distances"])
+    return points[:, 0], points[:, 1]
+
+
+def _ComputeGridMaps(tasks):
+    """
+    Computes the grid maps of several sweeps, in a worker process of
+    ComputeGridMaps(). Fixed extent maps are all ray cast into one buffer,
+    allocated once.
+
+    Args:
+        tasks (list): (sweepID, ox, oy, xy_resolution, breshen, angularBin,
+        maxRange) tuples, of the same xy_resolution and maxRange.
+
+    Returns:
+        list: (gridMap, extent, seconds) compact grid map of every sweep, see
+        ComputeGridMaps(), and the time spent ray casting it.
+    """
+    computed = []
+    buffer = None
+    for sweepID, ox, oy, xy_resolution, breshen, angularBin, maxRange in tasks:
+        if maxRange is not None and buffer is None:
+            _, _, _, _, xW, yW = lidar_to_grid_map.calc_fixed_grid_map_config(
+                maxRange, xy_resolution
+            )
+            buffer = numpy.empty((xW, yW))
+        start = time.perf_counter()
+        gridMap, minX, maxX, minY, maxY, _ = (
+            lidar_to_grid_map.generate_ray_casting_grid_map(
+                ox,
+                oy,
+                xy_resolution,
+                sweepID,
+                breshen,
+                angular_bin=angularBin,
+                max_range=maxRange,
+                out=buffer,
             )
         )
+        seconds = time.perf_counter() - start
+        computed.append((EncodeGridMap(gridMap), (minX, maxX, minY, maxY), seconds))
+    return computed
 
-        sweepDataDict = {}
-        sweepDataDict["angles"] = angles[minIndex:maxIndex]
-        unitConversionFactor = GetUnitConversionScale("mm", "m")
-        sweepDataDict["distances"] = distances[minIndex:maxIndex] * unitConversionFactor
-        lidarSweepsList.append(sweepDataDict)
 
-    return lidarSweepsList
+@Timed()
+def ComputeGridMaps(
+    lidarSweepsList,
+    xy_resolution=0.01,
+    breshen=True,
+    jobs=1,
+    cache=None,
+    angularBin=None,
+    maxRange=None,
+):
+    """
+    Computes the grid map of every sweep, distributing the sweeps across a
+    pool of worker processes.
+
+    The maps are returned as compact uint8 arrays, 0 free, 1 unknown and 2
+    occupied, 8 times smaller than the float64 maps to send back from the
+    workers. DecodeGridMap() converts them back to occupancy values.
+
+    Args:
+        lidarSweepsList (list): List of dictionaries with the keys "angles" and
+        "distances".
+        xy_resolution (float): Resolution of the grid maps.
+        breshen (bool): If True use bresenham ray casting, else flood fill.
+        jobs (int): Number of worker processes, 1 computes the maps in this
+        process and None uses one process per CPU.
+        cache (gridcache.GridMapCache): Optional cache, only the sweeps it
+        misses are ray cast, and their maps are added to it.
+        angularBin (float): If set, only the farthest sample of every angular bin
+        of that many degrees is ray cast.
+        maxRange (float): If set, every map has the same extent centered on the
+        lidar, holding the samples up to maxRange, the farther samples being
+        clipped to it. Each process then ray casts into one reused buffer.
+
+    Returns:
+        list: One dictionary per sweep, in the order of lidarSweepsList, with
+        the keys "sweepID", "gridMap" and "extent" (minX, maxX, minY, maxY).
+
+    Raises:
+        AssertionError: If lidarSweepsList is empty or jobs is not positive.
+    """
+    assert len(lidarSweepsList) > 0, "lidarSweepsList should not be empty"
+    assert jobs is None or jobs > 0, "jobs should be a positive integer or None"
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+
+    # project all sweeps at once, each task holds views of its own points
+    lidarSweepsList = SweepSet.FromSweeps(lidarSweepsList)
+    points = ProjectSweepSet(lidarSweepsList)
+    tasks = [
+        (
+            sweep.sweepID,
+            sweepPoints[:, 0],
+            sweepPoints[:, 1],
+            xy_resolution,
+            breshen,
+            angularBin,
+            maxRange,
+        )
+        for sweep, sweepPoints in zip(
+            lidarSweepsList, numpy.split(points, lidarSweepsList.offsets[1:-1])
+        )
+    ]
+    entries = [None] * len(tasks)
+    if cache is not None:
+        keys = [
+            GetGridMapKey(ox, oy, xy_resolution, breshen, angularBin, maxRange)
+            for _, ox, oy, _, _, _, _ in tasks
+        ]
+        entries = [cache.Get(key) for key in keys]
+    missing = [index for index, entry in enumerate(entries) if entry is None]
+    profiler.Count("gridMapsFromCache", len(tasks) - len(missing))
+
+    jobs = max(1, min(jobs, len(missing)))
+    logHandle.log.debug(
+        "Computing %d of %d grid maps with %d process(es)",
+        len(missing),
+        len(tasks),
+        jobs,
+    )
+    if jobs == 1:
+        computed = _ComputeGridMaps([tasks[index] for index in missing])
+    else:
+        # a few sweeps per task amortizes the inter process round trips
+        chunkSize = max(1, len(missing) // (jobs * 4))
+        chunks = [
+            [tasks[index] for index in missing[start : start + chunkSize]]
+            for start in range(0, len(missing), chunkSize)
+        ]
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            computed = [
+                gridMap
+                for chunk in executor.map(_ComputeGridMaps, chunks)
+                for gridMap in chunk
+            ]
+
+    for index, (gridMap, extent, seconds) in zip(missing, computed):
+        entries[index] = (gridMap, extent)
+        if cache is not None:
+            cache.Put(keys[index], gridMap, extent)
+        if profiler.enabled:
+            sweepID = tasks[index][0]
+            profiler.AddTime("generate_ray_casting_grid_map", seconds, sweepID)
+            profiler.Count("beamsCast", len(tasks[index][1]), sweepID)
+            # every cell of the map that is no longer unknown
+            profiler.Count("cellsTouched", numpy.count_nonzero(gridMap != 1), sweepID)
+
+    return [
+        {"sweepID": task[0], "gridMap": gridMap, "extent": extent}
+        for task, (gridMap, extent) in zip(tasks, entries)
+    ]
 
 
 def VisualizeMeasurementsPerSweep(
@@ -236,6 +697,9 @@ def VisualizeMeasurementsPerSweep(
     xy_resolution=0.01,
     show=False,
     dumpViz=False,
+    jobs=1,
+    cache=None,
+    maxRange=None,
 ):
     """
     Visualizes lidar measurements per sweep.
@@ -247,6 +711,10 @@ def VisualizeMeasurementsPerSweep(
         xy_resolution (float): Resolution of the grid map.
         show (bool): Whether or not to display the generated plots.
         dumpViz (bool): If True, save the visualization to a file.
+        jobs (int): Number of processes computing the grid maps, see ComputeGridMaps().
+        cache (gridcache.GridMapCache): Optional cache of the grid maps.
+        maxRange (float): Optional max range of fixed extent grid maps, see
+        ComputeGridMaps().
 
     Raises:
         AssertionError: If lidarSweepsList is empty or not a list.
@@ -255,8 +723,8 @@ def VisualizeMeasurementsPerSweep(
 
     """
     assert (
-        isinstance(lidarSweepsList, list) and len(lidarSweepsList) > 0
-    ), "lidarSweepsList should be a non-empty list"
+        isinstance(lidarSweepsList, (list, SweepSet)) and len(lidarSweepsList) > 0
+    ), "lidarSweepsList should be a non-empty list or SweepSet"
     assert (
         isinstance(sampling, int) and sampling > 0
     ), "sampling should be a positive integer"
@@ -264,29 +732,24 @@ def VisualizeMeasurementsPerSweep(
         isinstance(xy_resolution, float) and xy_resolution > 0
     ), "xy_resolution should be a positive float"
 
-    numSweeps = len(lidarSweepsList)
-
-    for sweepID in range(numSweeps):
-        logHandle.log.debug(
-            "Computing lidar measurements and occupancy map from sweepID={}".format(
-                sweepID
-            )
-        )
-        # convert the Lidar measurements to x, y coordinates
-        angles = lidarSweepsList[sweepID]["angles"] * (numpy.pi / 180)
-        distances = lidarSweepsList[sweepID]["distances"]
-        ox = (distances) * numpy.sin(angles)
-        oy = (distances) * numpy.cos(angles)
+    # compute all grid maps first, the sweeps are independent of each other
+    gridMaps = ComputeGridMaps(
+        lidarSweepsList, xy_resolution, True, jobs, cache, maxRange=maxRange
+    )
 
-        gridMap = lidar_to_grid_map.generate_ray_casting_grid_map(
-            ox, oy, xy_resolution, sweepID, True
-        )[0]
+    lidarSweepsList = SweepSet.FromSweeps(lidarSweepsList)
+    points = numpy.split(
+        ProjectSweepSet(lidarSweepsList), lidarSweepsList.offsets[1:-1]
+    )
+    for sweepID in range(len(lidarSweepsList)):
+        ox, oy = points[sweepID][:, 0], points[sweepID][:, 1]
+        gridMap = DecodeGridMap(gridMaps[sweepID]["gridMap"])
 
         if show:
+            profiler.Count("framesRendered", sweepID=sweepID)
             logHandle.log.info(
-                "Preparing visualizing grid map and Lidar Measurement map of sweepID={}".format(
-                    sweepID
-                )
+                "Preparing visualizing grid map and Lidar Measurement map of sweepID=%d",
+                sweepID,
             )
             fig = plt.figure(sweepID, figsize=(10, 5))
             plt.subplot(121)
@@ -315,6 +778,61 @@ def VisualizeMeasurementsPerSweep(
         input("Press [enter] to continue or exit.")
 
 
+@Timed()
+def DrawAllSweepsWithDronePath(ax, lidarSweepsList, sampling=2):
+    """
+    Draws all the LIDAR sweeps in the given list along with the drone's flight
+    path into a matplotlib axes, interactive or not.
+
+    Args:
+        ax (matplotlib.axes.Axes): The axes to draw into.
+        lidarSweepsList (list): List of LiDAR sweep dictionaries.
+        sampling (int): Downsample factor for lidar sweep visualization.
+    """
+    randomState = numpy.random.RandomState(3)
+    lidarSweepsList = SweepSet.FromSweeps(lidarSweepsList)
+    points = numpy.split(
+        ProjectSweepSet(lidarSweepsList, "world"), lidarSweepsList.offsets[1:-1]
+    )
+    for sweepID in range(len(lidarSweepsList)):
+        position = lidarSweepsList[sweepID]["coordinates"]
+        # Plot the LIDAR data
+        x, y = points[sweepID][::sampling].T
+        ax.plot(x, y, "ro", linewidth=2, markersize=1)
+
+        # Plot the drone position
+        color = tuple(
+            (randomState.random(), randomState.random(), randomState.random())
+        )
+        ax.plot(position[0], position[1], color=color, marker="o")
+        ax.annotate(
+            f"P:{sweepID}",
+            xy=position,
+            xytext=(-20, 20),
+            textcoords="offset points",
+            ha="center",
+            va="bottom",
+        )
+
+        # Connect wayPoints
+        if sweepID > 0:
+            startPos = lidarSweepsList[sweepID - 1]["coordinates"]
+            endPos = position
+            ax.plot(
+                [startPos[0], endPos[0]],
+                [startPos[1], endPos[1]],
+                color=color,
+            )
+
+    # Add labels and legend
+    ax.set_xlabel("X")
+    ax.set_ylabel("Y")
+    ax.set_xlim((0, 25))
+    ax.set_ylim((-15, 30))
+    ax.set_title("Drone Path and LIDAR Data")
+    ax.legend(["LIDAR data"])
+
+
 def VisualizeAllSweepsWithDronePath(
     lidarSweepsList,
     sampling=2,
@@ -333,47 +851,7 @@ def VisualizeAllSweepsWithDronePath(
     if show:
         logHandle.log.debug("Visualizing all flight path and all sweeps measurements")
         fig, ax = plt.subplots(figsize=(15, 8))
-        randomState = numpy.random.RandomState(3)
-        for sweepID in range(len(lidarSweepsList)):
-            position = lidarSweepsList[sweepID]["coordinates"]
-            angles = lidarSweepsList[sweepID]["angles"] * (numpy.pi / 180)
-            distances = lidarSweepsList[sweepID]["distances"]
-            # Plot the LIDAR data
-            x = position[0] + distances[::sampling] * numpy.cos(angles[::sampling])
-            y = position[1] + distances[::sampling] * numpy.sin(angles[::sampling])
-            ax.plot(x, y, "ro", linewidth=2, markersize=1)
-
-            # Plot the drone position
-            color = tuple(
-                (randomState.random(), randomState.random(), randomState.random())
-            )
-            ax.plot(position[0], position[1], color=color, marker="o")
-            ax.annotate(
-                f"P:{sweepID}",
-                xy=position,
-                xytext=(-20, 20),
-                textcoords="offset points",
-                ha="center",
-                va="bottom",
-            )
-
-            # Connect wayPoints
-            if sweepID > 0:
-                startPos = lidarSweepsList[sweepID - 1]["coordinates"]
-                endPos = position
-                ax.plot(
-                    [startPos[0], endPos[0]],
-                    [startPos[1], endPos[1]],
-                    color=color,
-                )
-
-        # Add labels and legend
-        ax.set_xlabel("X")
-        ax.set_ylabel("Y")
-        ax.set_xlim((0, 25))
-        ax.set_ylim((-15, 30))
-        ax.set_title("Drone Path and LIDAR Data")
-        ax.legend(["LIDAR data"])
+        DrawAllSweepsWithDronePath(ax, lidarSweepsList, sampling)
         fig.canvas.draw_idle()
         plt.pause(0.001)
         if dumpViz:
@@ -407,6 +885,10 @@ def VisualizeRandomFlightPathAndSweep(positions, angles, distances, sampling=6):
     fig, ax = plt.subplots(figsize=(15, 8))
 
     logHandle.log.info("preparing to plot flight path and sweep measurements.")
+    offsets = numpy.concatenate(([0], numpy.cumsum([len(sweep) for sweep in angles])))
+    points = ProjectToWorldFrame(
+        numpy.concatenate(angles), numpy.concatenate(distances), positions, offsets
+    )
     randomState = numpy.random.RandomState(3)
     for index, position in enumerate(positions):
         color = tuple(
@@ -414,12 +896,7 @@ def VisualizeRandomFlightPathAndSweep(positions, angles, distances, sampling=6):
         )
 
         # Plot the LIDAR data
-        xPos = position[0] + distances[index][::sampling] * numpy.cos(
-            angles[index][::sampling]
-        )
-        yPos = position[1] + distances[index][::sampling] * numpy.sin(
-            angles[index][::sampling]
-        )
+        xPos, yPos = points[offsets[index] : offsets[index + 1] : sampling].T
         ax.scatter(xPos, yPos, color=color, marker="o", linewidths=1)
 
         # Plot the drone position
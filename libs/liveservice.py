@@ -0,0 +1,518 @@
+#!/usr/bin/env python3
+__author__ = "Ashesh Vasalya"
+
+import os
+import json
+import time
+import asyncio
+import numpy
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from .lidarutils import logHandle
+from .sweepstream import IterLinesFromStream, SweepAssembler
+from .mapping import global_map
+from .mapping.ray_query import expected_ranges
+from .mapping.distance_field import DistanceField
+
+""" Live ingestion service fusing streamed sweeps into a running occupancy map.
+
+    Clients connect over a local TCP or Unix socket and send the LIDARPoints
+    format, "sweepID,numSamples" header lines followed by "angle,distance"
+    sample lines, segmented into sweeps as the lines arrive. Complete sweeps
+    wait in a bounded queue, are ray cast from their flight path position in an
+    executor, off the event loop, and fused into a tiled GlobalOccupancyMap
+    that grows with the flight. The map is only read and written from one map
+    thread, which fuses the traces and answers the map requests, so neither
+    blocks the event loop, and the distance field of the ranges requests is
+    only updated over the cells the sweeps fused since the last one touched. When sweeps arrive faster than they are fused,
+    the "drop" overflow policy drops the oldest queued sweep, which bounds the
+    ingestion latency to the queue size, while "block" stops reading from the
+    senders, whose writes then wait on the socket.
+
+    Any line starting with "{" is a JSON request, answered with one JSON line:
+    {"command": "stats"} ingestion counters and latencies.
+    {"command": "flush"} the same, once the sweeps sent before are fused.
+    {"command": "snapshot"} the map, its "shape", "extent" and "bytes", the
+        answer line being followed by that many uint8 occupancy bytes.
+    {"command": "occupancy", "points": [[x, y], ...]} probabilities at points.
+    {"command": "ranges", "poses": [[x, y, heading], ...], "angles": [...],
+        "maxRange": 10.0} expected ranges, angles in degrees as in the sweeps,
+        the heading in degrees being added to them.
+
+    Example usage:
+    from liveservice import LiveMapService, OpenServiceConnection, ReplayLidarPoints
+    service = LiveMapService(poses=dict(zip(sweepIDs.tolist(), pathCoordinates)))
+    host, port = await service.Start(port=5800)
+    reader, writer = await OpenServiceConnection(port=5800)
+    await ReplayLidarPoints("LIDARPoints.csv", writer, rate=10.0, speed=2.0)
+    probability, extent, numSweeps = await RequestSnapshot(reader, writer)
+"""
+
+OVERFLOW_POLICIES = ("drop", "block")
+# occupancy probability of the cells that stop the beams of a ranges request
+OCCUPIED_PROBABILITY = 0.5
+OCCUPIED_LOG_ODDS = global_map.probability_to_log_odds(OCCUPIED_PROBABILITY)
+# latencies kept for the statistics
+LATENCY_WINDOW = 1024
+# longest line the service reads, and the longest answer line a client reads
+MAX_LINE_BYTES = 2**20
+MAX_RESPONSE_BYTES = 2**28
+
+
+class LiveMapService:
+    """
+    Asyncio server ingesting sweeps into a running occupancy map and answering
+    map requests.
+    """
+
+    def __init__(
+        self,
+        poses=None,
+        xy_resolution=0.05,
+        angularBin=None,
+        queueSize=8,
+        overflow="drop",
+        jobs=1,
+        tileSize=64,
+    ):
+        """
+        Args:
+            poses (dict): Mapping of sweepID to drone coordinates, sweeps without
+            a pose are counted but not fused.
+            xy_resolution (float): Resolution of the map in meters.
+            angularBin (float): If set, only the farthest sample of every angular
+            bin of that many degrees is ray cast.
+            queueSize (int): Complete sweeps waiting to be fused.
+            overflow (str): "drop" the oldest queued sweep when the queue is
+            full, or "block" the senders until there is room.
+            jobs (int): Sweeps ray cast at once, 1 in a worker thread, more in
+            that many processes, None uses one process per CPU.
+            tileSize (int): Cells per side of the tiles of the map.
+
+        Raises:
+            AssertionError: If overflow is not one of OVERFLOW_POLICIES.
+        """
+        assert overflow in OVERFLOW_POLICIES, "overflow should be one of {}".format(
+            OVERFLOW_POLICIES
+        )
+        assert queueSize > 0, "queueSize should be positive"
+        self.poses = poses or {}
+        self.queueSize = queueSize
+        self.overflow = overflow
+        self.globalMap = global_map.GlobalOccupancyMap(
+            0.0,
+            0.0,
+            xy_resolution,
+            xy_resolution,
+            xy_resolution,
+            tile_size=tileSize,
+            angular_bin=angularBin,
+        )
+        self.jobs = jobs or os.cpu_count() or 1
+        if self.jobs == 1:
+            self.executor = ThreadPoolExecutor(max_workers=1)
+        else:
+            self.executor = ProcessPoolExecutor(max_workers=self.jobs)
+        # the only thread touching the map
+        self.mapExecutor = ThreadPoolExecutor(max_workers=1)
+        self.stats = {
+            "sweepsReceived": 0,
+            "sweepsFused": 0,
+            "sweepsDropped": 0,
+            "sweepsUnplaced": 0,
+            "malformedLines": 0,
+            "lastSweepID": None,
+        }
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.queue = None
+        self.server = None
+        self.consumers = []
+        # connected clients, by the task handling them
+        self.clients = {}
+        # distance field of the ranges requests, the index of its first cell,
+        # the cell bounds the traces fused since its last update touched, and
+        # the obstacles and distances it gave
+        self._distanceField = None
+        self._fieldOrigin = None
+        self._touched = None
+        self._rangeMap = None
+
+    async def Start(self, host="127.0.0.1", port=0, path=None):
+        """
+        Starts listening and fusing.
+
+        Args:
+            host (str): Address of the TCP socket, local only by default.
+            port (int): Port of the TCP socket, 0 picks a free one.
+            path (str): If set, listen on this Unix socket instead.
+
+        Returns:
+            The address the service listens on.
+        """
+        self.queue = asyncio.Queue(self.queueSize)
+        self.consumers = [
+            asyncio.ensure_future(self._Consume()) for _ in range(self.jobs)
+        ]
+        if path:
+            self.server = await asyncio.start_unix_server(
+                self._HandleClient, path=path, limit=MAX_LINE_BYTES
+            )
+        else:
+            self.server = await asyncio.start_server(
+                self._HandleClient, host, port, limit=MAX_LINE_BYTES
+            )
+        address = self.server.sockets[0].getsockname()
+        logHandle.log.info("Live map service listening on %s", address)
+        return address
+
+    async def Stop(self, drain=True):
+        """
+        Stops listening, fuses the queued sweeps if drain, and stops the workers.
+        """
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+        # closing the connections ends the reads of their handlers
+        for writer in self.clients.values():
+            writer.close()
+        await asyncio.gather(*self.clients, return_exceptions=True)
+        if drain and self.queue is not None:
+            await self.queue.join()
+        for consumer in self.consumers:
+            consumer.cancel()
+        await asyncio.gather(*self.consumers, return_exceptions=True)
+        self.consumers = []
+        self.executor.shutdown()
+        self.mapExecutor.shutdown()
+
+    async def Serve(self, host="127.0.0.1", port=0, path=None, statsInterval=None):
+        """
+        Starts the service and serves until cancelled, logging the statistics
+        every statsInterval seconds if set.
+        """
+        await self.Start(host, port, path)
+        try:
+            while True:
+                await asyncio.sleep(statsInterval or 3600)
+                if statsInterval:
+                    logHandle.log.info("Live map service %s", self.GetStats())
+        finally:
+            await self.Stop(drain=False)
+
+    def GetStats(self):
+        """
+        Returns:
+            dict: The ingestion counters, the queue depth, and the mean and max
+            seconds from the arrival of a sweep to its fusion.
+        """
+        stats = dict(self.stats)
+        stats["queueDepth"] = self.queue.qsize() if self.queue is not None else 0
+        stats["latencyMean"] = (
+            float(numpy.mean(self.latencies)) if self.latencies else None
+        )
+        stats["latencyMax"] = float(max(self.latencies)) if self.latencies else None
+        return stats
+
+    async def _HandleClient(self, reader, writer):
+        """
+        Segments the sweeps streamed by a client and answers its requests.
+        """
+        assembler = SweepAssembler(self.poses)
+        task = asyncio.current_task()
+        self.clients[task] = writer
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    text = line.decode().strip()
+                except ValueError as error:
+                    # a line over the limit of the reader, or not text, is lost
+                    logHandle.log.warning("Unreadable line: %s", error)
+                    self.stats["malformedLines"] += 1
+                    assembler.SkipLine()
+                    continue
+                await self._HandleLine(text, assembler, writer)
+            for sweep in assembler.Flush():
+                await self._Enqueue(sweep)
+        except ConnectionError as error:
+            logHandle.log.warning("Client connection lost: %s", error)
+        finally:
+            if assembler.sweepID is not None:
+                logHandle.log.warning(
+                    "Client left in the middle of sweep=%s", assembler.sweepID
+                )
+            self.clients.pop(task, None)
+            writer.close()
+
+    async def _HandleLine(self, text, assembler, writer):
+        """
+        Answers a JSON request line, or pushes a sample or header line to the
+        assembler of the client and queues the sweep it completes.
+        """
+        if text.startswith("{"):
+            await self._HandleRequest(text, writer)
+            return
+        try:
+            sweep = assembler.PushLine(text)
+        except (AssertionError, ValueError) as error:
+            # the assembler drops the sweep, or looks for the next header
+            logHandle.log.warning("Malformed line '%.80s': %s", text, error)
+            self.stats["malformedLines"] += 1
+            return
+        if sweep is not None:
+            await self._Enqueue(sweep)
+
+    async def _Enqueue(self, sweep):
+        sweep["received"] = time.monotonic()
+        self.stats["sweepsReceived"] += 1
+        if self.overflow == "block":
+            await self.queue.put(sweep)
+            return
+        if self.queue.full():
+            dropped = self.queue.get_nowait()
+            self.queue.task_done()
+            self.stats["sweepsDropped"] += 1
+            logHandle.log.debug("Queue full, dropped sweep=%d", dropped["sweepID"])
+        self.queue.put_nowait(sweep)
+
+    async def _Consume(self):
+        """
+        Ray casts the queued sweeps in the executor and fuses them into the map.
+        """
+        loop = asyncio.get_event_loop()
+        globalMap = self.globalMap
+        while True:
+            sweep = await self.queue.get()
+            try:
+                if sweep["coordinates"] is None:
+                    self.stats["sweepsUnplaced"] += 1
+                    continue
+                trace = await loop.run_in_executor(
+                    self.executor,
+                    global_map.trace_sweep,
+                    sweep["angles"],
+                    sweep["distances"],
+                    sweep["coordinates"],
+                    globalMap.min_x,
+                    globalMap.min_y,
+                    globalMap.xy_resolution,
+                    globalMap.angular_bin,
+                )
+                await loop.run_in_executor(self.mapExecutor, self._ApplyTrace, trace)
+                self.stats["sweepsFused"] += 1
+                self.stats["lastSweepID"] = sweep["sweepID"]
+                self.latencies.append(time.monotonic() - sweep["received"])
+            except Exception as error:
+                logHandle.log.error(
+                    "Failed to fuse sweep=%d: %s", sweep["sweepID"], error
+                )
+            finally:
+                self.queue.task_done()
+
+    async def _HandleRequest(self, text, writer):
+        loop = asyncio.get_event_loop()
+        payload = b""
+        try:
+            request = json.loads(text)
+            command = request.get("command")
+            if command == "stats":
+                response = self.GetStats()
+            elif command == "flush":
+                # the sweeps sent before the request are queued, wait for them
+                await self.queue.join()
+                response = self.GetStats()
+            elif command == "snapshot":
+                response, payload = await loop.run_in_executor(
+                    self.mapExecutor, self._Snapshot
+                )
+            elif command == "occupancy":
+                response = await loop.run_in_executor(
+                    self.mapExecutor, self._Occupancy, request["points"]
+                )
+            elif command == "ranges":
+                rangeMap = await loop.run_in_executor(
+                    self.mapExecutor, self._GetRangeMap
+                )
+                # the ray queries run on copies, without holding the map thread
+                response = await loop.run_in_executor(
+                    None,
+                    self._Ranges,
+                    rangeMap,
+                    request["poses"],
+                    request["angles"],
+                    request["maxRange"],
+                )
+            else:
+                response = {"error": "unknown command {}".format(command)}
+        except (ValueError, KeyError, TypeError, AttributeError) as error:
+            response = {"error": "malformed request: {}".format(error)}
+        writer.write(json.dumps(response).encode() + b"\n" + payload)
+        await writer.drain()
+
+    def _ApplyTrace(self, trace):
+        """
+        Fuses a traced sweep, on the map thread, and extends the cell bounds
+        touched since the last update of the distance field.
+        """
+        self.globalMap.apply_trace(trace)
+        cells = numpy.hstack(trace[:2])
+        if cells.size == 0:
+            return
+        low, high = cells.min(axis=1), cells.max(axis=1) + 1
+        if self._touched is not None:
+            low = numpy.minimum(low, self._touched[0])
+            high = numpy.maximum(high, self._touched[1])
+        self._touched = (low, high)
+
+    def _Snapshot(self):
+        logOdds, minX, minY = self.globalMap.dense_log_odds()
+        probability = 1.0 - 1.0 / (1.0 + numpy.exp(logOdds / global_map.LOG_ODDS_SCALE))
+        encoded = numpy.rint(probability * 255).astype(numpy.uint8)
+        resolution = self.globalMap.xy_resolution
+        response = {
+            "shape": list(encoded.shape),
+            "extent": [
+                minX,
+                minX + encoded.shape[0] * resolution,
+                minY,
+                minY + encoded.shape[1] * resolution,
+            ],
+            "numSweeps": self.globalMap.num_sweeps,
+            "bytes": encoded.nbytes,
+        }
+        return response, encoded.tobytes()
+
+    def _Occupancy(self, points):
+        points = numpy.asarray(points, dtype=numpy.float64).reshape(-1, 2)
+        values = self.globalMap.log_odds_at(points[:, 0], points[:, 1])
+        probability = 1.0 - 1.0 / (1.0 + numpy.exp(values / global_map.LOG_ODDS_SCALE))
+        return {"probabilities": probability.tolist()}
+
+    def _GetRangeMap(self):
+        """
+        Brings the distance field in step with the map, on the map thread,
+        only over the cells touched since its last update unless the map grew.
+
+        Returns:
+            tuple: (occupied, minX, minY, distances) copies of the obstacles and
+            of their distance field, and the world coordinates of their first cell.
+        """
+        numSweeps = self.globalMap.num_sweeps
+        if self._rangeMap is not None and self._rangeMap[0] == numSweeps:
+            return self._rangeMap[1:]
+        logOdds, minX, minY = self.globalMap.dense_log_odds()
+        resolution = self.globalMap.xy_resolution
+        origin = numpy.rint(
+            [
+                (minX - self.globalMap.min_x) / resolution,
+                (minY - self.globalMap.min_y) / resolution,
+            ]
+        ).astype(numpy.int64)
+        field = self._distanceField
+        if (
+            field is None
+            or field.occupied.shape != logOdds.shape
+            or (origin != self._fieldOrigin).any()
+        ):
+            field = DistanceField(logOdds, resolution, OCCUPIED_LOG_ODDS)
+            self._distanceField = field
+            self._fieldOrigin = origin
+        elif self._touched is not None:
+            low = numpy.clip(self._touched[0] - origin, 0, logOdds.shape)
+            high = numpy.clip(self._touched[1] - origin, 0, logOdds.shape)
+            field.update(logOdds, (low[0], high[0], low[1], high[1]))
+        self._touched = None
+        rangeMap = (field.occupied.copy(), minX, minY, field.distances)
+        self._rangeMap = (numSweeps,) + rangeMap
+        return rangeMap
+
+    def _Ranges(self, rangeMap, poses, angles, maxRange):
+        occupied, minX, minY, distances = rangeMap
+        poses = numpy.asarray(poses, dtype=numpy.float64).reshape(-1, 3)
+        # a sweep angle a points along (cos(a), -sin(a)) in the world frame,
+        # see GetWorldUnitVectors(), the ray queries along (sin(b), cos(b)), so
+        # b = 90 + heading + a
+        queryPoses = numpy.column_stack((poses[:, :2], 90.0 + poses[:, 2]))
+        ranges = expected_ranges(
+            occupied,
+            minX,
+            minY,
+            self.globalMap.xy_resolution,
+            queryPoses,
+            numpy.asarray(angles, dtype=numpy.float64),
+            maxRange,
+            distance_field=distances,
+        )
+        return {"ranges": ranges.tolist()}
+
+
+async def OpenServiceConnection(host="127.0.0.1", port=None, path=None):
+    """
+    Connects to a LiveMapService over TCP, or over a Unix socket if path is set.
+
+    Returns:
+        tuple: The (reader, writer) streams of the connection.
+    """
+    if path:
+        return await asyncio.open_unix_connection(path, limit=MAX_RESPONSE_BYTES)
+    return await asyncio.open_connection(host, port, limit=MAX_RESPONSE_BYTES)
+
+
+async def SendRequest(reader, writer, request):
+    """
+    Sends a JSON request and returns the decoded answer line.
+    """
+    writer.write(json.dumps(request).encode() + b"\n")
+    await writer.drain()
+    return json.loads(await reader.readline())
+
+
+async def RequestSnapshot(reader, writer):
+    """
+    Returns:
+        tuple: (probability, extent, numSweeps) the occupancy probability of
+        every cell of the running map, its (minX, maxX, minY, maxY) and the
+        number of sweeps fused.
+    """
+    response = await SendRequest(reader, writer, {"command": "snapshot"})
+    payload = await reader.readexactly(response["bytes"])
+    encoded = numpy.frombuffer(payload, dtype=numpy.uint8).reshape(response["shape"])
+    return encoded / 255.0, tuple(response["extent"]), response["numSweeps"]
+
+
+async def ReplayLidarPoints(lidarPoints, writer, rate=10.0, speed=1.0):
+    """
+    Streams a LIDARPoints file to the service one sweep at a time, standing in
+    for the drone.
+
+    Args:
+        lidarPoints (str): The lidar measurements file.
+        writer (asyncio.StreamWriter): Writer of the service connection.
+        rate (float): Sweeps per second of the lidar.
+        speed (float): Replay speed factor, 0 streams as fast as the service reads.
+
+    Returns:
+        int: Number of sweeps sent.
+    """
+    loop = asyncio.get_event_loop()
+    start = loop.time()
+    numSweeps = 0
+    lines = IterLinesFromStream(lidarPoints)
+    for header in lines:
+        if not header.strip():
+            continue
+        numSamples = int(float(header.split(",")[1]))
+        block = [header] + [next(lines) for _ in range(numSamples)]
+        if speed:
+            # on a fixed schedule, a slow write does not delay the next sweeps
+            await asyncio.sleep(
+                max(0.0, start + numSweeps / (rate * speed) - loop.time())
+            )
+        writer.write(("\n".join(block) + "\n").encode())
+        await writer.drain()
+        numSweeps += 1
+    return numSweeps
@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+__author__ = "Ashesh Vasalya"
+
+import os
+import numpy
+from concurrent.futures import ProcessPoolExecutor
+
+from .mapping.distance_field import distance_field
+from .projection import ProjectToLocalFrame
+from .profiling import Timed, profiler
+
+""" Monte Carlo localization of the drone against an occupancy grid map.
+
+    The map is an occupancy grid of generate_ray_casting_grid_map(), in the
+    local frame of the lidar, ox = d*sin(a) and oy = d*cos(a). A particle is a
+    pose (x, y, heading) in that frame, the heading in degrees being added to
+    the angles of the sweep, so its beams end at x + d*sin(a + heading) and
+    y + d*cos(a + heading).
+
+    A sweep is scored with a likelihood field: the log-likelihood of a beam end
+    only depends on its distance to the nearest occupied cell, precomputed
+    once per map, so scoring all the particles is one table lookup per beam
+    and particle, batched over both. The particles can be split in chunks
+    scored by a pool of worker processes.
+
+    Example usage:
+    from localization import LikelihoodField, ParticleFilter
+    gridMap, minX, maxX, minY, maxY, xy_resolution = generate_ray_casting_grid_map(ox, oy, 0.05)
+    field = LikelihoodField(gridMap, minX, minY, xy_resolution)
+    particleFilter = ParticleFilter(field, 5000, (0.0, 0.0, 0.0), seed=0)
+    pose = particleFilter.Step(angles, distances, motion=(0.1, 0.0, 0.0))
+
+    With jobs > 1 the worker processes start on the first Score() and stop on
+    Close(), or at the end of a with ParticleFilter(...) block.
+"""
+
+# occupancy of the cells treated as obstacles
+OCCUPIED_THRESHOLD = 0.5
+
+
+def GetObstacleDistances(gridMap, xy_resolution, maxDistance):
+    """
+    Distance of every cell to the nearest occupied cell, up to maxDistance.
+
+    Args:
+        gridMap (numpy.ndarray): Occupancy grid map, 1.0 occupied.
+        xy_resolution (float): Size of a cell in meters.
+        maxDistance (float): Cells farther from any obstacle get maxDistance.
+
+    Returns:
+        numpy.ndarray: Distances in meters, of the shape of gridMap.
+    """
+    distances = distance_field(gridMap, xy_resolution, OCCUPIED_THRESHOLD)
+    return numpy.minimum(distances, maxDistance)
+
+
+class LikelihoodField:
+    """
+    Log-likelihood of a beam ending in every cell of a map, from the distance of
+    the cell to the nearest obstacle.
+    """
+
+    def __init__(
+        self,
+        gridMap,
+        minX,
+        minY,
+        xy_resolution,
+        sigma=0.1,
+        maxDistance=0.5,
+        randomWeight=0.05,
+    ):
+        """
+        Args:
+            gridMap (numpy.ndarray): Occupancy grid map of
+            generate_ray_casting_grid_map(), 1.0 occupied.
+            minX (float): x coordinate of the first row of the map.
+            minY (float): y coordinate of the first column of the map.
+            xy_resolution (float): Size of a cell in meters.
+            sigma (float): Standard deviation of the range noise in meters.
+            maxDistance (float): Distances to obstacles are clamped to it.
+            randomWeight (float): Weight of the uniform part of the model, which
+            keeps a beam ending far from any obstacle from ruling a particle out.
+        """
+        assert sigma > 0, "sigma should be positive"
+        self.minX = minX
+        self.minY = minY
+        self.xy_resolution = xy_resolution
+        distances = GetObstacleDistances(gridMap, xy_resolution, maxDistance)
+        hit = numpy.exp(-0.5 * (distances / sigma) ** 2)
+        self.logLikelihood = numpy.log(
+            (1.0 - randomWeight) * hit + randomWeight
+        ).astype(numpy.float32)
+        # beams ending outside of the map are scored as far from any obstacle
+        self.outside = numpy.float32(
+            numpy.log(
+                (1.0 - randomWeight) * numpy.exp(-0.5 * (maxDistance / sigma) ** 2)
+                + randomWeight
+            )
+        )
+
+    def Score(self, particles, beams):
+        """
+        Log-likelihood of a sweep seen from every particle.
+
+        Args:
+            particles (numpy.ndarray): (P, 3) poses (x, y, heading in degrees).
+            beams (numpy.ndarray): (B, 2) ends of the beams seen from the
+            origin, (d*sin(a), d*cos(a)), see ProjectToLocalFrame().
+
+        Returns:
+            numpy.ndarray: (P,) sum over the beams of their log-likelihood.
+        """
+        particles = numpy.asarray(particles, dtype=numpy.float64)
+        headings = numpy.radians(particles[:, 2])
+        cos, sin = numpy.cos(headings)[:, None], numpy.sin(headings)[:, None]
+        beamSin, beamCos = beams[:, 0], beams[:, 1]
+        # sin(a + h) = sin(a)cos(h) + cos(a)sin(h), cos(a + h) = cos(a)cos(h) - sin(a)sin(h)
+        x = particles[:, :1] + beamSin * cos + beamCos * sin
+        y = particles[:, 1:2] + beamCos * cos - beamSin * sin
+        rows, columns = self.logLikelihood.shape
+        ix = numpy.rint((x - self.minX) / self.xy_resolution).astype(numpy.int64)
+        iy = numpy.rint((y - self.minY) / self.xy_resolution).astype(numpy.int64)
+        inside = (ix >= 0) & (ix < rows) & (iy >= 0) & (iy < columns)
+        values = numpy.where(
+            inside,
+            self.logLikelihood.take(
+                numpy.where(inside, ix * columns + iy, 0), mode="clip"
+            ),
+            self.outside,
+        )
+        return values.sum(axis=1, dtype=numpy.float64)
+
+
+# likelihood field of a worker process of ParticleFilter
+_workerField = None
+
+
+def _InitWorker(field):
+    global _workerField
+    _workerField = field
+
+
+def _ScoreChunk(task):
+    """
+    Scores a chunk of particles, in a worker process of ParticleFilter.
+    """
+    particles, beams = task
+    return _workerField.Score(particles, beams)
+
+
+class ParticleFilter:
+    """
+    Particle filter tracking the pose of the drone in the frame of a map.
+    """
+
+    def __init__(
+        self,
+        field,
+        numParticles,
+        initialPose,
+        initialSpread=(0.5, 0.5, 5.0),
+        motionNoise=(0.05, 0.05, 1.0),
+        beamStep=1,
+        chunkSize=1024,
+        jobs=1,
+        seed=None,
+    ):
+        """
+        Args:
+            field (LikelihoodField): Likelihood field of the map.
+            numParticles (int): Number of particles.
+            initialPose (tuple): (x, y, heading in degrees) first guess of the pose.
+            initialSpread (tuple): Standard deviations of the first particles
+            around initialPose.
+            motionNoise (tuple): Standard deviations added to every motion.
+            beamStep (int): Only every beamStep-th beam of a sweep is scored.
+            chunkSize (int): Particles scored at once, which bounds the memory
+            of the (particles, beams) arrays.
+            jobs (int): Number of worker processes scoring the chunks, 1 scores
+            them in this process and None uses one process per CPU.
+            seed (int): Seed of the random numbers, for a repeatable filter.
+        """
+        assert numParticles > 0, "numParticles should be positive"
+        assert (
+            beamStep > 0 and chunkSize > 0
+        ), "beamStep and chunkSize should be positive"
+        assert jobs is None or jobs > 0, "jobs should be a positive integer or None"
+        self.field = field
+        self.motionNoise = numpy.asarray(motionNoise, dtype=numpy.float64)
+        self.beamStep = beamStep
+        self.chunkSize = chunkSize
+        self.randomState = numpy.random.RandomState(seed)
+        self.particles = self.randomState.normal(
+            initialPose, initialSpread, (numParticles, 3)
+        )
+        self.logWeights = numpy.zeros(numParticles)
+
+        self.jobs = jobs or os.cpu_count() or 1
+        # the worker processes only start on the first parallel Score()
+        self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.Close()
+        return False
+
+    def Close(self):
+        """
+        Stops the worker processes, if any were started.
+        """
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def _GetExecutor(self):
+        """
+        Pool of worker processes scoring the chunks, started on first use.
+
+        Returns:
+            ProcessPoolExecutor: Pool of self.jobs processes.
+        """
+        if self.executor is None:
+            # every worker receives the likelihood field once
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.jobs,
+                initializer=_InitWorker,
+                initargs=(self.field,),
+            )
+        return self.executor
+
+    def Predict(self, motion):
+        """
+        Moves every particle by a motion given in its own frame, plus noise.
+
+        Args:
+            motion (tuple): (forward along oy, sideways along ox, turn in degrees).
+        """
+        headings = numpy.radians(self.particles[:, 2])
+        noisy = motion + self.randomState.normal(
+            0.0, self.motionNoise, self.particles.shape
+        )
+        cos, sin = numpy.cos(headings), numpy.sin(headings)
+        # the particle frame is rotated by its heading like its beams
+        self.particles[:, 0] += noisy[:, 1] * cos + noisy[:, 0] * sin
+        self.particles[:, 1] += noisy[:, 0] * cos - noisy[:, 1] * sin
+        self.particles[:, 2] += noisy[:, 2]
+
+    def Score(self, angles, distances):
+        """
+        Log-likelihood of a sweep seen from every particle.
+
+        Args:
+            angles (numpy.ndarray): 1D array of angles in degrees.
+            distances (numpy.ndarray): 1D array of distances.
+
+        Returns:
+            numpy.ndarray: (numParticles,) log-likelihoods.
+        """
+        beams = ProjectToLocalFrame(
+            numpy.asarray(angles)[:: self.beamStep],
+            numpy.asarray(distances)[:: self.beamStep],
+        )
+        chunks = [
+            (self.particles[start : start + self.chunkSize], beams)
+            for start in range(0, len(self.particles), self.chunkSize)
+        ]
+        if self.jobs == 1 or len(chunks) == 1:
+            scores = [self.field.Score(particles, beams) for particles, beams in chunks]
+        else:
+            scores = list(self._GetExecutor().map(_ScoreChunk, chunks))
+        profiler.Count("particleBeamsScored", len(self.particles) * len(beams))
+        return numpy.concatenate(scores)
+
+    def Update(self, angles, distances):
+        """
+        Weights the particles by the likelihood of a sweep, and resamples them
+        once the effective number of particles drops below half.
+        """
+        self.logWeights += self.Score(angles, distances)
+        self.logWeights -= self.logWeights.max()
+        weights = numpy.exp(self.logWeights)
+        weights /= weights.sum()
+        if 1.0 / numpy.square(weights).sum() < 0.5 * len(weights):
+            self.Resample(weights)
+
+    def Resample(self, weights):
+        """
+        Systematic resampling, particles are drawn in proportion to their weight
+        with a single random number.
+        """
+        positions = (
+            self.randomState.random_sample() + numpy.arange(len(weights))
+        ) / len(weights)
+        cumulative = numpy.cumsum(weights)
+        cumulative[-1] = 1.0
+        self.particles = self.particles[numpy.searchsorted(cumulative, positions)]
+        self.logWeights = numpy.zeros(len(weights))
+
+    def GetPose(self):
+        """
+        Returns:
+            numpy.ndarray: Weighted mean pose (x, y, heading in degrees) of the particles.
+        """
+        weights = numpy.exp(self.logWeights - self.logWeights.max())
+        weights /= weights.sum()
+        headings = numpy.radians(self.particles[:, 2])
+        # headings are averaged on the circle
+        heading = numpy.degrees(
+            numpy.arctan2(weights @ numpy.sin(headings), weights @ numpy.cos(headings))
+        )
+        x, y = weights @ self.particles[:, :2]
+        return numpy.array([x, y, heading])
+
+    @Timed("ParticleFilter.Step")
+    def Step(self, angles, distances, motion=None):
+        """
+        Moves the particles by the motion since the previous sweep, if any, and
+        weights them by the new sweep.
+
+        Returns:
+            numpy.ndarray: The estimated pose, see GetPose().
+        """
+        if motion is not None:
+            self.Predict(motion)
+        self.Update(angles, distances)
+        return self.GetPose()
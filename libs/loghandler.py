@@ -1,18 +1,46 @@
 #!/usr/bin/env python3
 __author__ = "Ashesh Vasalya"
+import os
 import sys
+import queue
+import atexit
 import logging
+import logging.handlers
 
 """ Example usage:
     from loghandler import LogHandler
     logger = LogHandler().log
     logger.debug("Debug message")
-    logger.info("Info message")
+    logger.info("Info message %s", "with lazy arguments")
     logger.warning("Warning message")
     logger.error("Error message")
     logger.critical("Critical message")
+
+    The level defaults to the LIDAR1D_LOG_LEVEL environment variable, DEBUG
+    otherwise, and LIDAR1D_LOG_QUEUE=1 starts in queue mode:
+    logHandle = LogHandler(level="WARNING", useQueue=True)
 """
 
+# environment variables read when a LogHandler is created
+LEVEL_ENVIRONMENT_VARIABLE = "LIDAR1D_LOG_LEVEL"
+QUEUE_ENVIRONMENT_VARIABLE = "LIDAR1D_LOG_QUEUE"
+LEVEL_NAMES = ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL")
+
+
+def GetLogLevel(level):
+    """
+    Converts a level name such as "info", or a level number, to a level number.
+
+    Raises:
+        AssertionError: If the level is not a known level.
+    """
+    if isinstance(level, int):
+        return level
+    assert (
+        str(level).upper() in LEVEL_NAMES
+    ), "Invalid log level: {}, expected one of {}".format(level, LEVEL_NAMES)
+    return getattr(logging, str(level).upper())
+
 
 class CustomFormatter(logging.Formatter):
     """
@@ -38,12 +66,22 @@ class CustomFormatter(logging.Formatter):
         logging.CRITICAL: bold_red + format + reset,
     }
 
+    def __init__(self):
+        """
+        Builds one formatter per level once, instead of one per record.
+        """
+        super().__init__()
+        self.formatters = {
+            level: logging.Formatter(log_fmt) for level, log_fmt in self.FORMATS.items()
+        }
+
     def format(self, record):
         """
         Override the format method to use the custom log formats defined above.
         """
-        log_fmt = self.FORMATS.get(record.levelno)
-        formatter = logging.Formatter(log_fmt)
+        formatter = self.formatters.get(record.levelno)
+        if formatter is None:
+            formatter = self.formatters[logging.DEBUG]
         return formatter.format(record)
 
 
@@ -51,16 +89,79 @@ class LogHandler:
     """
     A class that sets up a logger with the given name and adds a console handler that uses the
     CustomFormatter defined above.
+
+    The handlers are attached to the logger once, creating several LogHandler of the same
+    name reuses them. In queue mode, the logging calls only put the records in a queue, and
+    a background thread formats and writes them, so a slow stderr never stalls the caller.
     """
-    def __init__(self, name=None):
+    def __init__(self, name=None, level=None, useQueue=None):
         """
         Initialize a logger with the given name, or default to sys.argv[0].
+
+        Args:
+            name (str): Name of the logger.
+            level (str or int): Level of the logger, LIDAR1D_LOG_LEVEL or DEBUG by default.
+            useQueue (bool): If True log through a queue, LIDAR1D_LOG_QUEUE by default.
         """
         self.log = logging.getLogger(name or sys.argv[0])
-        self.log.setLevel(logging.DEBUG)
+        if level is None:
+            level = os.environ.get(LEVEL_ENVIRONMENT_VARIABLE, logging.DEBUG)
+        self.SetLevel(level)
+        if useQueue is None:
+            useQueue = os.environ.get(QUEUE_ENVIRONMENT_VARIABLE, "0") not in ("", "0")
 
-        # create console handler with a higher log level
-        consoleHandler = logging.StreamHandler()
-        consoleHandler.setLevel(logging.DEBUG)
-        consoleHandler.setFormatter(CustomFormatter())
-        self.log.addHandler(consoleHandler)
+        # the console handler of an earlier LogHandler of the same logger is reused
+        self.consoleHandler = None
+        self.queueHandler = None
+        for handler in self.log.handlers:
+            if isinstance(handler.formatter, CustomFormatter):
+                self.consoleHandler = handler
+            elif isinstance(handler, logging.handlers.QueueHandler):
+                self.queueHandler = handler
+        if self.queueHandler is not None:
+            self.consoleHandler = self.queueHandler.listener.handlers[0]
+
+        if self.consoleHandler is None:
+            # create console handler, the logger level filters the records
+            self.consoleHandler = logging.StreamHandler()
+            self.consoleHandler.setLevel(logging.DEBUG)
+            self.consoleHandler.setFormatter(CustomFormatter())
+            self.log.addHandler(self.consoleHandler)
+
+        if useQueue:
+            self.StartQueue()
+
+    def SetLevel(self, level):
+        """
+        Sets the level of the logger, from a level name such as "info" or a level number.
+        """
+        self.log.setLevel(GetLogLevel(level))
+
+    def StartQueue(self):
+        """
+        Switches to queue mode: the console handler is moved behind a QueueListener thread,
+        the logger only keeps a QueueHandler.
+        """
+        if self.queueHandler is not None:
+            return
+        self.queueHandler = logging.handlers.QueueHandler(queue.SimpleQueue())
+        self.queueHandler.listener = logging.handlers.QueueListener(
+            self.queueHandler.queue, self.consoleHandler
+        )
+        self.log.removeHandler(self.consoleHandler)
+        self.log.addHandler(self.queueHandler)
+        self.queueHandler.listener.start()
+        # the records still queued are written before the interpreter exits
+        atexit.register(self.StopQueue)
+
+    def StopQueue(self):
+        """
+        Writes the queued records and switches back to writing from the calling thread.
+        """
+        queueHandler, self.queueHandler = self.queueHandler, None
+        # another LogHandler of the same logger may have stopped it already
+        if queueHandler is None or queueHandler not in self.log.handlers:
+            return
+        self.log.removeHandler(queueHandler)
+        queueHandler.listener.stop()
+        self.log.addHandler(self.consoleHandler)
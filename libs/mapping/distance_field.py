@@ -0,0 +1,168 @@
+"""
+
+Exact Euclidean distance transform of occupancy grid maps, the distance of
+every cell to the nearest occupied cell, with local updates
+
+Felzenszwalb, P. F., Huttenlocher, D. P.: Distance Transforms of Sampled
+Functions. Theory of Computing 8 (2012)
+
+"""
+
+import numpy as np
+
+from ..profiling import profiler
+
+# an update checks every candidate row against every changed column, past
+# this many checks per row of the map a full transform is cheaper
+FULL_TRANSFORM_CHECKS_PER_ROW = 64
+
+
+def _squared_distance_rows(f):
+    """
+    One dimensional squared distance transform of every row of f, the lower
+    envelope of the parabolas (q - p)^2 + f[p], all rows advancing together
+    f: (R, n) array of squared distances, large values where there is no
+    obstacle. Returns the (R, n) transformed array
+    """
+    rows, n = f.shape
+    index = np.arange(rows)
+    # parabolas of the envelope, v their apex and z the boundaries between them
+    v = np.zeros((rows, n), dtype=np.int64)
+    z = np.empty((rows, n + 1))
+    z[:, 0] = -np.inf
+    z[:, 1] = np.inf
+    k = np.zeros(rows, dtype=np.int64)
+    for q in range(1, n):
+        fq = f[:, q] + q * q
+        while True:
+            p = v[index, k]
+            s = (fq - f[index, p] - p * p) / (2.0 * (q - p))
+            hidden = s <= z[index, k]
+            if not hidden.any():
+                break
+            k -= hidden
+        k += 1
+        v[index, k] = q
+        z[index, k] = s
+        z[index, k + 1] = np.inf
+
+    out = np.empty_like(f)
+    k[:] = 0
+    for q in range(n):
+        while True:
+            after = z[index, k + 1] < q
+            if not after.any():
+                break
+            k += after
+        p = v[index, k]
+        out[:, q] = (q - p) ** 2 + f[index, p]
+    return out
+
+
+class DistanceField:
+    """
+    Euclidean distances of the cells of an occupancy grid map to the nearest
+    occupied cell, kept in step with the map by recomputing only the columns
+    and rows a change of occupancy reaches
+    """
+
+    def __init__(self, grid_map, xy_resolution, occupied_threshold=0.5):
+        """
+        grid_map: occupancy grid map of generate_ray_casting_grid_map, cells
+        above occupied_threshold are obstacles
+        xy_resolution: size of a cell [m]
+        """
+        self.xy_resolution = xy_resolution
+        self.occupied_threshold = occupied_threshold
+        self.occupied = np.asarray(grid_map) > occupied_threshold
+        rows, columns = self.occupied.shape
+        # larger than any squared distance on the map, stands for no obstacle
+        self.no_obstacle = float(rows * rows + columns * columns)
+        # squared distances to the nearest obstacle of the same column, then
+        # of the whole map
+        self.column_squared = self._columns(np.arange(columns))
+        self.squared = _squared_distance_rows(self.column_squared)
+
+    def _columns(self, columns):
+        """
+        Squared distances of the cells of the given columns to the nearest
+        obstacle of their column, from the previous and next obstacle indices
+        """
+        occupied = self.occupied[:, columns]
+        n = occupied.shape[0]
+        index = np.arange(n)[:, None]
+        previous = np.maximum.accumulate(np.where(occupied, index, -2 * n), axis=0)
+        following = np.minimum.accumulate(
+            np.where(occupied, index, 3 * n)[::-1], axis=0
+        )[::-1]
+        distance = np.minimum(index - previous, following - index)
+        return np.where(distance > n, self.no_obstacle, distance**2.0)
+
+    @property
+    def distances(self):
+        """
+        Distances [m] of every cell to the nearest occupied cell, inf without
+        any occupied cell
+        """
+        distances = np.sqrt(self.squared) * self.xy_resolution
+        distances[self.squared >= self.no_obstacle] = np.inf
+        return distances
+
+    def update(self, grid_map, region=None):
+        """
+        Brings the distances in step with a new occupancy of the map
+        grid_map: occupancy grid map of the same shape
+        region: optional (ix_min, ix_max, iy_min, iy_max) bounds, end excluded,
+        of the cells that may have changed, by default the whole map is compared
+        Returns the indices of the rows whose distances were recomputed
+
+        Only the columns with a changed cell are transformed again, and only
+        the rows where a changed column distance is or becomes the nearest
+        obstacle of a cell, which gives the same field as a transform of the
+        whole map. Finding those rows costs rows x columns x changed columns,
+        so past FULL_TRANSFORM_CHECKS_PER_ROW changed columns per row of the
+        map the rows are all transformed again instead.
+        """
+        grid_map = np.asarray(grid_map)
+        assert grid_map.shape == self.occupied.shape, "the map should keep its shape"
+        if region is None:
+            region = (0, grid_map.shape[0], 0, grid_map.shape[1])
+        x0, x1, y0, y1 = region
+        occupied = grid_map[x0:x1, y0:y1] > self.occupied_threshold
+        changed = occupied != self.occupied[x0:x1, y0:y1]
+        columns = y0 + np.flatnonzero(changed.any(axis=0))
+        if columns.size == 0:
+            return np.zeros(0, dtype=np.int64)
+        self.occupied[x0:x1, y0:y1] = occupied
+
+        column_squared = self._columns(columns)
+        rows = np.flatnonzero(
+            (column_squared != self.column_squared[:, columns]).any(axis=1)
+        )
+        if len(rows) * len(columns) > FULL_TRANSFORM_CHECKS_PER_ROW * len(self.squared):
+            self.column_squared[:, columns] = column_squared
+            self.squared = _squared_distance_rows(self.column_squared)
+            profiler.Count("distanceFieldFullTransforms")
+            return np.arange(len(self.squared))
+        # a changed value of a row only matters if it is, or becomes, the
+        # minimum of some cell q of the row, value + (q - column)^2 <= squared
+        lower = np.minimum(column_squared[rows], self.column_squared[rows][:, columns])
+        squared = self.squared[rows]
+        q = np.arange(squared.shape[1])
+        affected = np.zeros(len(rows), dtype=bool)
+        for i, column in enumerate(columns):
+            reach = (squared - (q - column) ** 2).max(axis=1)
+            affected |= lower[:, i] <= reach
+        rows = rows[affected]
+        self.column_squared[:, columns] = column_squared
+        self.squared[rows] = _squared_distance_rows(self.column_squared[rows])
+        profiler.Count("distanceFieldRowsUpdated", len(rows))
+        return rows
+
+
+def distance_field(grid_map, xy_resolution, occupied_threshold=0.5):
+    """
+    Exact Euclidean distances [m] of every cell of an occupancy grid map to
+    the nearest cell above occupied_threshold, inf without any
+    """
+    return DistanceField(grid_map, xy_resolution, occupied_threshold).distances
@@ -0,0 +1,66 @@
+"""
+
+Vectorized downsampling of the end points of a sweep before ray casting
+
+"""
+
+import numpy as np
+
+
+def unique_cells(ix, iy):
+    """
+    Keeps one end point per distinct grid cell
+    ix, iy: grid coordinates of the end points
+    Returns the sorted indices of the last end point that falls in every cell.
+    Beams ending in the same cell trace the same cells, so casting only the
+    kept beams, in the order of the indices, writes the same map as casting
+    every beam, see resolve_laser_beams
+    >>> unique_cells(np.array([3, 5, 3]), np.array([1, 2, 1]))
+    array([1, 2])
+    """
+    ix = np.asarray(ix, dtype=np.int64)
+    iy = np.asarray(iy, dtype=np.int64)
+    if len(ix) == 0:
+        return np.zeros(0, dtype=np.int64)
+    # one integer key per cell, the grid coordinates may be negative
+    iy = iy - iy.min()
+    keys = (ix - ix.min()) * (iy.max() + 1) + iy
+    # first occurrence in reversed order is the last occurrence
+    _, last = np.unique(keys[::-1], return_index=True)
+    return np.sort(len(keys) - 1 - last)
+
+
+def cell_downsample(ox, oy, xy_resolution):
+    """
+    Keeps one point per cell of a grid of xy_resolution anchored at the origin
+    ox, oy: x and y coordinates of the points [m]
+    Returns the kept ox, oy, in their original order
+    """
+    ox = np.asarray(ox)
+    oy = np.asarray(oy)
+    keep = unique_cells(
+        np.rint(ox / xy_resolution).astype(np.int64),
+        np.rint(oy / xy_resolution).astype(np.int64),
+    )
+    return ox[keep], oy[keep]
+
+
+def farthest_per_angular_bin(angles, distances, bin_size):
+    """
+    Keeps the farthest return of every angular bin, the beam that crosses the
+    most free space in that direction
+    angles: beam angles [deg], any range, wrapped around 360
+    distances: beam ranges [m]
+    bin_size: width of the bins [deg]
+    Returns the sorted indices of the kept beams, ties keep the first beam
+    """
+    assert bin_size > 0, "bin_size should be positive"
+    angles = np.asarray(angles, dtype=np.float64)
+    distances = np.asarray(distances, dtype=np.float64)
+    num_bins = max(1, int(np.ceil(360.0 / bin_size)))
+    bins = np.floor(np.mod(angles, 360.0) / bin_size).astype(np.int64) % num_bins
+    # sort by bin, then by decreasing distance, the first beam of a bin wins
+    order = np.lexsort((-distances, bins))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = bins[order[1:]] != bins[order[:-1]]
+    return np.sort(order[first])
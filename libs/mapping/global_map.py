@@ -0,0 +1,254 @@
+"""
+
+Global occupancy grid map fused from many sweeps with log-odds updates
+
+"""
+
+import numpy as np
+
+from .downsample import farthest_per_angular_bin, unique_cells
+from .lidar_to_grid_map import bresenham_batch
+from .tiled_grid import TiledGrid
+from ..profiling import profiler
+from ..projection import ProjectToWorldFrame
+
+LOG_ODDS_SCALE = 100.0  # integer log-odds units per unit of log-odds
+TILE_KEY_OFFSET = 2**30  # cell keys of the tiled map allow negative indices
+TILE_KEY_STRIDE = 2**31
+
+
+def probability_to_log_odds(probability):
+    """
+    Converts an occupancy probability to integer log-odds units
+    """
+    return int(round(LOG_ODDS_SCALE * np.log(probability / (1.0 - probability))))
+
+
+def trace_sweep(
+    angles, distances, coordinates, min_x, min_y, xy_resolution, angular_bin=None
+):
+    """
+    Ray casts one sweep from its position in the world on the grid anchored at
+    min_x, min_y, without any map, so it can run in another thread or process
+    angles: beam angles [deg]
+    distances: beam ranges [m]
+    coordinates: (x, y) position of the sensor in the world [m], the beams
+    being placed in the world frame by ProjectToWorldFrame
+    angular_bin: if set, only the farthest beam of every angular bin is cast
+    Returns the (2, N) cells the beams pass through and the (2, M) cells they
+    end in, every cell once and a hit winning over a pass through, and the
+    number of beams cast, see GlobalOccupancyMap.apply_trace
+    """
+    angles = np.asarray(angles)
+    distances = np.asarray(distances)
+    if angular_bin:
+        keep = farthest_per_angular_bin(angles, distances, angular_bin)
+        angles, distances = angles[keep], distances[keep]
+    x, y = ProjectToWorldFrame(angles, distances, coordinates).T
+    ix = np.rint((x - min_x) / xy_resolution).astype(np.int64)
+    iy = np.rint((y - min_y) / xy_resolution).astype(np.int64)
+    center_x = int(np.rint((coordinates[0] - min_x) / xy_resolution))
+    center_y = int(np.rint((coordinates[1] - min_y) / xy_resolution))
+    keep = unique_cells(ix, iy)
+    ix, iy = ix[keep], iy[keep]
+
+    laser_beams, beam_ids = bresenham_batch(
+        (center_x, center_y), np.column_stack((ix, iy))
+    )
+    # the end point of a beam is the hit, not free space
+    pass_through = (laser_beams[:, 0] != ix[beam_ids]) | (
+        laser_beams[:, 1] != iy[beam_ids]
+    )
+    free_cells = _trace_keys(laser_beams[pass_through].T)
+    occupied_cells = _trace_keys((ix, iy))
+    # every cell is updated once per sweep, a hit wins over a pass through
+    occupied_cells = np.unique(occupied_cells)
+    free_cells = np.setdiff1d(free_cells, occupied_cells)
+    return _trace_cells(free_cells), _trace_cells(occupied_cells), len(ix)
+
+
+def _trace_keys(cells):
+    ix, iy = cells
+    return (ix + TILE_KEY_OFFSET) * TILE_KEY_STRIDE + (iy + TILE_KEY_OFFSET)
+
+
+def _trace_cells(keys):
+    ix, iy = np.divmod(keys, TILE_KEY_STRIDE)
+    return np.stack((ix - TILE_KEY_OFFSET, iy - TILE_KEY_OFFSET))
+
+
+class GlobalOccupancyMap:
+    """
+    Occupancy grid map of a fixed world area, stored as clamped integer
+    log-odds. Sweeps are ray cast from their pose in world coordinates and
+    fused one at a time, each update only touches the cells the beams cross
+    """
+
+    def __init__(
+        self,
+        min_x,
+        min_y,
+        max_x,
+        max_y,
+        xy_resolution=0.05,
+        dtype=np.int16,
+        p_occupied=0.7,
+        p_free=0.4,
+        p_clamp=0.97,
+        tile_size=None,
+        max_tiles=None,
+        angular_bin=None,
+    ):
+        """
+        min_x, min_y, max_x, max_y: world area covered by the map [m]
+        xy_resolution: size of a cell [m]
+        dtype: integer type of the log-odds cells, np.int8 or np.int16
+        p_occupied, p_free: inverse sensor model of a hit and of a pass through
+        p_clamp: log-odds are clamped to [1 - p_clamp, p_clamp] in probability
+        tile_size: if set, the log-odds are kept in a sparse TiledGrid of tiles
+        of this size, which grows past max_x, max_y as sweeps are added
+        max_tiles: number of tiles kept in memory before spilling to disk
+        angular_bin: if set, only the farthest beam of every angular bin of
+        that many degrees is cast
+        """
+        self.min_x = min_x
+        self.min_y = min_y
+        self.xy_resolution = xy_resolution
+        self.x_w = int(np.ceil((max_x - min_x) / xy_resolution))
+        self.y_w = int(np.ceil((max_y - min_y) / xy_resolution))
+        self.max_x = min_x + self.x_w * xy_resolution
+        self.max_y = min_y + self.y_w * xy_resolution
+        self.l_occupied = probability_to_log_odds(p_occupied)
+        self.l_free = probability_to_log_odds(p_free)
+        self.l_max = probability_to_log_odds(p_clamp)
+        assert self.l_max <= np.iinfo(dtype).max, "p_clamp does not fit in dtype"
+        if tile_size is None:
+            self.log_odds = np.zeros((self.x_w, self.y_w), dtype=dtype)
+        else:
+            self.log_odds = TiledGrid(tile_size, dtype, 0, max_tiles)
+        self.angular_bin = angular_bin
+        self.num_sweeps = 0
+
+    def world_to_grid(self, x, y):
+        """
+        Converts world coordinates [m] to (ix, iy) cell indices
+        """
+        ix = np.rint((np.asarray(x) - self.min_x) / self.xy_resolution)
+        iy = np.rint((np.asarray(y) - self.min_y) / self.xy_resolution)
+        return ix.astype(np.int64), iy.astype(np.int64)
+
+    def trace_sweep(self, angles, distances, coordinates):
+        """
+        Ray casts one sweep on the grid of the map without updating it, see
+        trace_sweep
+        """
+        return trace_sweep(
+            angles,
+            distances,
+            coordinates,
+            self.min_x,
+            self.min_y,
+            self.xy_resolution,
+            self.angular_bin,
+        )
+
+    def add_sweep(self, angles, distances, coordinates):
+        """
+        Fuses one sweep into the map
+        angles: beam angles [deg]
+        distances: beam ranges [m]
+        coordinates: (x, y) position of the sensor in the world [m]
+        Beams ending in the same cell are cast once
+        """
+        center_x, center_y = self.world_to_grid(coordinates[0], coordinates[1])
+        assert isinstance(self.log_odds, TiledGrid) or (
+            0 <= center_x < self.x_w and 0 <= center_y < self.y_w
+        ), "sweep pose outside of the map"
+        return self.apply_trace(self.trace_sweep(angles, distances, coordinates))
+
+    def apply_trace(self, trace):
+        """
+        Updates the log-odds of the cells of a traced sweep
+        trace: free cells, occupied cells and number of beams of trace_sweep
+        Returns the number of cells updated
+        """
+        free_cells, occupied_cells, num_beams = trace
+        free_cells = self._cell_keys(free_cells)
+        occupied_cells = self._cell_keys(occupied_cells)
+        self._update(free_cells, self.l_free)
+        self._update(occupied_cells, self.l_occupied)
+        self.num_sweeps += 1
+        profiler.Count("beamsCast", num_beams)
+        profiler.Count("cellsTouched", len(free_cells) + len(occupied_cells))
+        return len(free_cells) + len(occupied_cells)
+
+    def _cell_keys(self, cells):
+        """
+        Integer key of every cell kept by the map, the flat index into the
+        dense map, or a key that allows negative indices for the tiled map
+        """
+        ix, iy = cells
+        if isinstance(self.log_odds, TiledGrid):
+            return (ix + TILE_KEY_OFFSET) * TILE_KEY_STRIDE + (iy + TILE_KEY_OFFSET)
+        inside = (ix >= 0) & (ix < self.x_w) & (iy >= 0) & (iy < self.y_w)
+        return ix[inside] * self.y_w + iy[inside]
+
+    def _update(self, cells, delta):
+        """
+        Adds delta to the log-odds of the cells, clamped
+        """
+        if isinstance(self.log_odds, TiledGrid):
+            ix, iy = np.divmod(cells, TILE_KEY_STRIDE)
+            self.log_odds.add(
+                ix - TILE_KEY_OFFSET,
+                iy - TILE_KEY_OFFSET,
+                delta,
+                -self.l_max,
+                self.l_max,
+            )
+            return
+        log_odds = self.log_odds.ravel()
+        values = log_odds[cells].astype(np.int32) + delta
+        log_odds[cells] = np.clip(values, -self.l_max, self.l_max)
+
+    def dense_log_odds(self):
+        """
+        Log-odds as a dense array, and the world coordinates of its first cell
+        """
+        if isinstance(self.log_odds, TiledGrid):
+            dense, min_ix, min_iy = self.log_odds.to_dense()
+            return (
+                dense,
+                self.min_x + min_ix * self.xy_resolution,
+                self.min_y + min_iy * self.xy_resolution,
+            )
+        return self.log_odds, self.min_x, self.min_y
+
+    def log_odds_at(self, x, y):
+        """
+        Log-odds of the cells of the world points x, y [m], 0 outside of the
+        map, without a dense copy of the map
+        """
+        ix, iy = self.world_to_grid(np.ravel(x), np.ravel(y))
+        if isinstance(self.log_odds, TiledGrid):
+            return self.log_odds.get(ix, iy)
+        inside = (ix >= 0) & (ix < self.x_w) & (iy >= 0) & (iy < self.y_w)
+        values = np.zeros(len(ix), dtype=self.log_odds.dtype)
+        values[inside] = self.log_odds[ix[inside], iy[inside]]
+        return values
+
+    def probability(self):
+        """
+        Occupancy probability of every cell, 0.5 where nothing was observed
+        """
+        log_odds = self.dense_log_odds()[0]
+        return 1.0 - 1.0 / (1.0 + np.exp(log_odds / LOG_ODDS_SCALE))
+
+    def extent(self):
+        """
+        min_x, max_x, min_y, max_y of the map returned by probability() [m]
+        """
+        log_odds, min_x, min_y = self.dense_log_odds()
+        max_x = min_x + log_odds.shape[0] * self.xy_resolution
+        max_y = min_y + log_odds.shape[1] * self.xy_resolution
+        return min_x, max_x, min_y, max_y
@@ -12,6 +12,8 @@ from collections import deque
 import matplotlib.pyplot as plt
 import numpy as np
 
+from .downsample import farthest_per_angular_bin, unique_cells
+
 EXTEND_AREA = 1.0
 
 
@@ -76,6 +78,53 @@ def bresenham(start, end):
     return points
 
 
+def bresenham_batch(start, ends):
+    """
+    Vectorized Bresenham's line algorithm for many lines
+    start is either one start point shared by all lines or one per line
+    Produces the same points as bresenham(start, end) for every end point,
+    concatenated in the order of the end points
+    >>> points, beams = bresenham_batch((4, 4), np.array([[6, 10], [5, 4]]))
+    >>> print(points[beams == 1])
+    np.array([[4,4], [5,4]])
+    Returns the (M, 2) array of points and the (M,) index of the line each
+    point belongs to
+    """
+    ends = np.asarray(ends, dtype=np.int64).reshape(-1, 2)
+    starts = np.broadcast_to(np.asarray(start, dtype=np.int64), ends.shape)
+    x1 = starts[:, 0].copy()
+    y1 = starts[:, 1].copy()
+    x2 = ends[:, 0].copy()
+    y2 = ends[:, 1].copy()
+    is_steep = np.abs(y2 - y1) > np.abs(x2 - x1)  # determine how steep the lines are
+    # rotate steep lines
+    x1[is_steep], y1[is_steep] = y1[is_steep], x1[is_steep].copy()
+    x2[is_steep], y2[is_steep] = y2[is_steep], x2[is_steep].copy()
+    # swap start and end points if necessary
+    swapped = x1 > x2
+    x1[swapped], x2[swapped] = x2[swapped], x1[swapped].copy()
+    y1[swapped], y2[swapped] = y2[swapped], y1[swapped].copy()
+    dx = x2 - x1
+    abs_dy = np.abs(y2 - y1)
+    error = dx // 2
+    y_step = np.where(y1 < y2, 1, -1)
+    # the k-th point of a line has stepped along y once for every time the
+    # error went negative in the k previous iterations
+    lengths = dx + 1
+    beams = np.repeat(np.arange(len(ends)), lengths)
+    k = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    y_count = np.repeat(error, lengths) - k * np.repeat(abs_dy, lengths)
+    y_count //= np.repeat(np.maximum(dx, 1), lengths)
+    np.minimum(y_count, 0, out=y_count)
+    x = np.repeat(x1, lengths) + k
+    y = np.repeat(y1, lengths) - np.repeat(y_step, lengths) * y_count
+    steep = np.repeat(is_steep, lengths)
+    points = np.empty((len(k), 2), dtype=np.int64)
+    points[:, 0] = np.where(steep, y, x)
+    points[:, 1] = np.where(steep, x, y)
+    return points, beams
+
+
 def calc_grid_map_config(ox, oy, xy_resolution, sweepID=None):
     """
     Calculates the size, and the maximum distances according to the the
@@ -85,12 +134,42 @@ def calc_grid_map_config(ox, oy, xy_resolution, sweepID=None):
     min_y = round(min(oy) - EXTEND_AREA / 2.0)
     max_x = round(max(ox) + EXTEND_AREA / 2.0)
     max_y = round(max(oy) + EXTEND_AREA / 2.0)
-    xw = int(round((max_x - min_x) / xy_resolution))
-    yw = int(round((max_y - min_y) / xy_resolution))
+    # two more cells keep the extended occupied area of the farthest points,
+    # at ix + 1 and iy + 1, inside the map
+    xw = int(round((max_x - min_x) / xy_resolution)) + 2
+    yw = int(round((max_y - min_y) / xy_resolution)) + 2
     # print("At Sweep", sweepID, " The grid map is ", xw, "x", yw,)
     return min_x, min_y, max_x, max_y, xw, yw
 
 
+def calc_fixed_grid_map_config(max_range, xy_resolution):
+    """
+    Calculates the size of a grid map of a fixed extent, centered on the
+    sensor, that holds every point up to max_range, whatever the sweep
+    Returns the same values as calc_grid_map_config
+    """
+    assert max_range > 0, "max_range should be positive"
+    half_w = int(np.ceil((max_range + EXTEND_AREA / 2.0) / xy_resolution))
+    min_x = min_y = -half_w * xy_resolution
+    xw = yw = 2 * half_w + 2  # room for the extended occupied area
+    max_x = max_y = min_x + xw * xy_resolution
+    return min_x, min_y, max_x, max_y, xw, yw
+
+
+def clip_to_range(ox, oy, max_range):
+    """
+    Clips the points farther than max_range to max_range along their beam
+    Returns the clipped ox, oy and the mask of the points within range, the
+    hits, the clipped beams only clear free space
+    """
+    ox = np.asarray(ox, dtype=float)
+    oy = np.asarray(oy, dtype=float)
+    ranges = np.hypot(ox, oy)
+    hits = ranges <= max_range
+    scale = max_range / np.maximum(ranges, max_range)
+    return ox * scale, oy * scale, hits
+
+
 def atan_zero_to_twopi(y, x):
     angle = math.atan2(y, x)
     if angle < 0.0:
@@ -157,20 +236,211 @@ def flood_fill(center_point, occupancy_map):
                 fringe.appendleft((nx, ny + 1))
 
 
-def generate_ray_casting_grid_map(ox, oy, xy_resolution, sweepID=None, breshen=True):
+def init_flood_fill_batch(
+    center_point, obstacle_points, xy_points, min_coord, xy_resolution
+):
+    """
+    Vectorized init_flood_fill, draws the free boundary between consecutive
+    obstacle points with bresenham_batch
+    center_point: center point
+    obstacle_points: detected obstacles points (x,y)
+    xy_points: (x,y) point pairs
+    """
+    center_x, center_y = center_point
+    ox, oy = obstacle_points
+    xw, yw = xy_points
+    min_x, min_y = min_coord
+    occupancy_map = np.full((xw, yw), 0.5)
+    ix = np.rint((ox - min_x) / xy_resolution).astype(np.int64)
+    iy = np.rint((oy - min_y) / xy_resolution).astype(np.int64)
+    ends = np.column_stack((ix, iy))
+    starts = np.concatenate(([[center_x - 1, center_y]], ends[:-1]))
+    free_area = bresenham_batch(starts, ends)[0]
+    occupancy_map[free_area[:, 0], free_area[:, 1]] = 0.0  # free area 0.0
+    return occupancy_map
+
+
+def _label_runs(open_cells):
+    """
+    Labels every run of open cells along the rows of the grid, closed cells
+    get the label 0
+    """
+    run_starts = open_cells.copy()
+    run_starts[:, 1:] &= ~open_cells[:, :-1]
+    labels = np.cumsum(run_starts).reshape(open_cells.shape)
+    labels[~open_cells] = 0
+    return labels
+
+
+def flood_fill_batch(center_point, occupancy_map):
+    """
+    Vectorized flood_fill, fills the same cells by spreading the fill along
+    the runs of unknown cells of the rows and the columns in turns, until
+    nothing changes
+    center_point: starting point (x,y) of fill
+    occupancy_map: occupancy map generated from Bresenham ray-tracing
+    """
+    sx, sy = occupancy_map.shape
+    nx, ny = center_point
+    open_cells = occupancy_map == 0.5
+    row_labels = _label_runs(open_cells)
+    column_labels = _label_runs(open_cells.T).T
+    open_index = np.flatnonzero(open_cells)
+    open_rows = row_labels.ravel()[open_index]
+    open_columns = column_labels.ravel()[open_index]
+    # the fill starts from the unknown neighbours of the center point
+    filled_rows = np.zeros(row_labels.max() + 1, dtype=bool)
+    for mx, my in ((nx - 1, ny), (nx + 1, ny), (nx, ny - 1), (nx, ny + 1)):
+        if 0 <= mx < sx and 0 <= my < sy:
+            filled_rows[row_labels[mx, my]] = True
+    filled_rows[0] = False
+    count = np.count_nonzero(filled_rows)
+    while True:
+        filled_columns = np.zeros(column_labels.max() + 1, dtype=bool)
+        filled_columns[open_columns[filled_rows[open_rows]]] = True
+        filled_rows[open_rows[filled_columns[open_columns]]] = True
+        new_count = np.count_nonzero(filled_rows)
+        if new_count == count:
+            break
+        count = new_count
+    np.put(occupancy_map, open_index[filled_rows[open_rows]], 0.0)
+    return occupancy_map
+
+
+def resolve_laser_beams(shape, laser_beams, beam_ids, ix, iy, hits=None):
+    """
+    Resolves the cells written by all laser beams of a sweep. When beams
+    overlap, a cell keeps the value written by the last beam, exactly like
+    casting the beams one after the other
+    shape: (x_w, y_w) shape of the grid map
+    laser_beams: (M, 2) free cells from bresenham_batch
+    beam_ids: (M,) beam index of every free cell
+    ix, iy: grid coordinates of the occupied end point of every beam
+    hits: optional mask of the beams with an occupied end point, the other
+    beams only write free cells
+    Returns the flat indices of the free cells, and the flat indices and final
+    values of the cells around the end points
+    """
+    x_w, y_w = shape
+    occ_ids = np.arange(len(ix))
+    if hits is not None:
+        occ_ids = occ_ids[hits]
+        ix, iy = ix[hits], iy[hits]
+    assert (ix >= 0).all() and (ix < x_w - 1).all(), "occupied area outside of the map"
+    assert (iy >= 0).all() and (iy < y_w - 1).all(), "occupied area outside of the map"
+    free_cells = laser_beams[:, 0] * y_w + laser_beams[:, 1]
+    occ_cells = np.concatenate(
+        (ix, ix + 1, ix, ix + 1)  # extend the occupied area
+    ) * y_w + np.concatenate((iy, iy, iy + 1, iy + 1))
+    occ_beams = np.tile(occ_ids, 4)
+    # an occupied cell stays occupied unless a later beam passes through it,
+    # a beam writes its own occupied cells after its free cells
+    cells, inverse = np.unique(occ_cells, return_inverse=True)
+    if len(cells) == 0:  # every beam was clipped
+        return free_cells, cells, np.zeros(0)
+    last_occ = np.full(len(cells), -1)
+    np.maximum.at(last_occ, inverse, occ_beams)
+    index = np.minimum(np.searchsorted(cells, free_cells), len(cells) - 1)
+    matched = cells[index] == free_cells
+    last_free = np.full(len(cells), -1)
+    np.maximum.at(last_free, index[matched], beam_ids[matched])
+    return free_cells, cells, np.where(last_occ >= last_free, 1.0, 0.0)
+
+
+def apply_laser_beams(occupancy_map, laser_beams, beam_ids, ix, iy, hits=None):
+    """
+    Writes the free cells of every laser beam and the occupied cells at its end
+    in one go, see resolve_laser_beams
+    """
+    free_cells, cells, values = resolve_laser_beams(
+        occupancy_map.shape, laser_beams, beam_ids, ix, iy, hits
+    )
+    np.put(occupancy_map, free_cells, 0.0)  # free area 0.0
+    np.put(occupancy_map, cells, values)  # occupied area 1.0
+    return occupancy_map
+
+
+def generate_ray_casting_grid_map(
+    ox,
+    oy,
+    xy_resolution,
+    sweepID=None,
+    breshen=True,
+    batch=True,
+    grid=None,
+    grid_offset=(0, 0),
+    angular_bin=None,
+    max_range=None,
+    out=None,
+):
     """
     The breshen boolean tells if it's computed with bresenham ray casting
     (True) or with flood fill (False)
+    The batch boolean tells if the bresenham rays, or the flood fill, are
+    computed with array operations (True) or one cell at a time (False), both
+    produce the same map
+    When a TiledGrid is given as grid, the sweep is written into it instead of
+    a new array, the sensor being at cell grid_offset of the grid, and the grid
+    is returned in place of the map. Batched bresenham ray casting writes the
+    cells directly, the other modes copy the known cells of the sweep map
+    Batched bresenham ray casting casts one beam per distinct end point cell,
+    which writes the same map as one beam per point. When angular_bin is set,
+    only the farthest point of every angular bin of that many degrees is kept
+    When max_range is set, the map has the fixed extent of
+    calc_fixed_grid_map_config centered on the sensor, and the points past
+    max_range are clipped to it, their beams clearing free space without an
+    occupied end. A preallocated out array of the shape of that extent is
+    cleared and written in place of a new map, to reuse it from sweep to sweep
     """
-    min_x, min_y, max_x, max_y, x_w, y_w = calc_grid_map_config(ox, oy, xy_resolution, sweepID)
+    ox = np.asarray(ox)
+    oy = np.asarray(oy)
+    if angular_bin:
+        keep = farthest_per_angular_bin(
+            np.degrees(np.arctan2(ox, oy)), np.hypot(ox, oy), angular_bin
+        )
+        ox, oy = ox[keep], oy[keep]
+    if max_range is None:
+        hits = np.ones(len(ox), dtype=bool)
+        min_x, min_y, max_x, max_y, x_w, y_w = calc_grid_map_config(ox, oy, xy_resolution, sweepID)
+    else:
+        ox, oy, hits = clip_to_range(ox, oy, max_range)
+        min_x, min_y, max_x, max_y, x_w, y_w = calc_fixed_grid_map_config(max_range, xy_resolution)
+    assert out is None or out.shape == (x_w, y_w), "out should have the shape of the map"
     # print('******             *******'); from IPython import embed; embed()
-    # default 0.5 -- [[0.5 for i in range(y_w)] for i in range(x_w)]
-    occupancy_map = np.ones((x_w, y_w)) / 2
     center_x = int(round(-min_x / xy_resolution))  # center x coordinate of the grid map
     center_y = int(round(-min_y / xy_resolution))  # center y coordinate of the grid map
+    # occupancy grid computed with batched bresenham ray casting
+    if breshen and batch:
+        ix = np.rint((ox - min_x) / xy_resolution).astype(np.int64)
+        iy = np.rint((oy - min_y) / xy_resolution).astype(np.int64)
+        # ray count scales with the distinct cells, hits and clipped beams apart
+        keep = unique_cells(ix * 2 + hits, iy)
+        ix, iy, hits = ix[keep], iy[keep], hits[keep]
+        laser_beams, beam_ids = bresenham_batch(
+            (center_x, center_y), np.column_stack((ix, iy))
+        )  # lines form the lidar to the occupied points
+        if grid is not None:
+            free_cells, cells, values = resolve_laser_beams(
+                (x_w, y_w), laser_beams, beam_ids, ix, iy, hits
+            )
+            offset_x = grid_offset[0] - center_x
+            offset_y = grid_offset[1] - center_y
+            free_x, free_y = np.divmod(free_cells, y_w)
+            grid.set(free_x + offset_x, free_y + offset_y, 0.0)  # free area 0.0
+            occ_x, occ_y = np.divmod(cells, y_w)
+            grid.set(occ_x + offset_x, occ_y + offset_y, values)  # occupied area 1.0
+            return grid, min_x, max_x, min_y, max_y, xy_resolution
+        # default 0.5 -- [[0.5 for i in range(y_w)] for i in range(x_w)]
+        if out is None:
+            occupancy_map = np.full((x_w, y_w), 0.5)
+        else:
+            occupancy_map = out
+            occupancy_map.fill(0.5)
+        apply_laser_beams(occupancy_map, laser_beams, beam_ids, ix, iy, hits)
     # occupancy grid computed with bresenham ray casting
-    if breshen:
-        for x, y in zip(ox, oy):
+    elif breshen:
+        occupancy_map = np.full((x_w, y_w), 0.5)
+        for x, y, hit in zip(ox, oy, hits):
             # x coordinate of the the occupied area
             ix = int(round((x - min_x) / xy_resolution))
             # y coordinate of the the occupied area
@@ -180,10 +450,24 @@ def generate_ray_casting_grid_map(ox, oy, xy_resolution, sweepID=None, breshen=T
             )  # line form the lidar to the occupied point
             for laser_beam in laser_beams:
                 occupancy_map[laser_beam[0]][laser_beam[1]] = 0.0  # free area 0.0
+            if not hit:
+                continue  # clipped beam, nothing was hit
             occupancy_map[ix][iy] = 1.0  # occupied area 1.0
             occupancy_map[ix + 1][iy] = 1.0  # extend the occupied area
             occupancy_map[ix][iy + 1] = 1.0  # extend the occupied area
             occupancy_map[ix + 1][iy + 1] = 1.0  # extend the occupied area
+    # occupancy grid computed with vectorized flood fill
+    elif batch:
+        occupancy_map = init_flood_fill_batch(
+            (center_x, center_y), (ox, oy), (x_w, y_w), (min_x, min_y), xy_resolution
+        )
+        flood_fill_batch((center_x, center_y), occupancy_map)
+        ix = np.rint((ox[hits] - min_x) / xy_resolution).astype(np.int64)
+        iy = np.rint((oy[hits] - min_y) / xy_resolution).astype(np.int64)
+        occupancy_map[ix, iy] = 1.0  # occupied area 1.0
+        occupancy_map[ix + 1, iy] = 1.0  # extend the occupied area
+        occupancy_map[ix, iy + 1] = 1.0  # extend the occupied area
+        occupancy_map[ix + 1, iy + 1] = 1.0  # extend the occupied area
     # occupancy grid computed with with flood fill
     else:
         occupancy_map = init_flood_fill(
@@ -191,13 +475,24 @@ def generate_ray_casting_grid_map(ox, oy, xy_resolution, sweepID=None, breshen=T
         )
         flood_fill((center_x, center_y), occupancy_map)
         occupancy_map = np.array(occupancy_map, dtype=float)
-        for x, y in zip(ox, oy):
+        for x, y in zip(ox[hits], oy[hits]):
             ix = int(round((x - min_x) / xy_resolution))
             iy = int(round((y - min_y) / xy_resolution))
             occupancy_map[ix][iy] = 1.0  # occupied area 1.0
             occupancy_map[ix + 1][iy] = 1.0  # extend the occupied area
             occupancy_map[ix][iy + 1] = 1.0  # extend the occupied area
             occupancy_map[ix + 1][iy + 1] = 1.0  # extend the occupied area
+    if grid is not None:
+        known_x, known_y = np.nonzero(occupancy_map != 0.5)
+        grid.set(
+            known_x + grid_offset[0] - center_x,
+            known_y + grid_offset[1] - center_y,
+            occupancy_map[known_x, known_y],
+        )
+        return grid, min_x, max_x, min_y, max_y, xy_resolution
+    if out is not None and occupancy_map is not out:
+        out[...] = occupancy_map
+        occupancy_map = out
     return occupancy_map, min_x, max_x, min_y, max_y, xy_resolution
 
 
@@ -0,0 +1,99 @@
+"""
+
+Batched ray queries against an occupancy grid map: the range the sensor would
+read from a pose at an angle
+
+"""
+
+import numpy as np
+
+from ..profiling import profiler
+
+# a point is at most half a cell diagonal away from the center of its cell, so
+# a distance between cell centers overestimates the free space by a diagonal
+CELL_DIAGONAL = np.sqrt(2.0)
+BOUNDARY_EPSILON = 1e-9  # steps past a cell boundary into the next cell
+
+
+def _next_boundary(g, d):
+    """
+    Ray parameter, in cells, to the next cell boundary along one axis
+    g: grid coordinates of the points, d: direction of the rays
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        step = np.where(d > 0, (np.floor(g) + 1.0 - g) / d, (np.floor(g) - g) / d)
+    return np.where(d == 0, np.inf, step)
+
+
+def expected_ranges(
+    grid_map,
+    min_x,
+    min_y,
+    xy_resolution,
+    poses,
+    angles,
+    max_range,
+    distance_field=None,
+    occupied_threshold=0.5,
+):
+    """
+    Range read by a beam cast from every pose at every angle
+    grid_map: occupancy grid map of generate_ray_casting_grid_map, cells
+    above occupied_threshold stop the beams
+    min_x, min_y: coordinates of the first cell of the map [m]
+    xy_resolution: size of a cell [m]
+    poses: (P, 3) array of (x, y, heading [deg]), the heading is added to the
+    angles, a beam at angle a points along (sin(a), cos(a)) like the sweeps
+    angles: (A,) or (P, A) array of beam angles [deg]
+    max_range: range returned by the beams that hit nothing or leave the map [m]
+    distance_field: optional array of the map shape of the distances [m]
+    from every cell center to the nearest occupied cell center, or any lower
+    bound of them, the beams skip the free space it guarantees
+    Returns a (P, A) array of ranges [m]
+
+    All the beams march together, cell boundary by cell boundary, the ones that
+    hit or ran out of range dropping out at every step.
+    """
+    poses = np.asarray(poses, dtype=np.float64).reshape(-1, 3)
+    theta = np.radians(np.asarray(angles, dtype=np.float64) + poses[:, 2:3])
+    shape = theta.shape
+    dx = np.sin(theta).ravel()
+    dy = np.cos(theta).ravel()
+    # grid coordinates in cells, cell ix spans [ix - 0.5, ix + 0.5) around
+    # min_x + ix * xy_resolution as in generate_ray_casting_grid_map
+    gx0 = np.broadcast_to((poses[:, 0:1] - min_x) / xy_resolution + 0.5, shape).ravel()
+    gy0 = np.broadcast_to((poses[:, 1:2] - min_y) / xy_resolution + 0.5, shape).ravel()
+    limit = max_range / xy_resolution
+    occupied = np.asarray(grid_map) > occupied_threshold
+    rows, columns = occupied.shape
+    occupied = occupied.ravel()
+    skip = None
+    if distance_field is not None:
+        skip = np.maximum(
+            np.asarray(distance_field).ravel() / xy_resolution - CELL_DIAGONAL, 0.0
+        )
+
+    ranges = np.full(dx.size, limit)
+    active = np.arange(dx.size)
+    t = np.zeros(dx.size)
+    while active.size:
+        gx = gx0[active] + t * dx[active]
+        gy = gy0[active] + t * dy[active]
+        ix = np.floor(gx).astype(np.int64)
+        iy = np.floor(gy).astype(np.int64)
+        inside = (ix >= 0) & (ix < rows) & (iy >= 0) & (iy < columns) & (t < limit)
+        cells = np.where(inside, ix * columns + iy, 0)
+        hit = inside & occupied[cells]
+        ranges[active[hit]] = t[hit]
+        going = inside & ~hit
+        active, t, cells = active[going], t[going], cells[going]
+        gx, gy = gx[going], gy[going]
+        # to the next cell, or as far as the distance field guarantees free
+        step = np.minimum(
+            _next_boundary(gx, dx[active]), _next_boundary(gy, dy[active])
+        )
+        if skip is not None:
+            step = np.maximum(step, skip[cells])
+        t = t + step + BOUNDARY_EPSILON
+    profiler.Count("raysQueried", dx.size)
+    return np.minimum(ranges, limit).reshape(shape) * xy_resolution
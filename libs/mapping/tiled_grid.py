@@ -0,0 +1,181 @@
+"""
+
+Sparse tiled grid, fixed-size tiles allocated on demand
+
+"""
+
+import os
+import shutil
+import tempfile
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+
+
+class TiledGrid:
+    """
+    Unbounded 2D grid of cells stored as square tiles keyed by tile
+    coordinate. A tile is only allocated once one of its cells is written, so
+    the memory use follows the observed area instead of its bounding box.
+    With max_tiles set, the least recently used tiles are spilled to disk and
+    loaded back when accessed again. A temporary spill directory is removed by
+    close, or once the grid is garbage collected
+    """
+
+    def __init__(
+        self,
+        tile_size=256,
+        dtype=np.float64,
+        fill_value=0.5,
+        max_tiles=None,
+        spill_dir=None,
+    ):
+        """
+        tile_size: number of cells along the side of a tile
+        dtype: type of the cells
+        fill_value: value of the cells never written
+        max_tiles: maximum number of tiles held in memory, None for no limit
+        spill_dir: directory of the spilled tiles, a temporary one by default
+        """
+        assert max_tiles is None or max_tiles > 0, "max_tiles should be positive"
+        self.tile_size = tile_size
+        self.dtype = np.dtype(dtype)
+        self.fill_value = fill_value
+        self.max_tiles = max_tiles
+        self.spill_dir = spill_dir
+        self.tiles = OrderedDict()
+        self.spilled = set()
+        # removes the spill directory created by the grid, if any
+        self._finalizer = None
+
+    def __len__(self):
+        """
+        Number of allocated tiles, in memory or spilled
+        """
+        return len(self.tiles) + len(self.spilled)
+
+    @property
+    def nbytes(self):
+        """
+        Bytes held in memory by the tiles
+        """
+        return sum(tile.nbytes for tile in self.tiles.values())
+
+    def close(self):
+        """
+        Removes the temporary spill directory and the tiles spilled to it
+        """
+        if self._finalizer is not None:
+            self._finalizer()
+            self._finalizer = None
+            self.spill_dir = None
+            self.spilled.clear()
+
+    def _spill_path(self, key):
+        if self.spill_dir is None:
+            self.spill_dir = tempfile.mkdtemp(prefix="tiled_grid_")
+            self._finalizer = weakref.finalize(
+                self, shutil.rmtree, self.spill_dir, ignore_errors=True
+            )
+        return os.path.join(self.spill_dir, "tile_{}_{}.npy".format(*key))
+
+    def _tile(self, key, create):
+        """
+        Returns the tile of the given key, or None if it does not exist and
+        create is False. The tile becomes the most recently used one
+        """
+        tile = self.tiles.get(key)
+        if tile is not None:
+            self.tiles.move_to_end(key)
+            return tile
+        if key in self.spilled:
+            path = self._spill_path(key)
+            tile = np.load(path)
+            os.remove(path)
+            self.spilled.remove(key)
+        elif create:
+            tile = np.full(
+                (self.tile_size, self.tile_size), self.fill_value, self.dtype
+            )
+        else:
+            return None
+        self.tiles[key] = tile
+        # spill the least recently used tiles
+        while self.max_tiles is not None and len(self.tiles) > self.max_tiles:
+            old_key, old_tile = self.tiles.popitem(last=False)
+            np.save(self._spill_path(old_key), old_tile)
+            self.spilled.add(old_key)
+        return tile
+
+    def _group_by_tile(self, ix, iy):
+        """
+        Yields the tile key, local cell coordinates and the positions in the
+        input arrays of the cells of every tile touched
+        """
+        ix = np.asarray(ix, dtype=np.int64).ravel()
+        iy = np.asarray(iy, dtype=np.int64).ravel()
+        tx, lx = np.divmod(ix, self.tile_size)
+        ty, ly = np.divmod(iy, self.tile_size)
+        order = np.lexsort((ty, tx))
+        tx, ty = tx[order], ty[order]
+        bounds = np.flatnonzero((tx[1:] != tx[:-1]) | (ty[1:] != ty[:-1])) + 1
+        for start, end in zip(np.r_[0, bounds], np.r_[bounds, len(order)]):
+            cells = order[start:end]
+            yield (int(tx[start]), int(ty[start])), lx[cells], ly[cells], cells
+
+    def get(self, ix, iy):
+        """
+        Values of the cells (ix, iy)
+        """
+        values = np.full(np.size(ix), self.fill_value, self.dtype)
+        for key, lx, ly, cells in self._group_by_tile(ix, iy):
+            tile = self._tile(key, create=False)
+            if tile is not None:
+                values[cells] = tile[lx, ly]
+        return values
+
+    def set(self, ix, iy, values):
+        """
+        Writes values, a scalar or one per cell, into the cells (ix, iy)
+        """
+        values = np.broadcast_to(values, np.shape(np.ravel(ix)))
+        for key, lx, ly, cells in self._group_by_tile(ix, iy):
+            self._tile(key, create=True)[lx, ly] = values[cells]
+
+    def add(self, ix, iy, delta, min_value=None, max_value=None):
+        """
+        Adds delta to the cells (ix, iy), clipped to [min_value, max_value],
+        every cell should appear once
+        """
+        for key, lx, ly, cells in self._group_by_tile(ix, iy):
+            tile = self._tile(key, create=True)
+            values = tile[lx, ly].astype(np.float64) + delta
+            if min_value is not None or max_value is not None:
+                values = np.clip(values, min_value, max_value)
+            tile[lx, ly] = values
+
+    def bounds(self):
+        """
+        (min_ix, min_iy, max_ix, max_iy) cell bounds of the allocated tiles,
+        max excluded
+        """
+        keys = np.array(list(self.tiles) + list(self.spilled)).reshape(-1, 2)
+        assert len(keys) > 0, "the grid is empty"
+        min_tx, min_ty = keys.min(axis=0)
+        max_tx, max_ty = keys.max(axis=0) + 1
+        ts = self.tile_size
+        return min_tx * ts, min_ty * ts, max_tx * ts, max_ty * ts
+
+    def to_dense(self):
+        """
+        Dense copy of the allocated area, returns the array and the cell
+        coordinates (ix, iy) of its first cell
+        """
+        min_ix, min_iy, max_ix, max_iy = self.bounds()
+        dense = np.full((max_ix - min_ix, max_iy - min_iy), self.fill_value, self.dtype)
+        ts = self.tile_size
+        for key in list(self.tiles) + list(self.spilled):
+            x0, y0 = key[0] * ts - min_ix, key[1] * ts - min_iy
+            dense[x0 : x0 + ts, y0 : y0 + ts] = self._tile(key, create=False)
+        return dense, min_ix, min_iy
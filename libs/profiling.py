@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+__author__ = "Ashesh Vasalya"
+
+import json
+import time
+import functools
+import tracemalloc
+
+""" Per stage timers and counters of the lidar pipeline.
+
+    The module wide profiler is disabled by default, a disabled timer is one
+    shared no-op context manager and a disabled counter returns at once, so the
+    instrumented code runs at full speed unless profiling was asked for. Once
+    enabled, every stage records its number of calls, total and longest time,
+    and optionally its tracemalloc peak memory, globally and per sweep.
+
+    Only the work done in this process is recorded, except the ray casting time
+    of ComputeGridMaps(), which its worker processes send back with the maps.
+
+    Example usage:
+    from profiling import profiler, Timed
+    profiler.Enable(traceMemory=True)
+    with profiler.Timer("ExtractSweepsFromMeasurements"):
+        lidarSweepsList = ExtractSweepsFromMeasurements(angles, distances)
+    profiler.Count("samplesParsed", len(angles))
+    profiler.WriteReport("profile.json")
+"""
+
+
+class _NullTimer:
+    """
+    Timer of a disabled profiler, does nothing.
+    """
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _StageTimer:
+    """
+    Times one run of a stage, and measures its peak memory when traced.
+    """
+
+    __slots__ = ("profiler", "stage", "sweepID", "start", "peakBytes")
+
+    def __init__(self, profiler, stage, sweepID):
+        self.profiler = profiler
+        self.stage = stage
+        self.sweepID = sweepID
+        self.peakBytes = 0
+
+    def __enter__(self):
+        profiler = self.profiler
+        if profiler.traceMemory:
+            # the peak so far belongs to the enclosing stage, the peak is then
+            # reset to measure this stage on its own
+            _, peakBytes = tracemalloc.get_traced_memory()
+            if profiler._stack:
+                parent = profiler._stack[-1]
+                parent.peakBytes = max(parent.peakBytes, peakBytes)
+            if hasattr(tracemalloc, "reset_peak"):
+                tracemalloc.reset_peak()
+        profiler._stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        profiler = self.profiler
+        profiler._stack.pop()
+        peakBytes = None
+        if profiler.traceMemory:
+            peakBytes = max(self.peakBytes, tracemalloc.get_traced_memory()[1])
+            if profiler._stack:
+                parent = profiler._stack[-1]
+                parent.peakBytes = max(parent.peakBytes, peakBytes)
+        profiler.AddTime(self.stage, seconds, self.sweepID, peakBytes)
+        return False
+
+
+class Profiler:
+    """
+    Collects the time spent per stage and the counters of the pipeline.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.traceMemory = False
+        self.startedTracing = False
+        self.Reset()
+
+    def Reset(self):
+        """
+        Forgets every recorded time and counter.
+        """
+        self.stages = {}
+        self.counters = {}
+        self.sweeps = {}
+        self._stack = []
+        self.startTime = time.perf_counter()
+
+    def Enable(self, traceMemory=False):
+        """
+        Starts recording.
+
+        Args:
+            traceMemory (bool): If True also measure the peak memory of every
+            stage with tracemalloc, which slows down the allocations.
+        """
+        self.enabled = True
+        self.traceMemory = traceMemory
+        if traceMemory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.startedTracing = True
+        self.Reset()
+
+    def Disable(self):
+        """
+        Stops recording, the recorded times and counters are kept.
+        """
+        # tracing started by someone else is left running
+        if self.startedTracing:
+            tracemalloc.stop()
+            self.startedTracing = False
+        self.enabled = False
+        self.traceMemory = False
+
+    def Timer(self, stage, sweepID=None):
+        """
+        Context manager timing one run of a stage.
+
+        Args:
+            stage (str): Name of the stage.
+            sweepID (int): Optional ID of the sweep processed by this run.
+        """
+        if not self.enabled:
+            return _NULL_TIMER
+        return _StageTimer(self, stage, sweepID)
+
+    def _GetSweep(self, sweepID):
+        sweep = self.sweeps.get(sweepID)
+        if sweep is None:
+            sweep = self.sweeps[sweepID] = {"stages": {}, "counters": {}}
+        return sweep
+
+    def AddTime(self, stage, seconds, sweepID=None, peakBytes=None):
+        """
+        Records one run of a stage timed elsewhere, in a worker process for instance.
+
+        Args:
+            stage (str): Name of the stage.
+            seconds (float): Duration of the run.
+            sweepID (int): Optional ID of the sweep processed by this run.
+            peakBytes (int): Optional peak memory allocated by the run.
+        """
+        if not self.enabled:
+            return
+        record = self.stages.get(stage)
+        if record is None:
+            record = self.stages[stage] = {
+                "calls": 0,
+                "seconds": 0.0,
+                "maxSeconds": 0.0,
+            }
+        record["calls"] += 1
+        record["seconds"] += seconds
+        record["maxSeconds"] = max(record["maxSeconds"], seconds)
+        if peakBytes is not None:
+            record["peakBytes"] = max(record.get("peakBytes", 0), peakBytes)
+        if sweepID is not None:
+            stages = self._GetSweep(int(sweepID))["stages"]
+            stages[stage] = stages.get(stage, 0.0) + seconds
+
+    def Count(self, counter, value=1, sweepID=None):
+        """
+        Adds value to a counter.
+
+        Args:
+            counter (str): Name of the counter.
+            value (int): Amount added.
+            sweepID (int): Optional ID of the sweep the amount belongs to.
+        """
+        if not self.enabled:
+            return
+        self.counters[counter] = self.counters.get(counter, 0) + int(value)
+        if sweepID is not None:
+            counters = self._GetSweep(int(sweepID))["counters"]
+            counters[counter] = counters.get(counter, 0) + int(value)
+
+    def GetReport(self):
+        """
+        Returns:
+            dict: "totalSeconds" since the profiler was enabled, "stages" with the
+            calls, total, longest and mean seconds and peak memory of every stage,
+            "counters", and "sweeps" the stage seconds and counters per sweep ID.
+        """
+        stages = {}
+        for stage, record in self.stages.items():
+            stages[stage] = dict(
+                record, meanSeconds=record["seconds"] / record["calls"]
+            )
+        return {
+            "totalSeconds": time.perf_counter() - self.startTime,
+            "stages": stages,
+            "counters": dict(self.counters),
+            "sweeps": {
+                str(sweepID): self.sweeps[sweepID] for sweepID in sorted(self.sweeps)
+            },
+        }
+
+    def WriteReport(self, fileName):
+        """
+        Writes the report of GetReport() to a JSON file.
+
+        Args:
+            fileName (str): The name of the JSON file to write.
+        """
+        with open(fileName, "w") as fileHandler:
+            json.dump(self.GetReport(), fileHandler, indent=2)
+
+
+# the profiler of the whole process, shared by every instrumented module
+profiler = Profiler()
+
+
+def Timed(stage=None):
+    """
+    Decorator timing every call of a function as a stage of the profiler.
+
+    Args:
+        stage (str): Name of the stage, the name of the function by default.
+    """
+
+    def Decorator(function):
+        name = stage or function.__name__
+
+        @functools.wraps(function)
+        def Wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return function(*args, **kwargs)
+            with profiler.Timer(name):
+                return function(*args, **kwargs)
+
+        return Wrapper
+
+    return Decorator
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+__author__ = "Ashesh Vasalya"
+
+import os
+import numpy
+from concurrent.futures import ProcessPoolExecutor
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+from .lidarutils import (
+    ComputeGridMaps,
+    DecodeGridMap,
+    DrawAllSweepsWithDronePath,
+    DrawGlobalMap,
+    logHandle,
+)
+from .gridcache import GridMapCache
+from .projection import ProjectSweepSet
+from .sweepset import SweepSet
+from .profiling import Timed, profiler
+
+""" Headless PNG rendering of the sweep and flight path figures.
+
+    Figures are drawn on the non-interactive Agg canvas, without pyplot, so
+    rendering works on servers without a display and never waits for input.
+
+    Example usage:
+    from render import RenderSweepFrames
+    fileNames = RenderSweepFrames(lidarSweepsList, "output", jobs=8)
+"""
+
+
+class SweepFrameRenderer:
+    """
+    Renders the grid map and lidar measurement map of a sweep into a PNG file.
+
+    The figure, its axes and artists are created once, each frame only updates
+    their data and extents, which is several times faster than building a new
+    figure per sweep.
+    """
+
+    def __init__(self, sampling=2, dpi=100):
+        """
+        Args:
+            sampling (int): Sampling interval for displaying lidar measurements.
+            dpi (int): Resolution of the rendered frames.
+        """
+        assert (
+            isinstance(sampling, int) and sampling > 0
+        ), "sampling should be a positive integer"
+        self.sampling = sampling
+        self.dpi = dpi
+
+        self.figure = Figure(figsize=(10, 5))
+        FigureCanvasAgg(self.figure)
+        self.gridAxes = self.figure.add_subplot(121)
+        self.gridImage = self.gridAxes.imshow(
+            numpy.full((1, 1), 0.5), cmap="RdYlGn_r", vmin=0.0, vmax=1.0
+        )
+        self.figure.colorbar(self.gridImage, ax=self.gridAxes)
+
+        self.measurementAxes = self.figure.add_subplot(122)
+        (self.beams,) = self.measurementAxes.plot([], [], "ro-")
+        self.measurementAxes.plot(0, 0, "ob")
+
+    def Render(self, sweepID, gridMap, ox, oy, fileName):
+        """
+        Draws one sweep and saves the frame.
+
+        Args:
+            sweepID (int): ID of the sweep, shown in the titles.
+            gridMap (numpy.ndarray): Occupancy grid map of the sweep.
+            ox (numpy.ndarray): x coordinates of the samples around the lidar.
+            oy (numpy.ndarray): y coordinates of the samples around the lidar.
+            fileName (str): The name of the PNG file to write.
+        """
+        with profiler.Timer("SweepFrameRenderer.Render", sweepID):
+            self._Draw(sweepID, gridMap, ox, oy, fileName)
+        profiler.Count("framesRendered", sweepID=sweepID)
+
+    def _Draw(self, sweepID, gridMap, ox, oy, fileName):
+        rows, columns = gridMap.shape
+        self.gridImage.set_data(gridMap)
+        self.gridImage.set_extent((-0.5, columns - 0.5, rows - 0.5, -0.5))
+        self.gridAxes.set_xlim(-0.5, columns - 0.5)
+        self.gridAxes.set_ylim(rows - 0.5, -0.5)
+        self.gridAxes.set_title("gridMap=%i" % sweepID)
+
+        # one polyline for all beams, each beam separated from the next by a NaN
+        ox, oy = ox[:: self.sampling], oy[:: self.sampling]
+        zeros = numpy.zeros(len(ox))
+        nans = numpy.full(len(ox), numpy.nan)
+        self.beams.set_data(
+            numpy.column_stack((oy, zeros, nans)).ravel(),
+            numpy.column_stack((ox, zeros, nans)).ravel(),
+        )
+        self.measurementAxes.relim()
+        self.measurementAxes.autoscale_view()
+        bottom, top = self.measurementAxes.get_ylim()
+        self.measurementAxes.set_ylim(max(bottom, top), min(bottom, top))
+        self.measurementAxes.set_title("lidarMeasurementMap=%i" % sweepID)
+
+        self.figure.savefig(fileName, dpi=self.dpi)
+
+
+def _RenderSweepFrames(task):
+    """
+    Renders a contiguous chunk of sweeps, in a worker process of RenderSweepFrames().
+
+    Args:
+        task (tuple): (sweeps, fileNames, xy_resolution, sampling, cacheDir,
+        maxRange).
+
+    Returns:
+        list: The names of the written files.
+    """
+    sweeps, fileNames, xy_resolution, sampling, cacheDir, maxRange = task
+    renderer = SweepFrameRenderer(sampling)
+    # every worker reads and writes the on-disk tier of the cache directly
+    cache = None if cacheDir is None else GridMapCache(cacheDir)
+    gridMaps = ComputeGridMaps(
+        sweeps, xy_resolution, True, jobs=1, cache=cache, maxRange=maxRange
+    )
+    sweeps = SweepSet.FromSweeps(sweeps)
+    points = numpy.split(ProjectSweepSet(sweeps), sweeps.offsets[1:-1])
+    for sweepPoints, gridMap, fileName in zip(points, gridMaps, fileNames):
+        ox, oy = sweepPoints[:, 0], sweepPoints[:, 1]
+        renderer.Render(
+            gridMap["sweepID"], DecodeGridMap(gridMap["gridMap"]), ox, oy, fileName
+        )
+    return fileNames
+
+
+@Timed()
+def RenderSweepFrames(
+    lidarSweepsList,
+    outputDir="output",
+    sampling=2,
+    xy_resolution=0.01,
+    jobs=1,
+    cacheDir=None,
+    maxRange=None,
+):
+    """
+    Renders the grid map and lidar measurement map of every sweep to
+    outputDir/sweepID_<sweepID>.png, without any window.
+
+    Args:
+        lidarSweepsList (list): List of dictionaries with the keys "angles" and
+        "distances".
+        outputDir (str): Directory of the PNG files, created if missing.
+        sampling (int): Sampling interval for displaying lidar measurements.
+        xy_resolution (float): Resolution of the grid maps.
+        jobs (int): Number of worker processes, each renders a contiguous chunk
+        of sweeps with its own figure. None uses one process per CPU.
+        cacheDir (str): Optional directory of a GridMapCache of the grid maps.
+        maxRange (float): Optional max range of fixed extent grid maps, see
+        ComputeGridMaps().
+
+    Returns:
+        list: The names of the written files, in the order of lidarSweepsList.
+
+    Raises:
+        AssertionError: If lidarSweepsList is empty or jobs is not positive.
+    """
+    assert len(lidarSweepsList) > 0, "lidarSweepsList should not be empty"
+    assert jobs is None or jobs > 0, "jobs should be a positive integer or None"
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    os.makedirs(outputDir, exist_ok=True)
+
+    sweeps = [
+        {
+            "sweepID": sweep.get("sweepID", index),
+            "angles": numpy.asarray(sweep["angles"]),
+            "distances": numpy.asarray(sweep["distances"]),
+        }
+        for index, sweep in enumerate(lidarSweepsList)
+    ]
+    fileNames = [
+        os.path.join(outputDir, "sweepID_{}.png".format(sweep["sweepID"]))
+        for sweep in sweeps
+    ]
+
+    jobs = min(jobs, len(sweeps))
+    logHandle.log.info(
+        "Rendering %d sweep frames to %s with %d process(es)",
+        len(sweeps),
+        outputDir,
+        jobs,
+    )
+    bounds = numpy.linspace(0, len(sweeps), jobs + 1).astype(int)
+    tasks = [
+        (
+            sweeps[start:end],
+            fileNames[start:end],
+            xy_resolution,
+            sampling,
+            cacheDir,
+            maxRange,
+        )
+        for start, end in zip(bounds[:-1], bounds[1:])
+    ]
+    if jobs == 1:
+        return _RenderSweepFrames(tasks[0])
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        return [
+            fileName
+            for chunk in executor.map(_RenderSweepFrames, tasks)
+            for fileName in chunk
+        ]
+
+
+@Timed()
+def RenderAllSweepsWithDronePath(
+    lidarSweepsList,
+    fileName=os.path.join("output", "dronePathAndScans.png"),
+    sampling=2,
+):
+    """
+    Renders all the LIDAR sweeps along with the drone's flight path to a PNG
+    file, without any window.
+
+    Args:
+        lidarSweepsList (list): List of LiDAR sweep dictionaries.
+        fileName (str): The name of the PNG file to write.
+        sampling (int): Downsample factor for lidar sweep visualization.
+
+    Returns:
+        str: The name of the written file.
+    """
+    figure = Figure(figsize=(15, 8))
+    FigureCanvasAgg(figure)
+    DrawAllSweepsWithDronePath(figure.add_subplot(), lidarSweepsList, sampling)
+    os.makedirs(os.path.dirname(fileName) or ".", exist_ok=True)
+    figure.savefig(fileName)
+    logHandle.log.info("Drone path and sweeps rendered to %s", fileName)
+    return fileName
+
+
+@Timed()
+def RenderGlobalMap(globalMap, fileName=os.path.join("output", "globalMap.png")):
+    """
+    Renders the occupancy probability of a global map to a PNG file, without
+    any window.
+
+    Args:
+        globalMap (global_map.GlobalOccupancyMap): The map to render.
+        fileName (str): The name of the PNG file to write.
+
+    Returns:
+        str: The name of the written file.
+    """
+    figure = Figure(figsize=(10, 8))
+    FigureCanvasAgg(figure)
+    DrawGlobalMap(figure, figure.add_subplot(), globalMap)
+    os.makedirs(os.path.dirname(fileName) or ".", exist_ok=True)
+    figure.savefig(fileName)
+    logHandle.log.info("Global map rendered to %s", fileName)
+    return fileName
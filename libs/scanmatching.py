@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+__author__ = "Ashesh Vasalya"
+
+import os
+import numpy
+from concurrent.futures import ProcessPoolExecutor
+
+from .sweepset import SweepSet
+from .projection import ProjectToWorldFrame
+from .spatialindex import SpatialIndex
+from .profiling import Timed, profiler
+
+""" Scan to scan matching of lidar sweeps with the iterative closest point
+    algorithm (ICP).
+
+    The samples of a sweep are placed around the drone in the axes of the
+    world frame, x = d*cos(a) and y = -d*sin(a), by ProjectToWorldFrame(), so
+    the motions compare with the flight path as is, and the pose (x, y, theta)
+    of a source sweep relative to a target sweep moves the source points onto
+    the target points, q = R(theta) * p + (x, y). Every iteration matches all
+    the source points at once to their nearest target point, looked up in a
+    SpatialIndex of cells of maxCorrespondenceDistance, and then solves the pose
+    in closed form (point to point) or by linearized least squares (point to
+    line, along the normals of the target sweep). A point to line step whose
+    least squares are near singular, on a corridor or a single wall, or which
+    moves by more than maxCorrespondenceDistance is replaced by the point to
+    point step, and an iteration losing the correspondences keeps the last pose
+    that had them.
+
+    Example usage:
+    from scanmatching import MatchConsecutiveSweeps, EstimateFlightPath
+    matches = MatchConsecutiveSweeps(lidarSweepsList, method="line", jobs=4)
+    poses = EstimateFlightPath([match["pose"] for match in matches], start)
+"""
+
+METHODS = ("point", "line")
+# point to line least squares less well conditioned are not trusted
+MAX_CONDITION_NUMBER = 1e3
+
+
+def GetScanPoints(angles, distances):
+    """
+    Places the samples of a sweep around the drone, in the axes of the world frame.
+
+    Args:
+        angles (numpy.ndarray): 1D array of angles in degrees.
+        distances (numpy.ndarray): 1D array of distances.
+
+    Returns:
+        numpy.ndarray: (N, 2) array of (x, y), x = d*cos(a) and y = -d*sin(a).
+    """
+    return ProjectToWorldFrame(angles, distances, (0.0, 0.0))
+
+
+def GetRotation(theta):
+    """
+    Returns:
+        numpy.ndarray: 2x2 rotation matrix of the angle theta in radians.
+    """
+    cos, sin = numpy.cos(theta), numpy.sin(theta)
+    return numpy.array([[cos, -sin], [sin, cos]])
+
+
+def TransformPoints(points, pose):
+    """
+    Moves points by a pose.
+
+    Args:
+        points (numpy.ndarray): (N, 2) array of points.
+        pose (numpy.ndarray): (x, y, theta) translation and rotation in radians.
+
+    Returns:
+        numpy.ndarray: (N, 2) array of R(theta) * p + (x, y).
+    """
+    return points @ GetRotation(pose[2]).T + numpy.asarray(pose[:2])
+
+
+def WrapAngle(theta):
+    """
+    Returns:
+        float: The angle theta in radians wrapped to [-pi, pi].
+    """
+    return numpy.arctan2(numpy.sin(theta), numpy.cos(theta))
+
+
+def ComposePoses(first, second):
+    """
+    Chains two relative poses, second being expressed in the frame of first.
+
+    Returns:
+        numpy.ndarray: (x, y, theta) of the pose moving by second, then by first,
+        theta wrapped to [-pi, pi].
+    """
+    x, y = TransformPoints(numpy.reshape(second[:2], (1, 2)), first)[0]
+    return numpy.array([x, y, WrapAngle(first[2] + second[2])])
+
+
+def GetScanNormals(points, maxGap):
+    """
+    Unit normals of a sweep, across the line through the previous and the next
+    sample.
+
+    Args:
+        points (numpy.ndarray): (N, 2) points of the sweep, in angle order.
+        maxGap (float): Samples farther than maxGap from a neighbour, on a
+        depth jump, get no normal.
+
+    Returns:
+        numpy.ndarray: (N, 2) array of normals, NaN where there is none.
+    """
+    previous = numpy.roll(points, 1, axis=0)
+    following = numpy.roll(points, -1, axis=0)
+    tangents = following - previous
+    normals = numpy.column_stack((-tangents[:, 1], tangents[:, 0]))
+    lengths = numpy.hypot(normals[:, 0], normals[:, 1])
+    gaps = numpy.maximum(
+        numpy.hypot(*(points - previous).T), numpy.hypot(*(following - points).T)
+    )
+    valid = (lengths > 0) & (gaps <= maxGap)
+    normals[valid] /= lengths[valid, None]
+    normals[~valid] = numpy.nan
+    return normals
+
+
+def _SolvePointToPoint(source, target):
+    """
+    Closed form rigid motion moving the source points onto the target points.
+    """
+    sourceMean = source.mean(axis=0)
+    targetMean = target.mean(axis=0)
+    covariance = (source - sourceMean).T @ (target - targetMean)
+    theta = numpy.arctan2(
+        covariance[0, 1] - covariance[1, 0], covariance[0, 0] + covariance[1, 1]
+    )
+    x, y = targetMean - GetRotation(theta) @ sourceMean
+    return numpy.array([x, y, theta])
+
+
+def _SolvePointToLine(source, target, normals):
+    """
+    Small rigid motion minimizing the distances of the source points to the
+    lines through the target points, linearized in the rotation.
+
+    Returns:
+        numpy.ndarray: (x, y, theta) step, None if the least squares are near
+        singular.
+    """
+    jacobian = numpy.column_stack(
+        (
+            normals[:, 0],
+            normals[:, 1],
+            source[:, 0] * normals[:, 1] - source[:, 1] * normals[:, 0],
+        )
+    )
+    residuals = ((target - source) * normals).sum(axis=1)
+    step, _, rank, singularValues = numpy.linalg.lstsq(jacobian, residuals, rcond=None)
+    if rank < 3 or singularValues[0] > MAX_CONDITION_NUMBER * singularValues[-1]:
+        return None
+    return step
+
+
+def MatchScans(
+    source,
+    target,
+    initialPose=(0.0, 0.0, 0.0),
+    method="line",
+    maxCorrespondenceDistance=0.5,
+    maxIterations=50,
+    tolerance=1e-6,
+    minCorrespondences=10,
+):
+    """
+    Estimates the pose of a source sweep relative to a target sweep with ICP.
+
+    Args:
+        source (numpy.ndarray): (N, 2) points of the source sweep, see GetScanPoints().
+        target (numpy.ndarray): (M, 2) points of the target sweep, in angle order.
+        initialPose (tuple): (x, y, theta) first guess of the pose, theta in radians.
+        method (str): "point" for point to point, "line" for point to line ICP.
+        maxCorrespondenceDistance (float): Pairs farther apart are ignored.
+        maxIterations (int): Maximum number of iterations.
+        tolerance (float): The iterations stop once the pose moves by less.
+        minCorrespondences (int): Fewest pairs needed to solve a pose.
+
+    Returns:
+        dict: "pose" (x, y, theta) of the source in the frame of the target,
+        "rmse" of the matched pairs, "numCorrespondences", "iterations" and
+        "converged". With fewer than minCorrespondences pairs, "pose" is the
+        last pose that had enough of them, or initialPose, and "rmse" is inf.
+
+    Raises:
+        AssertionError: If method is not one of METHODS.
+    """
+    assert method in METHODS, "method should be one of {}".format(METHODS)
+    source = numpy.asarray(source, dtype=numpy.float64)
+    target = numpy.asarray(target, dtype=numpy.float64)
+    index = SpatialIndex(maxCorrespondenceDistance, target)
+    normals = None
+    if method == "line":
+        normals = GetScanNormals(target, maxCorrespondenceDistance)
+
+    pose = numpy.array(initialPose, dtype=numpy.float64)
+    pose[2] = WrapAngle(pose[2])
+    # last pose with enough correspondences
+    goodPose = pose
+    result = {"rmse": numpy.inf, "numCorrespondences": 0, "converged": False}
+    for iteration in range(1, maxIterations + 1):
+        moved = TransformPoints(source, pose)
+        indices, distances = index.QueryNearest(
+            moved, maxDistance=maxCorrespondenceDistance
+        )
+        indices, distances = indices[:, 0], distances[:, 0]
+        matched = indices >= 0
+        if normals is not None:
+            matched[matched] = ~numpy.isnan(normals[indices[matched], 0])
+        result["numCorrespondences"] = int(numpy.count_nonzero(matched))
+        if result["numCorrespondences"] < minCorrespondences:
+            pose = goodPose
+            result["rmse"] = numpy.inf
+            break
+        goodPose = pose
+        result["rmse"] = float(numpy.sqrt(numpy.mean(distances[matched] ** 2)))
+
+        pairs = target[indices[matched]]
+        step = None
+        if normals is not None:
+            step = _SolvePointToLine(moved[matched], pairs, normals[indices[matched]])
+            if step is not None and numpy.hypot(step[0], step[1]) > (
+                maxCorrespondenceDistance
+            ):
+                step = None
+        if step is None:
+            step = _SolvePointToPoint(moved[matched], pairs)
+        pose = ComposePoses(step, pose)
+        if numpy.hypot(step[0], step[1]) < tolerance and abs(step[2]) < tolerance:
+            result["converged"] = True
+            break
+
+    result["pose"] = pose
+    result["iterations"] = iteration
+    return result
+
+
+def _MatchSweepPairs(tasks):
+    """
+    Matches several sweep pairs, in a worker process of MatchConsecutiveSweeps().
+
+    Args:
+        tasks (list): (source, target, initialPose, options) tuples.
+
+    Returns:
+        list: The result of MatchScans() for every pair.
+    """
+    return [
+        MatchScans(source, target, initialPose, **options)
+        for source, target, initialPose, options in tasks
+    ]
+
+
+@Timed()
+def MatchConsecutiveSweeps(
+    lidarSweepsList, method="line", useFlightPath=False, jobs=1, **options
+):
+    """
+    Estimates the pose of every sweep relative to the previous sweep, the
+    pairs being matched across a pool of worker processes.
+
+    Args:
+        lidarSweepsList (SweepSet): The sweeps, or a list of sweep dictionaries.
+        method (str): "point" for point to point, "line" for point to line ICP.
+        useFlightPath (bool): If True and the sweeps have coordinates, start
+        from the flight path motion, to refine it, else from no motion.
+        jobs (int): Number of worker processes, None for one per CPU.
+        **options: Other arguments of MatchScans().
+
+    Returns:
+        list: One result of MatchScans() per pair of consecutive sweeps, with
+        the extra keys "sweepID" of the source and "targetSweepID".
+
+    Raises:
+        AssertionError: If there are fewer than two sweeps or jobs is not positive.
+    """
+    assert len(lidarSweepsList) > 1, "at least two sweeps are needed"
+    assert jobs is None or jobs > 0, "jobs should be a positive integer or None"
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    lidarSweepsList = SweepSet.FromSweeps(lidarSweepsList)
+
+    points = [GetScanPoints(sweep.angles, sweep.distances) for sweep in lidarSweepsList]
+    motions = numpy.zeros((len(points) - 1, 2))
+    if useFlightPath and not numpy.isnan(lidarSweepsList.poses).any():
+        motions = numpy.diff(lidarSweepsList.poses, axis=0)
+    options = dict(options, method=method)
+    tasks = [
+        (points[index + 1], points[index], (*motions[index], 0.0), options)
+        for index in range(len(points) - 1)
+    ]
+
+    jobs = max(1, min(jobs, len(tasks)))
+    if jobs == 1:
+        results = _MatchSweepPairs(tasks)
+    else:
+        bounds = numpy.linspace(0, len(tasks), jobs + 1).astype(int)
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = [
+                result
+                for chunk in executor.map(
+                    _MatchSweepPairs,
+                    [tasks[start:end] for start, end in zip(bounds[:-1], bounds[1:])],
+                )
+                for result in chunk
+            ]
+
+    sweepIDs = lidarSweepsList.sweepIDs
+    for index, result in enumerate(results):
+        result["sweepID"] = int(sweepIDs[index + 1])
+        result["targetSweepID"] = int(sweepIDs[index])
+    profiler.Count("sweepPairsMatched", len(results))
+    return results
+
+
+def EstimateFlightPath(relativePoses, start=(0.0, 0.0), heading=0.0):
+    """
+    Chains the relative poses of consecutive sweeps into a flight path.
+
+    Args:
+        relativePoses (list): (x, y, theta) pose of every sweep relative to the
+        previous one, see MatchConsecutiveSweeps().
+        start (tuple): Coordinates of the first sweep.
+        heading (float): Heading of the first sweep in radians.
+
+    Returns:
+        numpy.ndarray: (len(relativePoses) + 1, 3) array of (x, y, heading).
+    """
+    poses = numpy.empty((len(relativePoses) + 1, 3))
+    poses[0] = (start[0], start[1], heading)
+    for index, relativePose in enumerate(relativePoses):
+        poses[index + 1] = ComposePoses(poses[index], relativePose)
+    return poses
@@ -0,0 +1,427 @@
+#!/usr/bin/env python3
+__author__ = "Ashesh Vasalya"
+
+import bisect
+import numpy
+
+from . import sweepstore
+from .lidarutils import logHandle
+from .projection import GetWorldUnitVectors
+
+""" Synthetic drone missions ray cast against a procedural room layout.
+
+    A building is a grid of rooms of random sizes, every wall between two
+    neighbouring rooms has a door at a random position. The drone flies from
+    room to room through the doors in a serpentine order, and every sweep is
+    ray cast against the wall segments in the world frame, x = px + d*cos(a)
+    and y = py - d*sin(a), like the recorded missions, see ProjectToWorldFrame().
+
+    Example usage:
+    from simulation import GenerateMission, WriteMissionFiles
+    mission = GenerateMission(roomsX=4, roomsY=5, seed=3)
+    WriteMissionFiles(mission, "LIDARPoints.csv", "FlightPath.csv")
+"""
+
+
+def GenerateRoomLayout(
+    roomsX,
+    roomsY,
+    roomWidth=5.0,
+    roomLength=6.0,
+    sizeJitter=0.3,
+    doorWidth=1.0,
+    randomState=None,
+):
+    """
+    Generates the walls of a building made of roomsX by roomsY rooms.
+
+    Args:
+        roomsX (int): Number of rooms along x.
+        roomsY (int): Number of rooms along y.
+        roomWidth (float): Mean size of the rooms along x, in meters.
+        roomLength (float): Mean size of the rooms along y, in meters.
+        sizeJitter (float): Relative random variation of the room sizes.
+        doorWidth (float): Width of the doors, in meters.
+        randomState (numpy.random.RandomState): Source of randomness.
+
+    Returns:
+        dict: "walls" (M, 4) array of x0, y0, x1, y1 wall segments, "xEdges" and
+        "yEdges" the coordinates of the room boundaries, "roomWalls" a dict from
+        the (ix, iy) index of a room to the indices of the walls bounding it, and
+        "doors" a dict from a pair of neighbouring rooms to their door centre.
+
+    Raises:
+        AssertionError: If the rooms are too small for their doors.
+    """
+    assert roomsX > 0 and roomsY > 0, "roomsX and roomsY should be positive"
+    assert 0 <= sizeJitter < 1, "sizeJitter should be in [0, 1)"
+    randomState = randomState or numpy.random.RandomState()
+    widths = roomWidth * (1 + sizeJitter * randomState.uniform(-1, 1, roomsX))
+    lengths = roomLength * (1 + sizeJitter * randomState.uniform(-1, 1, roomsY))
+    assert (
+        min(widths.min(), lengths.min()) > doorWidth + 0.5
+    ), "rooms should be wider than their doors"
+    xEdges = numpy.concatenate(([0.0], numpy.cumsum(widths)))
+    yEdges = numpy.concatenate(([0.0], numpy.cumsum(lengths)))
+
+    walls = []
+    roomWalls = {(ix, iy): [] for ix in range(roomsX) for iy in range(roomsY)}
+    doors = {}
+    margin = doorWidth / 2 + 0.25
+
+    def AddWall(segment, rooms):
+        for room in rooms:
+            if room in roomWalls:
+                roomWalls[room].append(len(walls))
+        walls.append(segment)
+
+    # vertical walls between rooms (ix - 1, iy) and (ix, iy), solid on the outside
+    for ix in range(roomsX + 1):
+        for iy in range(roomsY):
+            low, high = yEdges[iy], yEdges[iy + 1]
+            rooms = ((ix - 1, iy), (ix, iy))
+            if ix in (0, roomsX):
+                AddWall((xEdges[ix], low, xEdges[ix], high), rooms)
+                continue
+            door = randomState.uniform(low + margin, high - margin)
+            AddWall((xEdges[ix], low, xEdges[ix], door - doorWidth / 2), rooms)
+            AddWall((xEdges[ix], door + doorWidth / 2, xEdges[ix], high), rooms)
+            doors[rooms] = (xEdges[ix], door)
+
+    # horizontal walls between rooms (ix, iy - 1) and (ix, iy), solid on the outside
+    for iy in range(roomsY + 1):
+        for ix in range(roomsX):
+            low, high = xEdges[ix], xEdges[ix + 1]
+            rooms = ((ix, iy - 1), (ix, iy))
+            if iy in (0, roomsY):
+                AddWall((low, yEdges[iy], high, yEdges[iy]), rooms)
+                continue
+            door = randomState.uniform(low + margin, high - margin)
+            AddWall((low, yEdges[iy], door - doorWidth / 2, yEdges[iy]), rooms)
+            AddWall((door + doorWidth / 2, yEdges[iy], high, yEdges[iy]), rooms)
+            doors[rooms] = (door, yEdges[iy])
+
+    return {
+        "walls": numpy.array(walls, dtype=numpy.float64),
+        "xEdges": xEdges,
+        "yEdges": yEdges,
+        "roomWalls": {
+            room: numpy.array(indices) for room, indices in roomWalls.items()
+        },
+        "doors": doors,
+    }
+
+
+def GenerateFlightPath(layout, step=0.5, randomState=None):
+    """
+    Generates drone positions visiting every room in a serpentine order, going
+    from the centre of a room to the next one through their door.
+
+    Args:
+        layout (dict): The room layout of GenerateRoomLayout().
+        step (float): Distance between consecutive positions, in meters.
+        randomState (numpy.random.RandomState): Source of randomness.
+
+    Returns:
+        numpy.ndarray: (N, 2) drone positions.
+    """
+    assert step > 0, "step should be positive"
+    randomState = randomState or numpy.random.RandomState()
+    xEdges, yEdges = layout["xEdges"], layout["yEdges"]
+    roomsX, roomsY = len(xEdges) - 1, len(yEdges) - 1
+
+    rooms = []
+    for iy in range(roomsY):
+        columns = range(roomsX) if iy % 2 == 0 else range(roomsX - 1, -1, -1)
+        rooms.extend((ix, iy) for ix in columns)
+
+    waypoints = []
+    for index, (ix, iy) in enumerate(rooms):
+        # somewhere around the middle of the room, clear of the walls
+        centre = (
+            (xEdges[ix] + xEdges[ix + 1]) / 2,
+            (yEdges[iy] + yEdges[iy + 1]) / 2,
+        )
+        jitter = randomState.uniform(-0.2, 0.2, 2) * (
+            xEdges[ix + 1] - xEdges[ix],
+            yEdges[iy + 1] - yEdges[iy],
+        )
+        waypoints.append(numpy.add(centre, jitter))
+        if index + 1 < len(rooms):
+            pair = tuple(sorted((rooms[index], rooms[index + 1])))
+            waypoints.append(numpy.array(layout["doors"][pair]))
+    waypoints = numpy.array(waypoints)
+
+    # resample the polyline through the waypoints every step meters
+    lengths = numpy.hypot(*numpy.diff(waypoints, axis=0).T)
+    cumulative = numpy.concatenate(([0.0], numpy.cumsum(lengths)))
+    stations = numpy.arange(0.0, cumulative[-1] + 1e-9, step)
+    return numpy.column_stack(
+        (
+            numpy.interp(stations, cumulative, waypoints[:, 0]),
+            numpy.interp(stations, cumulative, waypoints[:, 1]),
+        )
+    )
+
+
+def _CastBeams(walls, px, py, dx, dy, maxRange):
+    """
+    Distance from (px, py) to the nearest wall along every beam of direction
+    (dx, dy), maxRange for the beams hitting no wall.
+    """
+    ex, ey = walls[:, 2] - walls[:, 0], walls[:, 3] - walls[:, 1]
+    ax, ay = walls[:, 0] - px, walls[:, 1] - py
+
+    # p + t*d = a + u*e, solved with 2D cross products
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        denominator = dx[:, None] * ey - dy[:, None] * ex
+        t = (ax * ey - ay * ex) / denominator
+        u = (ax * dy[:, None] - ay * dx[:, None]) / denominator
+    t[~((t > 0) & (u >= 0) & (u <= 1))] = maxRange
+    return t.min(axis=1, initial=maxRange)
+
+
+def CastSweep(layout, position, angles, maxRange=20.0):
+    """
+    Ray casts the beams of one sweep against the walls of a room layout.
+
+    The beams are first cast against the walls of the room of the lidar only,
+    the rooms being convex the nearest of these hits is the nearest of all. The
+    few beams leaving the room through a door are then cast against the walls of
+    every room within maxRange.
+
+    Args:
+        layout (dict): The room layout of GenerateRoomLayout().
+        position (numpy.ndarray): (x, y) position of the lidar, inside the building.
+        angles (numpy.ndarray): Beam angles in degrees.
+        maxRange (float): Range of the lidar, returned by the beams hitting no wall.
+
+    Returns:
+        numpy.ndarray: Distance to the nearest wall along every beam, in meters.
+    """
+    px, py = position
+    xEdges, yEdges, walls = layout["xEdges"], layout["yEdges"], layout["walls"]
+    dx, dy = GetWorldUnitVectors(angles, tolerance=0).T
+
+    def RoomIndex(edges, value):
+        return min(max(bisect.bisect_right(edges, value) - 1, 0), len(edges) - 2)
+
+    ix, iy = RoomIndex(xEdges, px), RoomIndex(yEdges, py)
+    distances = _CastBeams(
+        walls[layout["roomWalls"][(ix, iy)]], px, py, dx, dy, maxRange
+    )
+
+    # the beams leaving the room, first against the neighbouring rooms, then
+    # against all the rooms within range
+    spans = (
+        (ix - 1, ix + 1, iy - 1, iy + 1),
+        (
+            RoomIndex(xEdges, px - maxRange),
+            RoomIndex(xEdges, px + maxRange),
+            RoomIndex(yEdges, py - maxRange),
+            RoomIndex(yEdges, py + maxRange),
+        ),
+    )
+    for minX, maxX, minY, maxY in spans:
+        escaped = numpy.flatnonzero(distances >= maxRange)
+        if len(escaped) == 0:
+            break
+        nearWalls = numpy.unique(
+            numpy.concatenate(
+                [
+                    layout["roomWalls"][(nearX, nearY)]
+                    for nearX in range(max(minX, 0), min(maxX, len(xEdges) - 2) + 1)
+                    for nearY in range(max(minY, 0), min(maxY, len(yEdges) - 2) + 1)
+                ]
+            )
+        )
+        distances[escaped] = _CastBeams(
+            walls[nearWalls], px, py, dx[escaped], dy[escaped], maxRange
+        )
+    return distances
+
+
+def GenerateMission(
+    roomsX=4,
+    roomsY=5,
+    roomWidth=5.0,
+    roomLength=6.0,
+    step=0.5,
+    numSamples=533,
+    noise=0.01,
+    maxRange=20.0,
+    seed=None,
+):
+    """
+    Generates a synthetic mission: a room layout, a flight path through it and
+    one lidar sweep per flight path position.
+
+    Args:
+        roomsX (int): Number of rooms along x.
+        roomsY (int): Number of rooms along y.
+        roomWidth (float): Mean size of the rooms along x, in meters.
+        roomLength (float): Mean size of the rooms along y, in meters.
+        step (float): Distance between consecutive sweeps, in meters.
+        numSamples (int): Number of beams per sweep.
+        noise (float): Standard deviation of the range noise, in meters.
+        maxRange (float): Range of the lidar, in meters.
+        seed (int): Seed of the random generator, the same seed gives the same mission.
+
+    Returns:
+        dict: "walls", "positions" (N, 2), and the sweeps as "angles" and
+        "distances" 1D arrays in degrees and meters, sweep i spanning
+        "offsets"[i]:"offsets"[i + 1].
+    """
+    assert numSamples > 0, "numSamples should be positive"
+    randomState = numpy.random.RandomState(seed)
+    layout = GenerateRoomLayout(
+        roomsX, roomsY, roomWidth, roomLength, randomState=randomState
+    )
+    positions = GenerateFlightPath(layout, step, randomState)
+    numSweeps = len(positions)
+    logHandle.log.debug(
+        "Simulating %d sweeps of %d samples against %d walls",
+        numSweeps,
+        numSamples,
+        len(layout["walls"]),
+    )
+
+    # every sweep starts at a random angle, its beams evenly spaced over 360 degrees
+    beamStep = 360.0 / numSamples
+    startAngles = randomState.uniform(0, beamStep, numSweeps)
+    angles = (startAngles[:, None] + numpy.arange(numSamples) * beamStep).ravel()
+    distances = numpy.empty(numSweeps * numSamples)
+    for index, position in enumerate(positions):
+        sweep = slice(index * numSamples, (index + 1) * numSamples)
+        distances[sweep] = CastSweep(layout, position, angles[sweep], maxRange)
+    distances += randomState.normal(0.0, noise, len(distances))
+    numpy.clip(distances, 0.0, maxRange, out=distances)
+
+    return {
+        "walls": layout["walls"],
+        "positions": positions,
+        "angles": angles,
+        "distances": distances,
+        "offsets": numpy.arange(numSweeps + 1) * numSamples,
+    }
+
+
+def _FormatDigits(values, width):
+    """
+    Renders non-negative integers as right aligned ASCII digits.
+
+    Args:
+        values (numpy.ndarray): 1D int64 array.
+        width (int): Number of digit columns, enough for the largest value.
+
+    Returns:
+        numpy.ndarray: (len(values), width) uint8 array, NUL bytes before the digits.
+    """
+    digits = numpy.zeros((len(values), width), dtype=numpy.uint8)
+    for column in range(width):
+        power = 10 ** (width - 1 - column)
+        digit = (values // power % 10).astype(numpy.uint8) + ord("0")
+        # leading zeros are left out, the units digit is always written
+        shown = values >= power if power > 1 else numpy.ones(len(values), bool)
+        digits[:, column] = numpy.where(shown, digit, 0)
+    return digits
+
+
+def FormatRows(first, second, decimals=None):
+    """
+    Formats two columns of non-negative numbers as "first,second" CSV rows with
+    array operations only, tens of times faster than formatting row by row.
+
+    Args:
+        first (numpy.ndarray): 1D array of the first column.
+        second (numpy.ndarray): 1D int64 array of the second column.
+        decimals (numpy.ndarray): Optional 1D bool array, True for the rows whose
+        first column is written with 6 decimals, the others are written as integers.
+
+    Returns:
+        bytes: The rows, each terminated by a newline.
+    """
+    first = numpy.asarray(first, dtype=numpy.float64)
+    second = numpy.asarray(second, dtype=numpy.int64)
+    assert (first >= 0).all() and (second >= 0).all(), "values should be non-negative"
+    if decimals is None:
+        decimals = numpy.ones(len(first), dtype=bool)
+
+    fixedPoint = numpy.rint(first * 1e6).astype(numpy.int64)
+    integerPart = numpy.where(decimals, fixedPoint // 1000000, numpy.rint(first))
+    fractionPart = fixedPoint % 1000000
+
+    def Width(values):
+        return len(str(int(values.max()))) if len(values) else 1
+
+    integerPart = integerPart.astype(numpy.int64)
+    columns = [
+        _FormatDigits(integerPart, Width(integerPart)),
+        numpy.where(decimals, ord("."), 0).astype(numpy.uint8)[:, None],
+        # the 6 decimals keep their leading zeros
+        numpy.where(
+            decimals[:, None], _FormatDigits(fractionPart + 1000000, 7)[:, 1:], 0
+        ).astype(numpy.uint8),
+        numpy.full((len(first), 1), ord(","), dtype=numpy.uint8),
+        _FormatDigits(second, Width(second)),
+        numpy.full((len(first), 1), ord("\n"), dtype=numpy.uint8),
+    ]
+    rows = numpy.concatenate(columns, axis=1)
+    return rows[rows != 0].tobytes()
+
+
+def WriteMissionFiles(mission, lidarPoints, flightPath, chunkSize=1 << 20):
+    """
+    Writes a mission as "sweepID,numSamples" / "angle,distance" rows, distances
+    in millimeters, and its flight path as "sweepID,1" / "x,y" rows, the
+    formats read by GetLidarMeasurementsFromFile() and GetFlightPathFromFile().
+
+    Args:
+        mission (dict): The mission of GenerateMission().
+        lidarPoints (str): The name of the lidar measurements file to write.
+        flightPath (str): The name of the flight path file to write.
+        chunkSize (int): Number of rows formatted at once, bounds the memory used.
+    """
+    offsets = mission["offsets"]
+    numSweeps = len(offsets) - 1
+    numSamples = numpy.diff(offsets)
+    distancesMM = numpy.rint(mission["distances"] * 1000).astype(numpy.int64)
+
+    # interleave a header row before the samples of every sweep
+    numRows = len(mission["angles"]) + numSweeps
+    headerRows = offsets[:-1] + numpy.arange(numSweeps)
+    isHeader = numpy.zeros(numRows, dtype=bool)
+    isHeader[headerRows] = True
+    first = numpy.empty(numRows)
+    second = numpy.empty(numRows, dtype=numpy.int64)
+    first[headerRows], second[headerRows] = numpy.arange(numSweeps), numSamples
+    first[~isHeader], second[~isHeader] = mission["angles"] % 360.0, distancesMM
+
+    with open(lidarPoints, "wb") as fileHandler:
+        for start in range(0, numRows, chunkSize):
+            rows = slice(start, start + chunkSize)
+            fileHandler.write(FormatRows(first[rows], second[rows], ~isHeader[rows]))
+
+    with open(flightPath, "w") as fileHandler:
+        for sweepID, (x, y) in enumerate(mission["positions"]):
+            fileHandler.write("{},1\n{:.6f},{:.6f}\n".format(sweepID, x, y))
+
+
+def WriteMissionSweepStore(mission, sweepStoreFile):
+    """
+    Writes a mission as a binary sweep store, see sweepstore.WriteSweepStore().
+
+    Args:
+        mission (dict): The mission of GenerateMission().
+        sweepStoreFile (str): The name of the sweep store file to write.
+    """
+    numSweeps = len(mission["offsets"]) - 1
+    sweepstore.WriteSweepStore(
+        sweepStoreFile,
+        mission["angles"] % 360.0,
+        mission["distances"],
+        numpy.arange(numSweeps),
+        mission["offsets"],
+        numpy.arange(numSweeps),
+        mission["positions"],
+    )
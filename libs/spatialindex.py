@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+__author__ = "Ashesh Vasalya"
+
+import numpy
+
+from .projection import ProjectSweepSet
+from .sweepset import SweepSet
+from .profiling import profiler
+
+""" Spatial index of 2D points, for radius and nearest neighbour queries.
+
+    The points are hashed into a uniform grid of cellSize cells: their cell
+    keys are kept sorted, so the points of a cell are one contiguous run found
+    with a binary search. A batch of queries gathers the runs of the cells
+    around every query at once, and the candidates of a query stay contiguous,
+    so the distances, filters and minimums run on whole arrays. Points are
+    inserted by merging their sorted keys into the index, without rebuilding
+    it, as new sweeps arrive.
+
+    Example usage:
+    from spatialindex import SpatialIndex
+    index = SpatialIndex.FromSweepSet(lidarSweepsList, cellSize=0.5)
+    indices, distances, offsets = index.QueryRadius(waypoints, 1.0)
+    nearest, distances = index.QueryNearest(waypoints, k=3)
+    sweepIDs = index.labels[nearest[:, 0]]
+"""
+
+# cell keys of the grid hash allow negative cell indices
+CELL_KEY_OFFSET = 2**30
+CELL_KEY_STRIDE = 2**31
+
+
+def GetCellKeys(cells):
+    """
+    Args:
+        cells (numpy.ndarray): (N, 2) integer cell indices.
+
+    Returns:
+        numpy.ndarray: (N,) int64 key of every cell.
+    """
+    return (cells[:, 0] + CELL_KEY_OFFSET) * CELL_KEY_STRIDE + (
+        cells[:, 1] + CELL_KEY_OFFSET
+    )
+
+
+class SpatialIndex:
+    """
+    Grid hash of 2D points with batched radius and k nearest neighbour
+    queries, and incremental insertion.
+    """
+
+    def __init__(self, cellSize, points=None, labels=None):
+        """
+        Args:
+            cellSize (float): Size of the grid cells in meters, about the
+            typical query radius.
+            points (numpy.ndarray): Optional (N, 2) first points.
+            labels (numpy.ndarray): Optional (N,) integer label of every point,
+            -1 by default.
+        """
+        assert cellSize > 0, "cellSize should be positive"
+        self.cellSize = cellSize
+        self.size = 0
+        self._points = numpy.zeros((0, 2))
+        self._labels = numpy.zeros(0, dtype=numpy.int64)
+        # sorted cell keys and the index of the point of every key
+        self._keys = numpy.zeros(0, dtype=numpy.int64)
+        self._order = numpy.zeros(0, dtype=numpy.int64)
+        self._cellMin = numpy.zeros(2, dtype=numpy.int64)
+        self._cellMax = numpy.zeros(2, dtype=numpy.int64)
+        # occupied cells and their runs of keys, listed on the first query
+        self._occupied = None
+        if points is not None:
+            self.Insert(points, labels)
+
+    @classmethod
+    def FromSweepSet(cls, lidarSweepsList, cellSize=0.5):
+        """
+        Indexes the world frame points of all the sweeps with coordinates,
+        labelled by their sweep ID. The points are those of
+        ProjectToWorldFrame(), x + d*cos(a) and y - d*sin(a) around the
+        coordinates of their sweep, as in the fused global map.
+
+        Args:
+            lidarSweepsList (SweepSet): The sweeps, or a list of sweep dictionaries.
+            cellSize (float): Size of the grid cells in meters.
+
+        Returns:
+            SpatialIndex: The index.
+        """
+        sweeps = SweepSet.FromSweeps(lidarSweepsList)
+        points = ProjectSweepSet(sweeps, frame="world")
+        labels = numpy.repeat(sweeps.sweepIDs, numpy.diff(sweeps.offsets))
+        # sweeps without coordinates have no world frame points
+        placed = ~numpy.isnan(points[:, 0])
+        return cls(cellSize, points[placed], labels[placed])
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def points(self):
+        return self._points[: self.size]
+
+    @property
+    def labels(self):
+        return self._labels[: self.size]
+
+    def _GetCells(self, points):
+        return numpy.floor(points / self.cellSize).astype(numpy.int64)
+
+    def Insert(self, points, labels=None):
+        """
+        Adds points to the index, merging their keys into the sorted keys.
+
+        Args:
+            points (numpy.ndarray): (N, 2) points.
+            labels (numpy.ndarray): Optional (N,) integer labels, -1 by default.
+
+        Returns:
+            numpy.ndarray: (N,) indices of the new points in the index.
+        """
+        points = numpy.asarray(points, dtype=numpy.float64).reshape(-1, 2)
+        assert numpy.isfinite(points).all(), "points should be finite"
+        if labels is None:
+            labels = numpy.full(len(points), -1, dtype=numpy.int64)
+        assert len(labels) == len(points), "labels should match the points"
+        start, end = self.size, self.size + len(points)
+        if end > len(self._points):
+            # grow the buffers geometrically, inserting sweep by sweep stays linear
+            capacity = max(end, 2 * len(self._points))
+            self._points = numpy.resize(self._points, (capacity, 2))
+            self._labels = numpy.resize(self._labels, capacity)
+        self._points[start:end] = points
+        self._labels[start:end] = labels
+        self.size = end
+        if len(points) == 0:
+            return numpy.arange(start, end)
+
+        cells = self._GetCells(points)
+        if start == 0:
+            self._cellMin, self._cellMax = cells.min(axis=0), cells.max(axis=0)
+        else:
+            self._cellMin = numpy.minimum(self._cellMin, cells.min(axis=0))
+            self._cellMax = numpy.maximum(self._cellMax, cells.max(axis=0))
+        keys = GetCellKeys(cells)
+        order = numpy.argsort(keys, kind="stable")
+        # after the points already in the same cell, a cell lists its points
+        # in insertion order
+        positions = numpy.searchsorted(self._keys, keys[order], "right")
+        self._keys = numpy.insert(self._keys, positions, keys[order])
+        self._order = numpy.insert(self._order, positions, start + order)
+        self._occupied = None
+        profiler.Count("pointsIndexed", len(points))
+        return numpy.arange(start, end)
+
+    def _GetOccupiedCells(self):
+        """
+        Returns:
+            tuple: (cells, starts, counts) the (U, 2) occupied cells in key
+            order, and the run of sorted keys of each of them.
+        """
+        if self._occupied is None:
+            keys, starts, counts = numpy.unique(
+                self._keys, return_index=True, return_counts=True
+            )
+            cells = numpy.column_stack(
+                (keys // CELL_KEY_STRIDE, keys % CELL_KEY_STRIDE)
+            )
+            self._occupied = (cells - CELL_KEY_OFFSET, starts, counts)
+        return self._occupied
+
+    def _GetCandidates(self, queries, radius, k=None):
+        """
+        Gathers the points of the cells within radius cells of every query.
+
+        The windows are clipped to the cells spanned by the index, and a query
+        whose window still has as many cells as there are occupied cells scans
+        the occupied cells instead, so a query far from the points or with a
+        large radius costs no more than the index itself. Given k, the scanned
+        cells that cannot hold any of the k nearest points are left out.
+
+        Returns:
+            tuple: (candidates, queryIDs, queryCounts) the candidate point
+            indices, the query of every candidate, contiguous per query, and the
+            number of candidates of every query.
+        """
+        cells = self._GetCells(queries)
+        low = numpy.maximum(cells - radius, self._cellMin)
+        high = numpy.minimum(cells + radius, self._cellMax)
+        sizes = numpy.maximum(high - low + 1, 0)
+        windowCells = sizes[:, 0] * sizes[:, 1]
+        occupiedCells, occupiedStarts, occupiedCounts = self._GetOccupiedCells()
+        scanned = windowCells >= len(occupiedCells)
+
+        # windows listed cell by cell, x major
+        windowed = numpy.flatnonzero(~scanned)
+        numCells = windowCells[windowed]
+        queryIDs = numpy.repeat(windowed, numCells)
+        within = numpy.arange(numCells.sum()) - numpy.repeat(
+            numpy.cumsum(numCells) - numCells, numCells
+        )
+        columns = sizes[queryIDs, 1]
+        keys = GetCellKeys(
+            numpy.column_stack(
+                (
+                    low[queryIDs, 0] + within // columns,
+                    low[queryIDs, 1] + within % columns,
+                )
+            )
+        )
+        starts = numpy.searchsorted(self._keys, keys, "left")
+        counts = numpy.searchsorted(self._keys, keys, "right") - starts
+
+        # occupied cells inside the windows, in key order, which is x major
+        scanned = numpy.flatnonzero(scanned)
+        if len(scanned):
+            inside = (
+                (occupiedCells >= low[scanned, None, :])
+                & (occupiedCells <= high[scanned, None, :])
+            ).all(axis=2)
+            if k is not None:
+                inside &= self._GetNearCells(queries[scanned], occupiedCells, k)
+            scannedIDs, cellIDs = numpy.nonzero(inside)
+            queryIDs = numpy.concatenate((queryIDs, scanned[scannedIDs]))
+            starts = numpy.concatenate((starts, occupiedStarts[cellIDs]))
+            counts = numpy.concatenate((counts, occupiedCounts[cellIDs]))
+            order = numpy.argsort(queryIDs, kind="stable")
+            queryIDs, starts, counts = queryIDs[order], starts[order], counts[order]
+
+        total = counts.sum()
+        within = numpy.arange(total) - numpy.repeat(
+            numpy.cumsum(counts) - counts, counts
+        )
+        candidates = self._order[numpy.repeat(starts, counts) + within]
+        queryCounts = numpy.bincount(queryIDs, counts, len(queries)).astype(numpy.int64)
+        queryIDs = numpy.repeat(numpy.arange(len(queries)), queryCounts)
+        return candidates, queryIDs, queryCounts
+
+    def _GetNearCells(self, queries, cells, k):
+        """
+        Returns:
+            numpy.ndarray: (Q, U) mask of the cells closer to every query than
+            the k-th nearest point can be, from the farthest corners of the
+            nearest cells that hold k points.
+        """
+        counts = self._GetOccupiedCells()[2]
+        # per axis, from the query to the lower and upper sides of the cells
+        below = cells * self.cellSize - queries[:, None, :]
+        above = below + self.cellSize
+        nearest = numpy.square(numpy.maximum(numpy.maximum(below, -above), 0.0)).sum(
+            axis=2
+        )
+        farthest = numpy.square(numpy.maximum(numpy.abs(below), numpy.abs(above))).sum(
+            axis=2
+        )
+        order = numpy.argsort(farthest, axis=1)
+        held = numpy.cumsum(counts[order], axis=1)
+        # farthest corner of the nearest cells holding k points, all of them
+        # if there are fewer
+        last = numpy.minimum((held < k).sum(axis=1), len(cells) - 1)
+        bound = numpy.take_along_axis(
+            farthest, order[numpy.arange(len(queries)), last][:, None], axis=1
+        )
+        return nearest <= bound
+
+    def QueryRadius(self, queries, radius):
+        """
+        Finds the points within radius of every query.
+
+        Args:
+            queries (numpy.ndarray): (Q, 2) query points.
+            radius (float): Search radius in meters.
+
+        Returns:
+            tuple: (indices, distances, offsets) the points of query i and their
+            distances span offsets[i]:offsets[i + 1], nearest first.
+        """
+        queries = numpy.asarray(queries, dtype=numpy.float64).reshape(-1, 2)
+        candidates, queryIDs, _ = self._GetCandidates(
+            queries, int(numpy.ceil(radius / self.cellSize))
+        )
+        squared = numpy.square(self._points[candidates] - queries[queryIDs]).sum(axis=1)
+        inside = squared <= radius**2
+        candidates, queryIDs, squared = (
+            candidates[inside],
+            queryIDs[inside],
+            squared[inside],
+        )
+        order = numpy.lexsort((squared, queryIDs))
+        offsets = numpy.zeros(len(queries) + 1, dtype=numpy.int64)
+        offsets[1:] = numpy.cumsum(numpy.bincount(queryIDs, minlength=len(queries)))
+        return candidates[order], numpy.sqrt(squared[order]), offsets
+
+    def QueryNearest(self, queries, k=1, maxDistance=None):
+        """
+        Finds the k nearest points of every query, searching growing windows of
+        cells until the k-th nearest point is closer than any point left out.
+
+        Args:
+            queries (numpy.ndarray): (Q, 2) query points.
+            k (int): Number of neighbours.
+            maxDistance (float): Optional, farther points are not returned.
+
+        Returns:
+            tuple: (indices, distances) (Q, k) arrays, nearest first, -1 and inf
+            past the points found.
+        """
+        assert k > 0, "k should be positive"
+        queries = numpy.asarray(queries, dtype=numpy.float64).reshape(-1, 2)
+        indices = numpy.full((len(queries), k), -1)
+        distances = numpy.full((len(queries), k), numpy.inf)
+        limit = numpy.inf if maxDistance is None else maxDistance
+        if self.size == 0:
+            return indices, distances
+        # past this window radius every point of the index has been seen
+        cells = self._GetCells(queries)
+        lastRadius = numpy.maximum(cells - self._cellMin, self._cellMax - cells).max(
+            axis=1
+        )
+        pending = numpy.arange(len(queries))
+        radius = 1
+        while len(pending):
+            found, squared = self._GetNearestCandidates(queries[pending], radius, k)
+            # points out of the window are at least radius cells away
+            done = (
+                (squared[:, -1] <= (radius * self.cellSize) ** 2)
+                | (radius * self.cellSize >= limit)
+                | (radius >= lastRadius[pending])
+            )
+            kept = squared[done] <= limit**2
+            indices[pending[done]] = numpy.where(kept, found[done], -1)
+            distances[pending[done]] = numpy.where(
+                kept, numpy.sqrt(squared[done]), numpy.inf
+            )
+            pending = pending[~done]
+            radius *= 2
+        return indices, distances
+
+    def _GetNearestCandidates(self, queries, radius, k):
+        """
+        Returns:
+            tuple: (indices, squared) (Q, k) arrays of the k nearest candidates
+            of the window of every query, the first of equal candidates first,
+            -1 and inf past the candidates.
+        """
+        candidates, queryIDs, queryCounts = self._GetCandidates(queries, radius, k)
+        indices = numpy.full((len(queries), k), -1)
+        nearest = numpy.full((len(queries), k), numpy.inf)
+        if len(candidates) == 0:
+            return indices, nearest
+        squared = numpy.square(self._points[candidates] - queries[queryIDs]).sum(axis=1)
+        groupStarts = numpy.cumsum(queryCounts) - queryCounts
+        if k == 1:
+            found = queryCounts > 0
+            nearest[found, 0] = numpy.minimum.reduceat(squared, groupStarts[found])
+            # the first candidate of every query at its nearest distance
+            ties = numpy.flatnonzero(squared == nearest[queryIDs, 0])
+            first = numpy.ones(len(ties), dtype=bool)
+            first[1:] = queryIDs[ties[1:]] != queryIDs[ties[:-1]]
+            ties = ties[first]
+            indices[queryIDs[ties], 0] = candidates[ties]
+            return indices, nearest
+        order = numpy.lexsort((squared, queryIDs))
+        ranks = numpy.arange(len(order)) - groupStarts[queryIDs[order]]
+        order, ranks = order[ranks < k], ranks[ranks < k]
+        indices[queryIDs[order], ranks] = candidates[order]
+        nearest[queryIDs[order], ranks] = squared[order]
+        return indices, nearest
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+__author__ = "Ashesh Vasalya"
+
+import numpy
+
+""" Array backed collection of lidar sweeps.
+
+    The samples of all sweeps are stored back to back in one angle array and
+    one distance array, sweep i spanning offsets[i]:offsets[i + 1], next to the
+    sweep IDs and an (N, 2) array of drone coordinates. Sweeps are handed out
+    as lightweight views, which also answer the dictionary keys "sweepID",
+    "coordinates", "angles" and "distances" of the former list of dicts.
+
+    Example usage:
+    from sweepset import SweepSet
+    sweeps = SweepSet(angles, distances, offsets)
+    sweeps.SetPoses(sweepIDs, pathCoordinates)
+    for sweep in sweeps:
+        print(sweep.sweepID, sweep.coordinates, len(sweep.angles))
+"""
+
+
+class Sweep:
+    """
+    View of one sweep of a SweepSet, holding no sample data of its own.
+    """
+
+    __slots__ = ("sweepSet", "index")
+
+    KEYS = ("sweepID", "coordinates", "angles", "distances")
+
+    def __init__(self, sweepSet, index):
+        self.sweepSet = sweepSet
+        self.index = index
+
+    @property
+    def sweepID(self):
+        return int(self.sweepSet.sweepIDs[self.index])
+
+    @property
+    def angles(self):
+        sweepSet, index = self.sweepSet, self.index
+        return sweepSet.angles[sweepSet.offsets[index] : sweepSet.offsets[index + 1]]
+
+    @property
+    def distances(self):
+        sweepSet, index = self.sweepSet, self.index
+        return sweepSet.distances[sweepSet.offsets[index] : sweepSet.offsets[index + 1]]
+
+    @property
+    def coordinates(self):
+        """
+        Drone coordinates of the sweep, None if the sweep has no pose.
+        """
+        coordinates = self.sweepSet.poses[self.index]
+        if numpy.isnan(coordinates).any():
+            return None
+        return coordinates
+
+    def __getitem__(self, key):
+        if key not in self.KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        """
+        Only the coordinates of a sweep can be set, they are stored in the poses
+        of the SweepSet.
+        """
+        if key != "coordinates":
+            raise KeyError("only the coordinates of a sweep can be set")
+        self.sweepSet.SetPoses([self.sweepID], value)
+
+    def __contains__(self, key):
+        return key in self.KEYS
+
+    def get(self, key, default=None):
+        value = self[key] if key in self.KEYS else None
+        return default if value is None else value
+
+    def keys(self):
+        return self.KEYS
+
+    def __len__(self):
+        return int(
+            self.sweepSet.offsets[self.index + 1] - self.sweepSet.offsets[self.index]
+        )
+
+    def __repr__(self):
+        return "Sweep(sweepID={}, numSamples={})".format(self.sweepID, len(self))
+
+
+class SweepSet:
+    """
+    Compressed sparse row storage of the sweeps of a whole mission.
+    """
+
+    def __init__(self, angles, distances, offsets, sweepIDs=None, poses=None):
+        """
+        Args:
+            angles (numpy.ndarray): 1D array of the angles of all sweeps, in degrees.
+            distances (numpy.ndarray): 1D array of the distances of all sweeps.
+            offsets (numpy.ndarray): 1D array of numSweeps + 1 sample offsets.
+            sweepIDs (numpy.ndarray): ID of every sweep, their position by default.
+            poses (numpy.ndarray): (numSweeps, 2) drone coordinates, NaN where unknown.
+
+        Raises:
+            AssertionError: If the arrays are inconsistent with each other.
+        """
+        offsets = numpy.asarray(offsets, dtype=numpy.int64)
+        assert len(angles) == len(distances), "angles and distances should match"
+        assert len(offsets) > 0 and offsets[0] == 0, "offsets should start at 0"
+        assert offsets[-1] == len(angles), "offsets should cover all samples"
+        assert (numpy.diff(offsets) >= 0).all(), "offsets should be increasing"
+        numSweeps = len(offsets) - 1
+
+        if sweepIDs is None:
+            sweepIDs = numpy.arange(numSweeps)
+        sweepIDs = numpy.asarray(sweepIDs, dtype=numpy.int64)
+        assert len(sweepIDs) == numSweeps, "one sweepID per sweep expected"
+
+        if poses is None:
+            poses = numpy.full((numSweeps, 2), numpy.nan)
+        assert numpy.shape(poses) == (numSweeps, 2), "poses should be (numSweeps, 2)"
+
+        self.angles = angles
+        self.distances = distances
+        self.offsets = offsets
+        self.sweepIDs = sweepIDs
+        self.poses = poses
+
+    @classmethod
+    def FromSweeps(cls, lidarSweepsList):
+        """
+        Packs sweeps given as dictionaries, or any mapping with the keys
+        "angles", "distances" and optionally "sweepID" and "coordinates".
+
+        Args:
+            lidarSweepsList (list): The sweeps to pack, a SweepSet is returned as is.
+
+        Returns:
+            SweepSet: The packed sweeps, the arrays are copied.
+        """
+        if isinstance(lidarSweepsList, cls):
+            return lidarSweepsList
+        numSamples = [len(sweep["angles"]) for sweep in lidarSweepsList]
+        offsets = numpy.concatenate(([0], numpy.cumsum(numSamples, dtype=numpy.int64)))
+        poses = numpy.full((len(lidarSweepsList), 2), numpy.nan)
+        for index, sweep in enumerate(lidarSweepsList):
+            if sweep.get("coordinates") is not None:
+                poses[index] = sweep["coordinates"]
+        return cls(
+            numpy.concatenate([sweep["angles"] for sweep in lidarSweepsList] or [[]]),
+            numpy.concatenate(
+                [sweep["distances"] for sweep in lidarSweepsList] or [[]]
+            ),
+            offsets,
+            [
+                sweep.get("sweepID", index)
+                for index, sweep in enumerate(lidarSweepsList)
+            ],
+            poses,
+        )
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        """
+        Returns the view of one sweep, or a SweepSet sharing the sample arrays
+        for a slice.
+        """
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            assert step == 1, "only contiguous slices of a SweepSet are supported"
+            stop = max(start, stop)
+            offsets = self.offsets[start : stop + 1]
+            return SweepSet(
+                self.angles[offsets[0] : offsets[-1]],
+                self.distances[offsets[0] : offsets[-1]],
+                offsets - offsets[0],
+                self.sweepIDs[start:stop],
+                self.poses[start:stop],
+            )
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("sweep index {} out of range".format(index))
+        return Sweep(self, index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield Sweep(self, index)
+
+    @property
+    def numSamples(self):
+        """
+        Number of samples of every sweep.
+        """
+        return numpy.diff(self.offsets)
+
+    def GetMaxDistances(self):
+        """
+        Largest distance of every sweep, 0 for an empty sweep.
+        """
+        maxDistances = numpy.zeros(len(self), dtype=numpy.float64)
+        nonEmpty = self.numSamples > 0
+        if nonEmpty.any():
+            maxDistances[nonEmpty] = numpy.maximum.reduceat(
+                self.distances, self.offsets[:-1][nonEmpty]
+            )
+        return maxDistances
+
+    def GetSweepIndices(self, sweepIDs):
+        """
+        Positions in the set of the sweeps with the given IDs.
+
+        Raises:
+            AssertionError: If one of the sweepIDs is not in the set.
+        """
+        sweepIDs = numpy.asarray(sweepIDs, dtype=numpy.int64)
+        sorter = numpy.argsort(self.sweepIDs, kind="stable")
+        positions = numpy.searchsorted(self.sweepIDs, sweepIDs, sorter=sorter)
+        positions = sorter[numpy.minimum(positions, len(sorter) - 1)]
+        assert (
+            len(sorter) > 0 and (self.sweepIDs[positions] == sweepIDs).all()
+        ), "unknown sweepID"
+        return positions
+
+    def SetPoses(self, sweepIDs, coordinates):
+        """
+        Sets the drone coordinates of the sweeps with the given IDs.
+
+        Args:
+            sweepIDs (numpy.ndarray): IDs of the sweeps.
+            coordinates (numpy.ndarray): (len(sweepIDs), 2) drone coordinates.
+        """
+        if not numpy.issubdtype(self.poses.dtype, numpy.floating) or not (
+            self.poses.flags.writeable
+        ):
+            self.poses = numpy.array(self.poses, dtype=numpy.float64)
+        self.poses[self.GetSweepIndices(sweepIDs)] = numpy.reshape(coordinates, (-1, 2))
+
+    def ScaleDistances(self, scale):
+        """
+        Multiplies the distances of all sweeps by scale, in place when the
+        distance array allows it, as one operation over the whole mission.
+        """
+        if scale == 1:
+            return
+        if self.distances.flags.writeable and numpy.issubdtype(
+            self.distances.dtype, numpy.floating
+        ):
+            self.distances *= scale
+        else:
+            self.distances = self.distances * scale
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+__author__ = "Ashesh Vasalya"
+
+import os
+import numpy
+
+""" Binary columnar sweep store.
+
+    Layout of a sweep store file, every section starts on a 64 bytes boundary:
+    - header: magic, version and the number of samples, sweeps and poses
+    - angles: float32[numSamples], degrees
+    - distances: float32[numSamples], meters
+    - sweepIDs: int64[numSweeps]
+    - sweepOffsets: int64[numSweeps + 1], sweep i spans samples
+      sweepOffsets[i]:sweepOffsets[i + 1]
+    - poseSweepIDs: int64[numPoses]
+    - poses: float32[numPoses, 2], drone coordinates of each pose
+
+    Example usage:
+    from sweepstore import OpenSweepStore
+    store = OpenSweepStore("mission.l1d")
+    angles, distances = store.GetSweep(0)
+"""
+
+MAGIC = b"L1DSWEEP"
+VERSION = 1
+ALIGNMENT = 64
+
+HEADER_DTYPE = numpy.dtype(
+    [
+        ("magic", "S8"),
+        ("version", "<u4"),
+        ("reserved", "<u4"),
+        ("numSamples", "<u8"),
+        ("numSweeps", "<u8"),
+        ("numPoses", "<u8"),
+    ]
+)
+
+
+def _GetSectionLayout(numSamples, numSweeps, numPoses):
+    """
+    Computes the dtype, shape and byte offset of every section of a sweep store.
+
+    Args:
+        numSamples (int): Number of lidar samples over all sweeps.
+        numSweeps (int): Number of sweeps.
+        numPoses (int): Number of flight path poses.
+
+    Returns:
+        list: List of (name, dtype, shape, offset) tuples in file order.
+    """
+    sections = [
+        ("angles", numpy.dtype("<f4"), (numSamples,)),
+        ("distances", numpy.dtype("<f4"), (numSamples,)),
+        ("sweepIDs", numpy.dtype("<i8"), (numSweeps,)),
+        ("sweepOffsets", numpy.dtype("<i8"), (numSweeps + 1,)),
+        ("poseSweepIDs", numpy.dtype("<i8"), (numPoses,)),
+        ("poses", numpy.dtype("<f4"), (numPoses, 2)),
+    ]
+
+    layout = []
+    offset = HEADER_DTYPE.itemsize
+    for name, dtype, shape in sections:
+        offset = -(-offset // ALIGNMENT) * ALIGNMENT
+        layout.append((name, dtype, shape, offset))
+        offset += dtype.itemsize * int(numpy.prod(shape))
+    return layout
+
+
+def WriteSweepStore(
+    fileName, angles, distances, sweepIDs, sweepOffsets, poseSweepIDs, poses
+):
+    """
+    Writes sweeps and flight path poses into a binary sweep store file.
+
+    Args:
+        fileName (str): The name of the sweep store file to write.
+        angles (numpy.ndarray): 1D array of the angles of all sweeps, in degrees.
+        distances (numpy.ndarray): 1D array of the distances of all sweeps, in meters.
+        sweepIDs (numpy.ndarray): 1D array of the ID of every sweep.
+        sweepOffsets (numpy.ndarray): 1D array of numSweeps + 1 sample offsets.
+        poseSweepIDs (numpy.ndarray): 1D array of the sweep ID of every pose.
+        poses (numpy.ndarray): (numPoses, 2) array of drone coordinates.
+
+    Raises:
+        AssertionError: If the arrays are inconsistent with each other.
+    """
+    assert fileName, "No sweep store filename provided."
+    assert len(angles) == len(distances), "angles and distances should match"
+    assert (
+        len(sweepOffsets) == len(sweepIDs) + 1
+    ), "sweepOffsets should hold one more entry than sweepIDs"
+    assert sweepOffsets[0] == 0 and sweepOffsets[-1] == len(
+        angles
+    ), "sweepOffsets should cover all samples"
+    assert len(poseSweepIDs) == len(poses), "poseSweepIDs and poses should match"
+
+    numSamples, numSweeps, numPoses = len(angles), len(sweepIDs), len(poses)
+    header = numpy.zeros(1, dtype=HEADER_DTYPE)
+    header["magic"] = MAGIC
+    header["version"] = VERSION
+    header["numSamples"] = numSamples
+    header["numSweeps"] = numSweeps
+    header["numPoses"] = numPoses
+
+    arrays = {
+        "angles": angles,
+        "distances": distances,
+        "sweepIDs": sweepIDs,
+        "sweepOffsets": sweepOffsets,
+        "poseSweepIDs": poseSweepIDs,
+        "poses": numpy.reshape(poses, (-1, 2)),
+    }
+
+    with open(fileName, "wb") as fileHandler:
+        fileHandler.write(header.tobytes())
+        for name, dtype, shape, offset in _GetSectionLayout(
+            numSamples, numSweeps, numPoses
+        ):
+            fileHandler.write(b"\0" * (offset - fileHandler.tell()))
+            numpy.ascontiguousarray(arrays[name], dtype=dtype).tofile(fileHandler)
+
+
+class SweepStore:
+    """
+    A memory-mapped, read only view of a sweep store file.
+
+    The sections of the file are exposed as numpy memmaps, nothing is read from
+    disk until the corresponding samples are accessed.
+    """
+
+    def __init__(self, fileName):
+        """
+        Opens the sweep store file and maps each of its sections.
+        """
+        assert fileName, "No sweep store filename provided."
+        assert os.path.isfile(fileName), f"Sweep store file '{fileName}' not found."
+
+        header = numpy.fromfile(fileName, dtype=HEADER_DTYPE, count=1)
+        assert (
+            len(header) == 1 and header["magic"][0] == MAGIC
+        ), f"'{fileName}' is not a sweep store file."
+        assert (
+            header["version"][0] == VERSION
+        ), f"Unsupported sweep store version {header['version'][0]}."
+
+        self.fileName = fileName
+        self.numSamples = int(header["numSamples"][0])
+        self.numSweeps = int(header["numSweeps"][0])
+        self.numPoses = int(header["numPoses"][0])
+
+        for name, dtype, shape, offset in _GetSectionLayout(
+            self.numSamples, self.numSweeps, self.numPoses
+        ):
+            if numpy.prod(shape) == 0:
+                section = numpy.empty(shape, dtype=dtype)
+            else:
+                section = numpy.memmap(
+                    fileName, dtype=dtype, mode="r", offset=offset, shape=shape
+                )
+            setattr(self, name, section)
+
+    def __len__(self):
+        return self.numSweeps
+
+    def GetSweep(self, index):
+        """
+        Returns memory-mapped views of the angles and distances of one sweep.
+
+        Args:
+            index (int): Position of the sweep in the store.
+
+        Returns:
+            tuple: (angles, distances) views of the sweep samples.
+        """
+        minIndex, maxIndex = self.sweepOffsets[index], self.sweepOffsets[index + 1]
+        return self.angles[minIndex:maxIndex], self.distances[minIndex:maxIndex]
+
+
+def OpenSweepStore(fileName):
+    """
+    Opens a sweep store file memory-mapped.
+
+    Args:
+        fileName (str): The name of the sweep store file.
+
+    Returns:
+        SweepStore: The opened sweep store.
+
+    Raises:
+        AssertionError: If the file does not exist or is not a sweep store file.
+    """
+    return SweepStore(fileName)
@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+__author__ = "Ashesh Vasalya"
+
+import time
+import socket
+import numpy
+from collections import deque
+
+from .lidarutils import GetUnitConversionScale, logHandle
+
+""" Streaming sweep iterator for live or append-only lidar feeds.
+
+    Example usage:
+    from sweepstream import IterSweepsFromStream
+    for sweep in IterSweepsFromStream("LIDARPoints.csv", follow=True):
+        print(sweep["sweepID"], len(sweep["angles"]))
+"""
+
+
+# most samples a sweep header may announce, the arrays are allocated up front
+MAX_SWEEP_SAMPLES = 2**20
+# after a malformed header, the header looked for is at most this many sweeps
+# past the last sweep received, a sample line rarely passes for it
+MAX_LOST_SWEEPS = 16
+
+
+class SweepAssembler:
+    """
+    Assembles complete sweeps from "sweepID,numSamples" header lines and
+    "angle,distance" sample lines pushed one at a time.
+
+    Only the samples of the sweep being received are held, in arrays allocated
+    once the header announced how many samples follow. A malformed sample line
+    drops its sweep once the announced number of lines has arrived, which keeps
+    the next header in place, while after a malformed header the lines are
+    skipped until one validates as the header of one of the MAX_LOST_SWEEPS
+    sweeps following the last sweep received. Before any sweep was received, a
+    header found this way, which a sample line with integral values also passes
+    for, is only trusted once the line following its samples is the header of
+    one of the next sweeps, or the end of the feed, otherwise the lines after it
+    are read again.
+    """
+
+    def __init__(self, poses=None, distanceScale=None, maxSamples=MAX_SWEEP_SAMPLES):
+        """
+        Args:
+            poses (dict): Optional mapping of sweepID to drone coordinates.
+            distanceScale (float): Scale applied to the distances, mm to m by default.
+            maxSamples (int): Most samples a header may announce.
+        """
+        self.poses = poses or {}
+        if distanceScale is None:
+            distanceScale = GetUnitConversionScale("mm", "m")
+        self.distanceScale = distanceScale
+        self.maxSamples = maxSamples
+        self.sweepID = None
+        self.angles = None
+        self.distances = None
+        self.numReceived = 0
+        # ID of the last sweep completed, and the states after a malformed line
+        self.lastSweepID = None
+        self.dropping = False
+        self.resyncing = False
+        # sweeps completed and not returned yet
+        self.ready = deque()
+        # lines read since a first header found by a resync, None once trusted,
+        # and its sweep, held until the line following it confirms the header
+        self.unconfirmed = None
+        self.pending = None
+
+    def _ParseHeader(self, line):
+        first, second = line.split(",")
+        sweepID, numSamples = float(first), float(second)
+        assert (
+            sweepID.is_integer() and numSamples.is_integer()
+        ), "Malformed sweep header '{}'".format(line)
+        assert (
+            0 <= numSamples <= self.maxSamples
+        ), "Sweep header '{}' announces more than {} samples".format(
+            line, self.maxSamples
+        )
+        return int(sweepID), int(numSamples)
+
+    def PushLine(self, line):
+        """
+        Consumes one line of the feed.
+
+        Args:
+            line (str): A header or sample line, with or without the newline.
+
+        Returns:
+            dict: A completed sweep with the keys "sweepID", "coordinates",
+            "angles" and "distances", or None while no sweep is complete.
+
+        Raises:
+            AssertionError: If a header line is malformed.
+            ValueError: If a line does not hold two numbers.
+        """
+        line = line.strip()
+        if line:
+            self._Replay(self._Push(line))
+        return self.ready.popleft() if self.ready else None
+
+    def SkipLine(self):
+        """
+        Accounts for a line of the feed that could not be read: the sweep being
+        received is dropped once its other samples have arrived, or, between
+        sweeps, the next header is looked for.
+        """
+        self._Replay(self._Push(None))
+
+    def Flush(self):
+        """
+        Ends the feed.
+
+        Returns:
+            list: The sweeps completed and not returned yet, including a first
+            sweep found by a resync if the feed ended right after its samples.
+        """
+        while self.unconfirmed is not None:
+            if self.sweepID is None:
+                self._Trust()
+            else:
+                self._Replay(self._Distrust())
+        sweeps = list(self.ready)
+        self.ready.clear()
+        return sweeps
+
+    def _Replay(self, lines):
+        # lines read again after a distrusted header, their errors were
+        # reported as samples already
+        lines = deque(lines or ())
+        while lines:
+            try:
+                lines.extendleft(reversed(self._Push(lines.popleft()) or ()))
+            except (AssertionError, ValueError):
+                pass
+
+    def _Push(self, line):
+        """
+        Consumes one line, None for an unreadable one.
+
+        Returns:
+            list: The lines to read again if a header found by a resync turned
+            out not to be one, else None.
+        """
+        if self.unconfirmed is not None:
+            self.unconfirmed.append(line)
+            if self.sweepID is None:
+                return self._Confirm(line)
+        if line is None:
+            if self.sweepID is None:
+                self.resyncing = True
+                return None
+            self.dropping = True
+            self._Received()
+        elif self.sweepID is None:
+            self._PushHeader(line)
+        else:
+            try:
+                first, second = line.split(",")
+                self.angles[self.numReceived] = float(first)
+                self.distances[self.numReceived] = float(second)
+            except ValueError:
+                self.dropping = True
+                self._Received()
+                raise
+            self._Received()
+        return None
+
+    def _PushHeader(self, line):
+        try:
+            sweepID, numSamples = self._ParseHeader(line)
+            if self.resyncing and self.lastSweepID is not None:
+                assert (
+                    0 < sweepID - self.lastSweepID <= MAX_LOST_SWEEPS
+                ), "Sweep header '{}' out of order".format(line)
+            elif self.resyncing:
+                assert numSamples > 0, "Sweep header '{}' announces no samples".format(
+                    line
+                )
+        except (AssertionError, ValueError):
+            if self.resyncing:
+                return
+            self.resyncing = True
+            raise
+        if self.resyncing and self.lastSweepID is None:
+            self.unconfirmed = []
+        else:
+            self.resyncing = False
+        self._Begin(sweepID, numSamples)
+
+    def _Confirm(self, line):
+        # the line following the samples of a header found by a resync
+        header = None
+        if line is not None:
+            try:
+                header = self._ParseHeader(line)
+            except (AssertionError, ValueError):
+                pass
+        if (
+            header is None
+            or header[1] == 0
+            or not 0 < header[0] - self.lastSweepID <= MAX_LOST_SWEEPS
+        ):
+            return self._Distrust()
+        self._Trust()
+        self._Begin(*header)
+        return None
+
+    def _Trust(self):
+        if self.pending is not None:
+            self.ready.append(self.pending)
+        self.unconfirmed = None
+        self.pending = None
+        self.resyncing = False
+
+    def _Distrust(self):
+        lines = self.unconfirmed
+        self.unconfirmed = None
+        self.pending = None
+        self.sweepID = None
+        self.angles = None
+        self.distances = None
+        self.dropping = False
+        self.lastSweepID = None
+        self.resyncing = True
+        return lines
+
+    def _Begin(self, sweepID, numSamples):
+        self.sweepID = sweepID
+        self.angles = numpy.empty(numSamples)
+        self.distances = numpy.empty(numSamples)
+        self.numReceived = 0
+        if numSamples == 0:
+            self._Complete()
+
+    def _Received(self):
+        self.numReceived += 1
+        if self.numReceived == len(self.angles):
+            self._Complete()
+
+    def _Complete(self):
+        sweep = None
+        if not self.dropping:
+            self.distances *= self.distanceScale
+            sweep = {
+                "sweepID": self.sweepID,
+                "coordinates": self.poses.get(self.sweepID),
+                "angles": self.angles,
+                "distances": self.distances,
+            }
+        if self.unconfirmed is not None:
+            self.pending = sweep
+        elif sweep is not None:
+            self.ready.append(sweep)
+        self.lastSweepID = self.sweepID
+        self.dropping = False
+        self.sweepID = None
+        self.angles = None
+        self.distances = None
+
+
+def IterLinesFromStream(source, follow=False, pollInterval=0.1, idleTimeout=None):
+    """
+    Yields complete text lines from a file, a pipe or a socket.
+
+    Args:
+        source: A file name, a socket, or a readable file-like object.
+        follow (bool): If True, keep waiting for new data at end of file, like tail -f.
+        pollInterval (float): Seconds to sleep between polls while following.
+        idleTimeout (float): Stop following after this many seconds without new data.
+
+    Yields:
+        str: One line of the feed, without its trailing newline.
+    """
+    ownsStream = False
+    if isinstance(source, str):
+        stream = open(source, "r")
+        ownsStream = True
+    elif isinstance(source, socket.socket):
+        stream = source.makefile("r")
+        ownsStream = True
+    else:
+        stream = source
+
+    try:
+        pending = ""
+        idleSince = time.monotonic()
+        while True:
+            chunk = stream.readline()
+            if chunk:
+                idleSince = time.monotonic()
+                pending += chunk
+                # a tailed file can hand back half a line, wait for the rest
+                if pending.endswith("\n"):
+                    yield pending.rstrip("\r\n")
+                    pending = ""
+                continue
+
+            # end of stream, or no new data yet on a followed file
+            if not follow or (
+                idleTimeout is not None and time.monotonic() - idleSince > idleTimeout
+            ):
+                break
+            time.sleep(pollInterval)
+
+        if pending:
+            yield pending.rstrip("\r\n")
+    finally:
+        if ownsStream:
+            stream.close()
+
+
+def IterSweepsFromStream(
+    source, poses=None, follow=False, pollInterval=0.1, idleTimeout=None
+):
+    """
+    Yields lidar sweeps as soon as their header and all their samples have
+    arrived. Malformed lines are logged and skipped, see SweepAssembler.
+
+    Args:
+        source: A file name, a socket, or a readable file-like object streaming
+            the LIDARPoints format.
+        poses (dict): Optional mapping of sweepID to drone coordinates.
+        follow (bool): If True, keep waiting for new data at end of file, like tail -f.
+        pollInterval (float): Seconds to sleep between polls while following.
+        idleTimeout (float): Stop following after this many seconds without new data.
+
+    Yields:
+        dict: A sweep with the keys "sweepID", "coordinates", "angles" and
+        "distances", distances in meters.
+    """
+    assembler = SweepAssembler(poses)
+    for line in IterLinesFromStream(source, follow, pollInterval, idleTimeout):
+        try:
+            sweep = assembler.PushLine(line)
+        except (AssertionError, ValueError) as error:
+            # the assembler drops the sweep, or looks for the next header
+            logHandle.log.warning("Malformed line '%.80s': %s", line, error)
+            continue
+        if sweep is not None:
+            logHandle.log.debug(
+                "Received sweep=%d with %d samples",
+                sweep["sweepID"],
+                len(sweep["angles"]),
+            )
+            yield sweep
+
+    for sweep in assembler.Flush():
+        yield sweep
+
+    if assembler.sweepID is not None:
+        logHandle.log.warning(
+            "Stream ended in the middle of sweep=%s", assembler.sweepID
+        )
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+__author__ = "Ashesh Vasalya"
+import sys
+import asyncio
+import argparse
+import matplotlib
+
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt  # noqa: E402
+
+from libs.loghandler import LEVEL_NAMES  # noqa: E402
+from libs.lidarutils import logHandle  # noqa: E402
+from libs.liveservice import (  # noqa: E402
+    OpenServiceConnection,
+    ReplayLidarPoints,
+    RequestSnapshot,
+    SendRequest,
+)
+
+DESCRIPTION = (
+    "Replay a LIDARPoints file to the live map service, standing in for the drone"
+)
+
+
+async def Replay(args):
+    """
+    Streams the sweeps, waits for the service to fuse them, and saves a snapshot
+    of the map if asked.
+    """
+    reader, writer = await OpenServiceConnection(args.host, args.port, args.unixSocket)
+    try:
+        numSweeps = await ReplayLidarPoints(
+            args.lidarPoints, writer, rate=args.rate, speed=args.speed
+        )
+        stats = await SendRequest(reader, writer, {"command": "flush"})
+        logHandle.log.info("Replayed %d sweeps, service %s", numSweeps, stats)
+        if args.snapshot:
+            probability, extent, numFused = await RequestSnapshot(reader, writer)
+            plt.imsave(
+                args.snapshot,
+                probability.T,
+                origin="lower",
+                cmap="RdYlGn_r",
+                vmin=0.0,
+                vmax=1.0,
+            )
+            logHandle.log.info(
+                "Snapshot of %d sweeps over %s written to %s",
+                numFused,
+                extent,
+                args.snapshot,
+            )
+    finally:
+        writer.close()
+
+
+def main(args):
+    """
+    Replays a lidar measurements file to a running serve.py.
+
+    Args:
+        args (argparse.Namespace): A namespace object containing command-line arguments.
+
+    Raises:
+        AssertionError: If any required input arguments are missing or invalid.
+    """
+    assert args.lidarPoints, "No LiDAR measurement filename provided."
+    assert args.rate > 0, "The sweep rate should be positive."
+    asyncio.run(Replay(args))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog=sys.argv[0],
+        description=DESCRIPTION,
+        epilog="python3 replay.py --lidarPoints <lidar_measurements_file> --port 5800 --speed 2",
+    )
+    parser.add_argument(
+        "--lidarPoints", help="path to lidar measurements .csv file", type=str
+    )
+    parser.add_argument(
+        "--host", help="address of the service", type=str, default="127.0.0.1"
+    )
+    parser.add_argument(
+        "--port", help="TCP port of the service", type=int, default=5800
+    )
+    parser.add_argument(
+        "--unixSocket",
+        help="path of the Unix socket of the service instead of TCP",
+        type=str,
+    )
+    parser.add_argument(
+        "--rate", help="sweeps per second of the lidar", type=float, default=10.0
+    )
+    parser.add_argument(
+        "--speed",
+        help="replay speed factor, 0 streams as fast as the service reads",
+        type=float,
+        default=1.0,
+    )
+    parser.add_argument(
+        "--snapshot",
+        help="path to a PNG file receiving the map once replayed",
+        type=str,
+    )
+    parser.add_argument(
+        "--logLevel",
+        help="level of the console log, LIDAR1D_LOG_LEVEL or DEBUG by default",
+        type=str.upper,
+        choices=LEVEL_NAMES,
+    )
+    args = parser.parse_args()
+    if args.logLevel:
+        logHandle.SetLevel(args.logLevel)
+
+    main(args)
+    logHandle.log.debug("******    end of program, exiting.  *******")
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+__author__ = "Ashesh Vasalya"
+import sys
+import asyncio
+import argparse
+
+from libs.loghandler import LEVEL_NAMES
+from libs.lidarutils import GetFlightPathFromFile, logHandle
+from libs.liveservice import OVERFLOW_POLICIES, LiveMapService
+
+DESCRIPTION = "Live map service fusing the sweeps streamed over a local socket"
+
+
+def main(args):
+    """
+    Serves a running occupancy map fed by the sweeps streamed by the clients.
+
+    Args:
+        args (argparse.Namespace): A namespace object containing command-line arguments.
+    """
+    poses = None
+    if args.flightPath:
+        sweepIDs, pathCoordinates = GetFlightPathFromFile(args.flightPath)
+        poses = dict(zip(sweepIDs.tolist(), pathCoordinates))
+    else:
+        logHandle.log.warning("No flight path provided, sweeps will not be fused.")
+
+    service = LiveMapService(
+        poses,
+        xy_resolution=args.resolution,
+        angularBin=args.angularBin,
+        queueSize=args.queueSize,
+        overflow=args.overflow,
+        jobs=args.jobs or None,
+    )
+    try:
+        asyncio.run(
+            service.Serve(args.host, args.port, args.unixSocket, args.statsInterval)
+        )
+    except KeyboardInterrupt:
+        logHandle.log.info("Live map service stopped, %s", service.GetStats())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog=sys.argv[0],
+        description=DESCRIPTION,
+        epilog="python3 serve.py --flightPath <flight_path_file> --port 5800",
+    )
+    parser.add_argument(
+        "--flightPath", help="path to flight path .csv file, the sweep poses", type=str
+    )
+    parser.add_argument(
+        "--host",
+        help="address to listen on, local only by default",
+        type=str,
+        default="127.0.0.1",
+    )
+    parser.add_argument("--port", help="TCP port to listen on", type=int, default=5800)
+    parser.add_argument(
+        "--unixSocket",
+        help="path of a Unix socket to listen on instead of TCP",
+        type=str,
+    )
+    parser.add_argument(
+        "--resolution", help="resolution of the map in meters", type=float, default=0.05
+    )
+    parser.add_argument(
+        "--angularBin",
+        help="width in degrees of the angular bins, only the farthest sample of every bin is ray cast",
+        type=float,
+    )
+    parser.add_argument(
+        "--queueSize",
+        help="complete sweeps waiting to be fused, bounds the ingestion latency",
+        type=int,
+        default=8,
+    )
+    parser.add_argument(
+        "--overflow",
+        help="drop the oldest queued sweep when the queue is full, or block the senders",
+        choices=OVERFLOW_POLICIES,
+        default="drop",
+    )
+    parser.add_argument(
+        "--jobs",
+        help="sweeps ray cast at once, 1 in a thread, more in processes, 0 for one per CPU",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--statsInterval",
+        help="seconds between two logs of the ingestion statistics",
+        type=float,
+    )
+    parser.add_argument(
+        "--logLevel",
+        help="level of the console log, LIDAR1D_LOG_LEVEL or DEBUG by default",
+        type=str.upper,
+        choices=LEVEL_NAMES,
+    )
+    args = parser.parse_args()
+    if args.logLevel:
+        logHandle.SetLevel(args.logLevel)
+
+    main(args)
+    logHandle.log.debug("******    end of program, exiting.  *******")
@@ -6,29 +6,47 @@ import argparse
 import matplotlib.pyplot as plt
 
 
+from libs.loghandler import LEVEL_NAMES
 from libs.lidarutils import (
     GetFlightPathFromFile,
     GetLidarMeasurementsFromFile,
+    GetSweepsFromSweepStore,
     ExtractSweepsFromMeasurements,
     VisualizeMeasurementsPerSweep,
     VisualizeAllSweepsWithDronePath,
+    FuseSweepsIntoGlobalMap,
+    VisualizeGlobalMap,
     logHandle,
 )
+from libs.render import (
+    RenderSweepFrames,
+    RenderAllSweepsWithDronePath,
+    RenderGlobalMap,
+)
+from libs.gridcache import GridMapCache
+from libs.profiling import profiler
 
 
 DESCRIPTION = "Drone mapping and localization using 1D Lidar"
 
 
-def main(args):
+def ReadSweeps(args):
     """
-    Reads flight path and LiDAR measurement files.
+    Reads the sweeps and their flight path positions, from a binary sweep store
+    or from the flight path and LiDAR measurement files.
 
     Args:
         args (argparse.Namespace): A namespace object containing command-line arguments.
 
+    Returns:
+        SweepSet: The sweeps with their coordinates.
+
     Raises:
         AssertionError: If any required input arguments are missing or invalid.
     """
+    if getattr(args, "sweepStore", None):
+        # Sweeps and flight path are memory-mapped from a binary sweep store
+        return GetSweepsFromSweepStore(args.sweepStore)
 
     # Check if flightPath and lidarPoints arguments are provided and valid files
     assert hasattr(args, "flightPath"), "The 'flightPath' argument is missing."
@@ -45,10 +63,6 @@ def main(args):
     ), f"LiDAR measurement file '{args.lidarPoints}' not found."
     assert os.path.isfile(args.lidarPoints), f"'{args.lidarPoints}' is not a file."
 
-    if args.show:
-        plt.ion()
-        plt.show()
-
     # Read flight path and LiDAR measurements from files
     sweepIDs, pathCoordinates = GetFlightPathFromFile(args.flightPath)
     angles, distances = GetLidarMeasurementsFromFile(args.lidarPoints)
@@ -58,19 +72,93 @@ def main(args):
 
     # Combine sweepID, drone position and lidar measurements
     logHandle.log.debug("Combine flight path position per sweep with lidar measurements.")
-    for sweepID in sweepIDs:
-        lidarSweepsList[sweepID].update(
-            {"sweepID": sweepID, "coordinates": pathCoordinates[sweepID]}
+    lidarSweepsList.SetPoses(sweepIDs, pathCoordinates)
+    return lidarSweepsList
+
+
+def ShowSweepsInIsolation(args, lidarSweepsList, headless):
+    """
+    Visualizes, or renders to PNG files if headless, the grid map of every sweep.
+    """
+    jobs = getattr(args, "jobs", 1) or None
+    cacheDir = getattr(args, "cacheDir", None)
+    maxRange = getattr(args, "maxRange", None)
+    if headless:
+        RenderSweepFrames(
+            lidarSweepsList=lidarSweepsList,
+            jobs=jobs,
+            cacheDir=cacheDir,
+            maxRange=maxRange,
         )
+        return
+
+    cache = GridMapCache(cacheDir) if cacheDir else None
+    VisualizeMeasurementsPerSweep(
+        lidarSweepsList=lidarSweepsList,
+        show=args.show,
+        jobs=jobs,
+        cache=cache,
+        maxRange=maxRange,
+    )
+    if cache is not None:
+        logHandle.log.info("Grid map cache: %s", cache.GetStats())
+
+
+def ShowGlobalMap(args, lidarSweepsList, headless):
+    """
+    Fuses all sweeps into one global occupancy map along the flight path, and
+    visualizes it, or renders it to a PNG file if headless.
+    """
+    globalMap = FuseSweepsIntoGlobalMap(
+        lidarSweepsList=lidarSweepsList, angularBin=getattr(args, "angularBin", None)
+    )
+    if headless:
+        RenderGlobalMap(globalMap)
+    else:
+        VisualizeGlobalMap(globalMap, show=args.show)
+
+
+def main(args):
+    """
+    Reads flight path and LiDAR measurement files, or a binary sweep store.
+
+    Args:
+        args (argparse.Namespace): A namespace object containing command-line arguments.
+
+    Raises:
+        AssertionError: If any required input arguments are missing or invalid.
+    """
+
+    profile = getattr(args, "profile", None)
+    if profile:
+        profiler.Enable(traceMemory=getattr(args, "profileMemory", False))
+
+    headless = getattr(args, "headless", False)
+    if args.show and not headless:
+        plt.ion()
+        plt.show()
+
+    lidarSweepsList = ReadSweeps(args)
 
     # Visualize Lidar data per sweeps
     if args.sweepsInIsolation:
-        VisualizeMeasurementsPerSweep(lidarSweepsList=lidarSweepsList, show=args.show)
+        ShowSweepsInIsolation(args, lidarSweepsList, headless)
 
     # Visualize all drone locations along with each sweep measurements
-    if args.allSweepsCombined:
+    if args.allSweepsCombined and headless:
+        RenderAllSweepsWithDronePath(lidarSweepsList=lidarSweepsList)
+    elif args.allSweepsCombined:
         VisualizeAllSweepsWithDronePath(lidarSweepsList=lidarSweepsList, show=args.show)
 
+    # Fuse all sweeps into one global occupancy map along the flight path
+    if args.globalMap:
+        ShowGlobalMap(args, lidarSweepsList, headless)
+
+    if profile:
+        profiler.WriteReport(profile)
+        profiler.Disable()
+        logHandle.log.info("Profile written to %s", profile)
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
@@ -82,6 +170,11 @@ if __name__ == "__main__":
     parser.add_argument(
         "--lidarPoints", help="path to lidar measurements .csv file", type=str
     )
+    parser.add_argument(
+        "--sweepStore",
+        help="path to a binary sweep store written by convert.py, replaces --flightPath and --lidarPoints",
+        type=str,
+    )
     parser.add_argument(
         "--show", help="flag to enable visualization", action="store_true"
     )
@@ -95,7 +188,65 @@ if __name__ == "__main__":
         help="flag to visualization all sweeps combined, --show must be set to true with this flag",
         action="store_true",
     )
+    parser.add_argument(
+        "--globalMap",
+        help="flag to fuse all sweeps into one global occupancy map, --show must be set to true to visualize it",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--angularBin",
+        help="width in degrees of the angular bins of the --globalMap, only the farthest sample of every bin is ray cast",
+        type=float,
+    )
+    parser.add_argument(
+        "--headless",
+        help="flag to render --sweepsInIsolation, --allSweepsCombined and --globalMap "
+        "figures to PNG files in output/ without any window",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--jobs",
+        help="number of processes computing or rendering the per sweep grid maps, 0 for one per CPU",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--cacheDir",
+        help="directory of a cache of the per sweep grid maps, reused by later runs over the same mission",
+        type=str,
+    )
+    parser.add_argument(
+        "--maxRange",
+        help="max range in meters of the per sweep grid maps, which then share one extent "
+        "centered on the lidar, farther samples are clipped",
+        type=float,
+    )
+    parser.add_argument(
+        "--profile",
+        help="path to a .json file receiving the time and counters of every stage, overall and per sweep",
+        type=str,
+    )
+    parser.add_argument(
+        "--profileMemory",
+        help="flag to also measure the peak memory of every stage in the --profile report, slower",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--logLevel",
+        help="level of the console log, LIDAR1D_LOG_LEVEL or DEBUG by default",
+        type=str.upper,
+        choices=LEVEL_NAMES,
+    )
+    parser.add_argument(
+        "--logQueue",
+        help="flag to write the log from a background thread, the processing never waits for the console",
+        action="store_true",
+    )
     args = parser.parse_args()
+    if args.logLevel:
+        logHandle.SetLevel(args.logLevel)
+    if args.logQueue:
+        logHandle.StartQueue()
 
     main(args)
     logHandle.log.debug("******    end of program, exiting.  *******")
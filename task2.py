@@ -1,111 +1,135 @@
 #!/usr/bin/env python3
 __author__ = "Ashesh Vasalya"
+import os
 import sys
+import time
 import argparse
 import numpy
 import matplotlib.pyplot as plt
 
+from libs.loghandler import LEVEL_NAMES
 from libs.lidarutils import VisualizeRandomFlightPathAndSweep, logHandle
+from libs.simulation import GenerateMission, WriteMissionFiles, WriteMissionSweepStore
 
 DESCRIPTION = "Generate new LIDARDPoints data based on a new room layout and new plausible flight plan."
 
 
 def main(args):
-    # Define the dimensions (meters) of the house
-    width = 20.0
-    length = 30.0
-
-    # Define the dimensions of each room
-    roomWidth = 5.0
-    roomLength = 6.0
-
-    # Calculate the number of rooms that can fit in the house
-    roomsWidth = int(width // roomWidth)
-    roomsLength = int(length // roomLength)
-
-    # Generate the layout of the house
-    numSamples = 360
-    positionsList = []
-    anglesList = []
-    distancesList = []
-
-    logHandle.log.debug("Generate some random data to simulate LIDAR measurements")
-    for roomWidth in range(roomsWidth):
-        for roomLength in range(roomsLength):
-            # Random drone waypoints
-            xPos = roomWidth * roomWidth + numpy.random.rand() * 2.0
-            yPos = roomLength * roomLength + numpy.random.rand() * 2.0
-            positionsList.append([xPos, yPos])
-
-            # Random angle samples 0 to 360
-            anglesList.append(numpy.random.randint(0, numSamples, numSamples))
-
-            # Random distances in meters
-            distancesList.append(numpy.random.random_sample(numSamples))
-
-    if args.show:
-        logHandle.log.debug("Plot the drone path and LIDAR data")
-        VisualizeRandomFlightPathAndSweep(positionsList, anglesList, distancesList)
-
-    logHandle.log.debug("Save LIDAR data to LIDARPoints.csv")
-    WriteRandomFlightPathAndSweepData(anglesList, distancesList)
-
-
-def WriteRandomFlightPathAndSweepData(anglesList, distancesList):
     """
-    Converts the LIDARPoints data into a dictionary and saves it into a CSV file named LIDARPoints.csv.
+    Simulates a mission in a procedural room layout and writes it in the format
+    of the recorded missions, or as a binary sweep store.
 
     Args:
-        anglesList (list): A list of angles of LIDAR sweeps.
-        distancesList (list): A list of distances of LIDAR sweeps.
-
-    Returns:
-        None
-
-    Raises:
-        TypeError: If anglesList or distancesList is not a list or if they are empty lists.
+        args (argparse.Namespace): A namespace object containing command-line arguments.
     """
-    # Assert that the input arguments are lists and are not empty
-    assert (
-        isinstance(anglesList, list) and len(anglesList) > 0
-    ), "anglesList must be a non-empty list"
-    assert (
-        isinstance(distancesList, list) and len(distancesList) > 0
-    ), "distancesList must be a non-empty list"
-
-    lidarSweepsList = []
-    for sweepID in range(len(anglesList)):
-        sweepDict = {}
-        for index in anglesList[sweepID]:
-            sweepDict["sweepID"] = sweepID
-            sweepDict["angles"] = anglesList[sweepID][index]
-            sweepDict["distances"] = distancesList[sweepID][index]
-            lidarSweepsList.append(sweepDict)
-
-    # Assert that the converted data is not an empty list
-    assert len(lidarSweepsList) > 0, "LIDARPoints data is empty"
+    start = time.perf_counter()
+    mission = GenerateMission(
+        roomsX=args.roomsX,
+        roomsY=args.roomsY,
+        roomWidth=args.roomWidth,
+        roomLength=args.roomLength,
+        step=args.step,
+        numSamples=args.numSamples,
+        noise=args.noise,
+        maxRange=args.maxRange,
+        seed=args.seed,
+    )
+    numSweeps, numSamples = len(mission["positions"]), len(mission["angles"])
+    logHandle.log.info(
+        "Simulated %d sweeps, %d samples in %.2f s",
+        numSweeps,
+        numSamples,
+        time.perf_counter() - start,
+    )
 
-    with open("LIDARPoints.csv", "w") as f:
-        for sweepID in range(len(lidarSweepsList)):
-            for key in lidarSweepsList[sweepID].keys():
-                f.write("%s,%s\n" % (key, lidarSweepsList[sweepID][key]))
+    os.makedirs(args.outputDir, exist_ok=True)
+    start = time.perf_counter()
+    if args.format == "store":
+        sweepStoreFile = os.path.join(args.outputDir, "mission.l1d")
+        WriteMissionSweepStore(mission, sweepStoreFile)
+        logHandle.log.info("Mission written to %s", sweepStoreFile)
+    else:
+        lidarPoints = os.path.join(args.outputDir, "LIDARPoints.csv")
+        flightPath = os.path.join(args.outputDir, "FlightPath.csv")
+        WriteMissionFiles(mission, lidarPoints, flightPath)
+        logHandle.log.info("Mission written to %s and %s", lidarPoints, flightPath)
+    logHandle.log.info(
+        "Wrote %d samples in %.2f s", numSamples, time.perf_counter() - start
+    )
 
-    # Assert that the CSV file was created and is not empty
-    with open("LIDARPoints.csv", "r") as f:
-        csv_data = f.read().splitlines()
-        assert len(csv_data) > 0, "CSV file is empty"
+    if args.show:
+        logHandle.log.debug("Plot the drone path and LIDAR data")
+        offsets = mission["offsets"]
+        VisualizeRandomFlightPathAndSweep(
+            list(mission["positions"]),
+            numpy.split(mission["angles"], offsets[1:-1]),
+            numpy.split(mission["distances"], offsets[1:-1]),
+        )
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         prog=sys.argv[0],
         description=DESCRIPTION,
+        epilog="python3 task2.py --roomsX 4 --roomsY 5 --seed 3 --outputDir output",
+    )
+    parser.add_argument(
+        "--seed", help="seed of the simulation, for a repeatable mission", type=int
+    )
+    parser.add_argument("--roomsX", help="number of rooms along x", type=int, default=4)
+    parser.add_argument("--roomsY", help="number of rooms along y", type=int, default=5)
+    parser.add_argument(
+        "--roomWidth",
+        help="mean size of the rooms along x (m)",
+        type=float,
+        default=5.0,
+    )
+    parser.add_argument(
+        "--roomLength",
+        help="mean size of the rooms along y (m)",
+        type=float,
+        default=6.0,
+    )
+    parser.add_argument(
+        "--step",
+        help="distance between consecutive sweeps (m)",
+        type=float,
+        default=0.5,
+    )
+    parser.add_argument(
+        "--numSamples", help="number of samples per sweep", type=int, default=533
+    )
+    parser.add_argument(
+        "--noise",
+        help="standard deviation of the range noise (m)",
+        type=float,
+        default=0.01,
+    )
+    parser.add_argument(
+        "--maxRange", help="range of the lidar (m)", type=float, default=20.0
+    )
+    parser.add_argument(
+        "--outputDir", help="directory of the written files", type=str, default="output"
+    )
+    parser.add_argument(
+        "--format",
+        help="csv writes LIDARPoints.csv and FlightPath.csv, store a binary sweep store",
+        choices=("csv", "store"),
+        default="csv",
     )
     parser.add_argument(
         "--show", help="flag to enable visualization", action="store_true"
     )
 
+    parser.add_argument(
+        "--logLevel",
+        help="level of the console log, LIDAR1D_LOG_LEVEL or DEBUG by default",
+        type=str.upper,
+        choices=LEVEL_NAMES,
+    )
     args = parser.parse_args()
+    if args.logLevel:
+        logHandle.SetLevel(args.logLevel)
 
     if args.show:
         plt.ion()
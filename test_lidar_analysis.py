@@ -1,10 +1,96 @@
 #!/usr/bin/env python3
 __author__ = "Ashesh Vasalya"
 
+import gc
+import io
+import os
+import socket
+import argparse
+import asyncio
+import csv
+import itertools
+import json
+import logging
+import threading
+import tracemalloc
+
 import numpy
 import pytest
 
-from libs.lidarutils import ExtractSweepsFromMeasurements
+from libs.lidarutils import (
+    ComputeGridMaps,
+    ConvertToSweepStore,
+    DecodeGridMap,
+    ExtractSweepsFromMeasurements,
+    GetFlightPathFromFile,
+    GetLidarMeasurementsFromFile,
+    GetSweepIndexFromMeasurements,
+    GetSweepsFromSweepStore,
+)
+from libs.sweepstream import IterSweepsFromStream
+from libs.sweepset import SweepSet
+from libs.gridcache import GridMapCache
+from libs.profiling import Profiler, profiler
+from libs.loghandler import CustomFormatter, LogHandler
+from libs.projection import (
+    DATA_TOLERANCE,
+    GetTrigTable,
+    ProjectSweepSet,
+    ProjectToLocalFrame,
+)
+from benchmark import CompareWithBaseline, MeasureStage, WriteScaledMission
+import task1
+from libs.localization import GetObstacleDistances, LikelihoodField, ParticleFilter
+from libs.render import (
+    RenderSweepFrames,
+    RenderAllSweepsWithDronePath,
+    RenderGlobalMap,
+)
+from libs.scanmatching import (
+    EstimateFlightPath,
+    GetScanPoints,
+    MatchConsecutiveSweeps,
+    MatchScans,
+    TransformPoints,
+)
+from libs.spatialindex import SpatialIndex
+from libs.liveservice import (
+    LiveMapService,
+    OpenServiceConnection,
+    ReplayLidarPoints,
+    RequestSnapshot,
+    SendRequest,
+)
+from libs.simulation import (
+    CastSweep,
+    FormatRows,
+    GenerateMission,
+    GenerateRoomLayout,
+    WriteMissionFiles,
+)
+from libs.mapping import lidar_to_grid_map
+from libs.mapping import global_map
+from libs.mapping import downsample
+from libs.mapping import tiled_grid
+from libs.mapping import ray_query
+from libs.mapping import distance_field
+
+LIDAR_POINTS = "data/LIDARPoints.csv"
+FLIGHT_PATH = "data/FlightPath.csv"
+
+
+def GetBundledSweepPoints(sweepIDs):
+    """Returns the local x, y coordinates of some sweeps of the bundled data."""
+    angles, distances = GetLidarMeasurementsFromFile(LIDAR_POINTS)
+    lidarSweepsList = ExtractSweepsFromMeasurements(angles, distances)
+    points = []
+    for sweepID in sweepIDs:
+        radians = lidarSweepsList[sweepID]["angles"] * (numpy.pi / 180)
+        sweepDistances = lidarSweepsList[sweepID]["distances"]
+        points.append(
+            (sweepDistances * numpy.sin(radians), sweepDistances * numpy.cos(radians))
+        )
+    return points
 
 
 class TestExtractSweepsFromMeasurements:
@@ -72,3 +158,1641 @@ class TestExtractSweepsFromMeasurements:
             angles = numpy.array([0, 90, numpy.inf, 270])
             distances = numpy.array([1, 2, 3, 4])
             ExtractSweepsFromMeasurements(angles, distances)
+
+    def test_sweeps_from_headers(self):
+        """Test function to ensure sweeps are split on their header rows,
+        even when a sample distance equals the header sample count.
+        """
+        angles = numpy.array([0, 10.5, 20.5, 1, 30.5, 40.5, 50.5])
+        distances = numpy.array([2, 3000, 3, 3, 1000, 2000, 3000])
+        lidarSweepsList = ExtractSweepsFromMeasurements(angles, distances)
+        assert len(lidarSweepsList) == 2
+        numpy.testing.assert_array_equal(lidarSweepsList[0]["angles"], [10.5, 20.5])
+        numpy.testing.assert_array_equal(lidarSweepsList[0]["distances"], [3.0, 0.003])
+        numpy.testing.assert_array_equal(lidarSweepsList[1]["distances"], [1, 2, 3])
+
+    def test_malformed_header(self):
+        """Test function to ensure the function raises an AssertionError
+        when a sweep claims more samples than there are left.
+        """
+        with pytest.raises(AssertionError):
+            angles = numpy.array([0, 10.5, 20.5])
+            distances = numpy.array([5, 3000, 3000])
+            ExtractSweepsFromMeasurements(angles, distances)
+
+    def test_bundled_data(self):
+        """Test function to ensure all sweeps of the bundled data are found
+        and share memory with the converted distances.
+        """
+        angles, distances = GetLidarMeasurementsFromFile(LIDAR_POINTS)
+        sweepIDs, startIndices, numSamples = GetSweepIndexFromMeasurements(
+            angles, distances
+        )
+        numpy.testing.assert_array_equal(sweepIDs, numpy.arange(34))
+        assert startIndices[-1] + numSamples[-1] == len(angles)
+
+        lidarSweepsList = ExtractSweepsFromMeasurements(angles, distances)
+        assert [len(sweep["angles"]) for sweep in lidarSweepsList] == list(numSamples)
+        baseArray = lidarSweepsList[0]["distances"].base
+        assert baseArray is not None
+        assert all(sweep["distances"].base is baseArray for sweep in lidarSweepsList)
+
+
+class TestSweepSet:
+    """Test class for the array backed SweepSet"""
+
+    def test_csr_storage_and_views(self):
+        """Test function to ensure the sweeps are stored back to back, without
+        their header rows, and handed out as slotted views.
+        """
+        angles = numpy.array([0, 10.5, 20.5, 7, 30.5, 40.5, 50.5])
+        distances = numpy.array([2, 3000, 3, 3, 1000, 2000, 3000])
+        lidarSweepsList = ExtractSweepsFromMeasurements(angles, distances)
+        assert isinstance(lidarSweepsList, SweepSet)
+        numpy.testing.assert_array_equal(lidarSweepsList.offsets, [0, 2, 5])
+        numpy.testing.assert_array_equal(lidarSweepsList.sweepIDs, [0, 7])
+        numpy.testing.assert_array_equal(
+            lidarSweepsList.distances, [3.0, 0.003, 1, 2, 3]
+        )
+        sweep = lidarSweepsList[-1]
+        assert not hasattr(sweep, "__dict__")
+        assert sweep.sweepID == sweep["sweepID"] == 7
+        assert sweep.get("coordinates") is None
+        assert numpy.shares_memory(sweep.angles, lidarSweepsList.angles)
+
+    def test_set_poses_and_slices(self):
+        """Test function to ensure poses are set by sweep ID, and slices share
+        the sample arrays of the set.
+        """
+        angles, distances = GetLidarMeasurementsFromFile(LIDAR_POINTS)
+        lidarSweepsList = ExtractSweepsFromMeasurements(angles, distances)
+        sweepIDs, pathCoordinates = GetFlightPathFromFile(FLIGHT_PATH)
+        lidarSweepsList.SetPoses(sweepIDs[::-1], pathCoordinates[::-1])
+        numpy.testing.assert_array_equal(lidarSweepsList.poses, pathCoordinates)
+
+        firstSweeps = lidarSweepsList[2:5]
+        assert len(firstSweeps) == 3 and firstSweeps[0].sweepID == 2
+        assert firstSweeps.angles.base is lidarSweepsList.angles
+        numpy.testing.assert_array_equal(
+            firstSweeps[1]["distances"], lidarSweepsList[3]["distances"]
+        )
+        with pytest.raises(AssertionError):
+            lidarSweepsList.SetPoses([99], [[0.0, 0.0]])
+
+    def test_from_sweeps(self):
+        """Test function to ensure a list of sweep dictionaries is packed
+        with its sweep IDs and coordinates.
+        """
+        sweeps = [
+            {"sweepID": 4, "angles": [1.0, 2.0], "distances": [3.0, 4.0]},
+            {"angles": [], "distances": [], "coordinates": (1.5, 2.5)},
+        ]
+        lidarSweepsList = SweepSet.FromSweeps(sweeps)
+        numpy.testing.assert_array_equal(lidarSweepsList.sweepIDs, [4, 1])
+        numpy.testing.assert_array_equal(lidarSweepsList.GetMaxDistances(), [4, 0])
+        assert lidarSweepsList[0]["coordinates"] is None
+        numpy.testing.assert_array_equal(lidarSweepsList[1]["coordinates"], (1.5, 2.5))
+
+
+class TestGetLidarMeasurementsFromFile:
+    """Test class for GetLidarMeasurementsFromFile function"""
+
+    def test_matches_row_by_row_parsing(self):
+        """Test function to ensure the bulk loader returns the same values
+        as parsing the file row by row.
+        """
+        with open(LIDAR_POINTS) as fileHandler:
+            rows = [(float(row[0]), float(row[1])) for row in csv.reader(fileHandler)]
+        expected = numpy.array(rows)
+
+        angles, distances = GetLidarMeasurementsFromFile(LIDAR_POINTS)
+        assert angles.flags["C_CONTIGUOUS"] and distances.flags["C_CONTIGUOUS"]
+        numpy.testing.assert_array_equal(angles, expected[:, 0])
+        numpy.testing.assert_array_equal(distances, expected[:, 1])
+
+    def test_chunked_matches_bulk(self):
+        """Test function to ensure the chunked mode returns the same arrays
+        as the single pass mode.
+        """
+        angles, distances = GetLidarMeasurementsFromFile(LIDAR_POINTS)
+        chunkAngles, chunkDistances = GetLidarMeasurementsFromFile(
+            LIDAR_POINTS, chunkSize=1000
+        )
+        numpy.testing.assert_array_equal(angles, chunkAngles)
+        numpy.testing.assert_array_equal(distances, chunkDistances)
+
+    def test_invalid_chunk_size(self):
+        """Test function to ensure the function raises an AssertionError
+        when chunkSize is not a positive integer.
+        """
+        with pytest.raises(AssertionError):
+            GetLidarMeasurementsFromFile(LIDAR_POINTS, chunkSize=0)
+
+
+class TestSweepStore:
+    """Test class for the binary sweep store"""
+
+    def test_round_trip(self, tmp_path):
+        """Test function to ensure the sweeps read back from a sweep store
+        match the sweeps extracted from the CSV files.
+        """
+        sweepStoreFile = str(tmp_path / "mission.l1d")
+        ConvertToSweepStore(LIDAR_POINTS, FLIGHT_PATH, sweepStoreFile)
+
+        angles, distances = GetLidarMeasurementsFromFile(LIDAR_POINTS)
+        expectedSweeps = ExtractSweepsFromMeasurements(angles, distances)
+        sweepIDs, pathCoordinates = GetFlightPathFromFile(FLIGHT_PATH)
+
+        lidarSweepsList = GetSweepsFromSweepStore(sweepStoreFile)
+        assert len(lidarSweepsList) == len(expectedSweeps)
+        for sweep, expected in zip(lidarSweepsList, expectedSweeps):
+            assert isinstance(sweep["angles"], numpy.memmap)
+            numpy.testing.assert_allclose(sweep["angles"], expected["angles"], 1e-6)
+            numpy.testing.assert_allclose(
+                sweep["distances"], expected["distances"], 1e-6
+            )
+        for sweepID, coordinates in zip(sweepIDs, pathCoordinates):
+            numpy.testing.assert_array_equal(
+                lidarSweepsList[sweepID]["coordinates"], coordinates
+            )
+
+    def test_not_a_sweep_store(self):
+        """Test function to ensure the function raises an AssertionError
+        when the file is not a sweep store.
+        """
+        with pytest.raises(AssertionError):
+            GetSweepsFromSweepStore(LIDAR_POINTS)
+
+
+class TestIterSweepsFromStream:
+    """Test class for IterSweepsFromStream function"""
+
+    def test_matches_extracted_sweeps(self):
+        """Test function to ensure the streamed sweeps match the sweeps
+        extracted from the whole recording.
+        """
+        angles, distances = GetLidarMeasurementsFromFile(LIDAR_POINTS)
+        expectedSweeps = ExtractSweepsFromMeasurements(angles, distances)
+        sweepIDs, pathCoordinates = GetFlightPathFromFile(FLIGHT_PATH)
+
+        with open(LIDAR_POINTS) as fileHandler:
+            stream = io.StringIO(fileHandler.read())
+        streamedSweeps = list(
+            IterSweepsFromStream(stream, poses=dict(zip(sweepIDs, pathCoordinates)))
+        )
+
+        assert len(streamedSweeps) == len(expectedSweeps)
+        for sweep, expected in zip(streamedSweeps, expectedSweeps):
+            numpy.testing.assert_array_equal(sweep["angles"], expected["angles"])
+            numpy.testing.assert_allclose(sweep["distances"], expected["distances"])
+            numpy.testing.assert_array_equal(
+                sweep["coordinates"], pathCoordinates[sweep["sweepID"]]
+            )
+
+    def test_follow_appended_file(self, tmp_path):
+        """Test function to ensure a followed file yields a sweep once its
+        last sample has been appended, even when written in pieces.
+        """
+        fileName = tmp_path / "LIDARPoints.csv"
+        fileName.write_text("0,2\n10.5,1000\n20")
+
+        def AppendRest():
+            with open(fileName, "a") as fileHandler:
+                fileHandler.write(".5,2000\n")
+
+        timer = threading.Timer(0.2, AppendRest)
+        timer.start()
+        sweeps = list(
+            IterSweepsFromStream(
+                str(fileName), follow=True, pollInterval=0.01, idleTimeout=1.0
+            )
+        )
+        timer.join()
+
+        assert len(sweeps) == 1
+        numpy.testing.assert_array_equal(sweeps[0]["angles"], [10.5, 20.5])
+        numpy.testing.assert_allclose(sweeps[0]["distances"], [1.0, 2.0])
+
+    def test_malformed_lines_keep_the_stream(self):
+        """Test function to ensure a malformed line only drops its sweep and
+        the stream goes on with the next sweeps.
+        """
+        stream = io.StringIO("0,2\n1.5,1000\nx,y\n1,1\n2.5,2000\nz\n2,1\n3.5,3000\n")
+        sweeps = list(IterSweepsFromStream(stream))
+        assert [sweep["sweepID"] for sweep in sweeps] == [1, 2]
+        numpy.testing.assert_allclose(sweeps[1]["distances"], [3.0])
+
+    def test_resync_needs_a_consistent_first_header(self):
+        """Test function to ensure that after a malformed first header, a
+        sample line with integral values is not taken for a header, and that a
+        first header found by the resync is trusted at the end of the feed.
+        """
+        lines = ["bad header", "90,2", "10.5,1000", "20.5,2000", "1,2"]
+        lines += ["30.5,3000", "40.5,4000", "2,1", "50.5,5000"]
+        sweeps = list(IterSweepsFromStream(io.StringIO("\n".join(lines))))
+        assert [sweep["sweepID"] for sweep in sweeps] == [1, 2]
+        numpy.testing.assert_array_equal(sweeps[0]["angles"], [30.5, 40.5])
+
+        sweeps = list(IterSweepsFromStream(io.StringIO("bad\n5,1\n1.5,1000\n")))
+        assert [sweep["sweepID"] for sweep in sweeps] == [5]
+
+
+class TestGenerateRayCastingGridMap:
+    """Test class for generate_ray_casting_grid_map function"""
+
+    def test_bresenham_batch(self):
+        """Test function to ensure the batched Bresenham lines hold the same
+        points as the scalar Bresenham lines.
+        """
+        randomState = numpy.random.RandomState(0)
+        start = (7, -3)
+        ends = randomState.randint(-40, 40, (200, 2))
+        points, beams = lidar_to_grid_map.bresenham_batch(start, ends)
+        for index, end in enumerate(ends):
+            expected = lidar_to_grid_map.bresenham(start, tuple(end)).reshape(-1, 2)
+            assert sorted(map(tuple, points[beams == index])) == sorted(
+                map(tuple, expected)
+            )
+
+    @pytest.mark.parametrize("sweepID", [0, 17, 32])
+    def test_batch_matches_bresenham(self, sweepID):
+        """Test function to ensure the batched ray casting produces the same
+        free and occupied cells as casting one beam at a time.
+        """
+        ox, oy = GetBundledSweepPoints([sweepID])[0]
+        batchMap = lidar_to_grid_map.generate_ray_casting_grid_map(
+            ox, oy, 0.02, sweepID, True, batch=True
+        )[0]
+        loopMap = lidar_to_grid_map.generate_ray_casting_grid_map(
+            ox, oy, 0.02, sweepID, True, batch=False
+        )[0]
+        numpy.testing.assert_array_equal(batchMap, loopMap)
+
+    def test_batch_matches_bresenham_overlapping_beams(self):
+        """Test function to ensure later beams overwrite earlier occupied
+        cells in the same way in both modes.
+        """
+        randomState = numpy.random.RandomState(1)
+        ox = randomState.uniform(-1.9, 1.9, 300)
+        oy = randomState.uniform(-1.9, 1.9, 300)
+        batchMap = lidar_to_grid_map.generate_ray_casting_grid_map(
+            ox, oy, 0.05, batch=True
+        )[0]
+        loopMap = lidar_to_grid_map.generate_ray_casting_grid_map(
+            ox, oy, 0.05, batch=False
+        )[0]
+        numpy.testing.assert_array_equal(batchMap, loopMap)
+
+    @pytest.mark.parametrize("sweepID", [1, 5])
+    def test_flood_fill_batch_matches_flood_fill(self, sweepID):
+        """Test function to ensure the vectorized flood fill produces the
+        same map as the queue based flood fill.
+        """
+        ox, oy = GetBundledSweepPoints([sweepID])[0]
+        batchMap = lidar_to_grid_map.generate_ray_casting_grid_map(
+            ox, oy, 0.05, sweepID, False, batch=True
+        )[0]
+        queueMap = lidar_to_grid_map.generate_ray_casting_grid_map(
+            ox, oy, 0.05, sweepID, False, batch=False
+        )[0]
+        numpy.testing.assert_array_equal(batchMap, queueMap)
+
+
+class TestComputeGridMaps:
+    """Test class for the ComputeGridMaps function"""
+
+    def test_parallel_matches_serial(self):
+        """Test function to ensure the process pool returns the same maps, in
+        the same order, as the serial computation.
+        """
+        angles, distances = GetLidarMeasurementsFromFile(LIDAR_POINTS)
+        lidarSweepsList = ExtractSweepsFromMeasurements(angles, distances)[:6]
+        serial = ComputeGridMaps(lidarSweepsList, 0.02, jobs=1)
+        parallel = ComputeGridMaps(lidarSweepsList, 0.02, jobs=3)
+        assert [gridMap["sweepID"] for gridMap in parallel] == list(range(6))
+        for serialMap, parallelMap in zip(serial, parallel):
+            numpy.testing.assert_array_equal(
+                serialMap["gridMap"], parallelMap["gridMap"]
+            )
+            assert serialMap["extent"] == parallelMap["extent"]
+
+    def test_compact_maps_decode_to_grid_map(self):
+        """Test function to ensure the uint8 maps decode to the maps of
+        generate_ray_casting_grid_map.
+        """
+        angles, distances = GetLidarMeasurementsFromFile(LIDAR_POINTS)
+        lidarSweepsList = ExtractSweepsFromMeasurements(angles, distances)
+        gridMap = ComputeGridMaps([lidarSweepsList[17]], 0.05)[0]["gridMap"]
+        ox, oy = GetBundledSweepPoints([17])[0]
+        expected = lidar_to_grid_map.generate_ray_casting_grid_map(ox, oy, 0.05)[0]
+        assert gridMap.dtype == numpy.uint8
+        numpy.testing.assert_array_equal(DecodeGridMap(gridMap), expected)
+
+    def test_jobs_must_be_positive(self):
+        """Test function to ensure the function raises an AssertionError
+        when jobs is not positive.
+        """
+        with pytest.raises(AssertionError):
+            ComputeGridMaps([{"angles": [0.0], "distances": [1.0]}], jobs=0)
+
+
+class TestGridMapCache:
+    """Test class for the GridMapCache of the per sweep grid maps"""
+
+    def test_memory_tier(self):
+        """Test function to ensure a cached map equals the ray cast one and
+        the second lookup is a memory hit.
+        """
+        ox, oy = GetBundledSweepPoints([17])[0]
+        expected = lidar_to_grid_map.generate_ray_casting_grid_map(ox, oy, 0.05)
+        cache = GridMapCache()
+        for _ in range(2):
+            result = cache.GetOrCompute(ox, oy, 0.05)
+            numpy.testing.assert_array_equal(result[0], expected[0])
+            assert result[1:] == expected[1:]
+        assert (cache.memoryHits, cache.diskHits, cache.misses) == (1, 0, 1)
+        cache.GetOrCompute(ox, oy, 0.05, breshen=False)
+        assert cache.misses == 2
+
+    def test_disk_tier_skips_ray_casting(self, tmp_path, monkeypatch):
+        """Test function to ensure a new cache on the same directory serves
+        the maps from disk without ray casting.
+        """
+        angles, distances = GetLidarMeasurementsFromFile(LIDAR_POINTS)
+        lidarSweepsList = ExtractSweepsFromMeasurements(angles, distances)[:4]
+        expected = ComputeGridMaps(
+            lidarSweepsList, 0.02, cache=GridMapCache(str(tmp_path))
+        )
+
+        def FailRayCasting(*args, **kwargs):
+            raise AssertionError("ray casting should be skipped")
+
+        monkeypatch.setattr(
+            lidar_to_grid_map, "generate_ray_casting_grid_map", FailRayCasting
+        )
+        cache = GridMapCache(str(tmp_path))
+        gridMaps = ComputeGridMaps(lidarSweepsList, 0.02, cache=cache)
+        assert cache.GetStats()["diskHits"] == 4 and cache.misses == 0
+        for gridMap, expectedMap in zip(gridMaps, expected):
+            numpy.testing.assert_array_equal(gridMap["gridMap"], expectedMap["gridMap"])
+            assert gridMap["extent"] == expectedMap["extent"]
+
+    def test_disk_tier_eviction(self, tmp_path):
+        """Test function to ensure the least recently used entries are evicted
+        once the disk tier grows past its size limit.
+        """
+        cache = GridMapCache(str(tmp_path), maxMemoryEntries=0)
+        gridMap = numpy.random.RandomState(1).randint(0, 3, (16, 16))
+        cache.Put("a", gridMap.astype(numpy.uint8), (0, 1, 0, 1))
+        cache.maxDiskBytes = int(cache.diskBytes * 2.5)
+        for key in ["b", "c"]:
+            cache.Put(key, gridMap.astype(numpy.uint8), (0, 1, 0, 1))
+        assert cache.diskBytes <= cache.maxDiskBytes
+        assert len(list(tmp_path.iterdir())) == 2
+        assert cache.Get("a") is None and cache.Get("c") is not None
+
+
+class TestRenderSweepFrames:
+    """Test class for the headless RenderSweepFrames function"""
+
+    @pytest.mark.parametrize("jobs", [1, 2])
+    def test_writes_one_png_per_sweep(self, tmp_path, jobs):
+        """Test function to ensure every sweep is rendered to its own PNG
+        file, in the order of the sweeps.
+        """
+        angles, distances = GetLidarMeasurementsFromFile(LIDAR_POINTS)
+        lidarSweepsList = ExtractSweepsFromMeasurements(angles, distances)
+        sweeps = [lidarSweepsList[17], {"angles": lidarSweepsList[32]["angles"]}]
+        sweeps[1]["distances"] = lidarSweepsList[32]["distances"]
+        fileNames = RenderSweepFrames(
+            sweeps, str(tmp_path / "frames"), xy_resolution=0.05, jobs=jobs
+        )
+        assert [name.rsplit("/", 1)[-1] for name in fileNames] == [
+            "sweepID_17.png",
+            "sweepID_1.png",
+        ]
+        for fileName in fileNames:
+            with open(fileName, "rb") as fileHandler:
+                assert fileHandler.read(8) == b"\x89PNG\r\n\x1a\n"
+
+    def test_drone_path_without_window(self, tmp_path):
+        """Test function to ensure the flight path figure is written without
+        any interactive backend or input.
+        """
+        sweepIDs, pathCoordinates = GetFlightPathFromFile(FLIGHT_PATH)
+        angles, distances = GetLidarMeasurementsFromFile(LIDAR_POINTS)
+        lidarSweepsList = ExtractSweepsFromMeasurements(angles, distances)
+        for sweepID in sweepIDs:
+            lidarSweepsList[sweepID]["coordinates"] = pathCoordinates[sweepID]
+        fileName = RenderAllSweepsWithDronePath(
+            lidarSweepsList, str(tmp_path / "path.png")
+        )
+        assert (tmp_path / "path.png").stat().st_size > 0
+        assert fileName == str(tmp_path / "path.png")
+
+    def test_global_map_without_window(self, tmp_path):
+        """Test function to ensure the global map figure is written without
+        any interactive backend or input.
+        """
+        globalMap = global_map.GlobalOccupancyMap(-5, -5, 5, 5, 0.1)
+        globalMap.add_sweep(numpy.array([0.0, 90.0]), numpy.array([2.0, 3.0]), (1, 1))
+        fileName = RenderGlobalMap(globalMap, str(tmp_path / "map" / "global.png"))
+        assert fileName == str(tmp_path / "map" / "global.png")
+        with open(fileName, "rb") as fileHandler:
+            assert fileHandler.read(8) == b"\x89PNG\r\n\x1a\n"
+
+    def test_headless_global_map(self, tmp_path, monkeypatch):
+        """Test function to ensure task1 --globalMap --show --headless writes
+        the global map to output/ and never waits for input.
+        """
+        args = argparse.Namespace(
+            flightPath=os.path.abspath(FLIGHT_PATH),
+            lidarPoints=os.path.abspath(LIDAR_POINTS),
+            show=True,
+            headless=True,
+            sweepsInIsolation=False,
+            allSweepsCombined=False,
+            globalMap=True,
+            angularBin=1.0,
+        )
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr("builtins.input", pytest.fail)
+        task1.main(args)
+        assert (tmp_path / "output" / "globalMap.png").stat().st_size > 0
+
+
+class TestGlobalOccupancyMap:
+    """Test class for the GlobalOccupancyMap log-odds fusion"""
+
+    def test_hits_and_pass_throughs(self):
+        """Test function to ensure a beam end point becomes occupied and the
+        cells along the beam become free, in world coordinates.
+        """
+        globalMap = global_map.GlobalOccupancyMap(-5, -5, 5, 5, 0.1)
+        globalMap.add_sweep(numpy.array([0.0, 90.0]), numpy.array([2.0, 3.0]), (1, 1))
+        probability = globalMap.probability()
+
+        hitX, hitY = globalMap.world_to_grid([3.0, 1.0], [1.0, -2.0])
+        assert (probability[hitX, hitY] > 0.5).all()
+        freeX, freeY = globalMap.world_to_grid([2.0, 1.0], [1.0, -0.5])
+        assert (probability[freeX, freeY] < 0.5).all()
+        assert numpy.count_nonzero(globalMap.log_odds) == 20 + 30 + 2 - 1
+
+    def test_log_odds_are_clamped(self):
+        """Test function to ensure repeated hits saturate at the clamp value
+        instead of overflowing the integer cells.
+        """
+        globalMap = global_map.GlobalOccupancyMap(
+            -2, -2, 2, 2, 0.1, dtype=numpy.int8, p_clamp=0.75
+        )
+        for _ in range(10):
+            globalMap.add_sweep(numpy.array([45.0]), numpy.array([1.0]), (0, 0))
+        assert globalMap.log_odds.max() == globalMap.l_max
+        assert globalMap.log_odds.min() == -globalMap.l_max
+
+    def test_consecutive_bundled_sweeps_overlap(self):
+        """Test function to ensure consecutive sweeps of the bundled data,
+        fused from their flight path positions, hit the same walls within a few
+        cells.
+        """
+        angles, distances = GetLidarMeasurementsFromFile(LIDAR_POINTS)
+        lidarSweepsList = ExtractSweepsFromMeasurements(angles, distances)
+        lidarSweepsList.SetPoses(*GetFlightPathFromFile(FLIGHT_PATH))
+        hits = []
+        for sweep in lidarSweepsList:
+            globalMap = global_map.GlobalOccupancyMap(-20, -20, 40, 40, 0.05)
+            globalMap.add_sweep(sweep.angles, sweep.distances, sweep.coordinates)
+            hits.append(numpy.argwhere(globalMap.log_odds > 0).astype(float))
+        for previous, current in zip(hits[:-1], hits[1:]):
+            _, gaps = SpatialIndex(4.0, previous).QueryNearest(current)
+            assert numpy.median(gaps) <= 2.0
+
+    def test_clamp_must_fit_dtype(self):
+        """Test function to ensure the function raises an AssertionError
+        when the clamp value does not fit in the cell type.
+        """
+        with pytest.raises(AssertionError):
+            global_map.GlobalOccupancyMap(-2, -2, 2, 2, 0.1, dtype=numpy.int8)
+
+
+class TestTiledGrid:
+    """Test class for the sparse TiledGrid backend"""
+
+    def test_set_get_round_trip(self):
+        """Test function to ensure written cells are read back, including
+        negative indices, and unwritten cells keep the fill value.
+        """
+        grid = tiled_grid.TiledGrid(tile_size=8)
+        ix = numpy.array([-20, -1, 0, 7, 8, 100])
+        iy = numpy.array([3, -9, 0, 7, 8, -100])
+        grid.set(ix, iy, numpy.arange(6, dtype=float))
+        numpy.testing.assert_array_equal(grid.get(ix, iy), numpy.arange(6))
+        numpy.testing.assert_array_equal(grid.get([1, 500], [1, 500]), [0.5, 0.5])
+
+    def test_memory_tracks_observed_tiles(self):
+        """Test function to ensure two far apart cells only allocate two tiles
+        instead of their bounding box.
+        """
+        grid = tiled_grid.TiledGrid(tile_size=16)
+        grid.set([0, 100000], [0, 100000], 1.0)
+        assert len(grid) == 2
+        assert grid.nbytes == 2 * 16 * 16 * 8
+
+    def test_lru_spills_to_disk(self, tmp_path):
+        """Test function to ensure cold tiles are spilled to disk once
+        max_tiles is reached, and loaded back unchanged.
+        """
+        grid = tiled_grid.TiledGrid(tile_size=4, max_tiles=2, spill_dir=str(tmp_path))
+        for tile in range(5):
+            grid.set([tile * 4], [0], float(tile))
+        assert len(grid.tiles) == 2 and len(grid.spilled) == 3
+        assert len(list(tmp_path.iterdir())) == 3
+        numpy.testing.assert_array_equal(
+            grid.get(numpy.arange(5) * 4, numpy.zeros(5)), numpy.arange(5)
+        )
+        dense, minX, minY = grid.to_dense()
+        assert (minX, minY) == (0, 0) and dense.shape == (20, 4)
+
+    def test_temporary_spill_dir_is_removed(self):
+        """Test function to ensure the spill directory a grid creates is
+        removed by close(), or once the grid is garbage collected.
+        """
+        spillDirs = []
+        for closed in (True, False):
+            grid = tiled_grid.TiledGrid(tile_size=4, max_tiles=1)
+            for tile in range(3):
+                grid.set([tile * 4], [0], float(tile))
+            spillDirs.append(grid.spill_dir)
+            assert len(os.listdir(grid.spill_dir)) == 2
+            if closed:
+                grid.close()
+                assert not os.path.exists(spillDirs[-1])
+            del grid
+            gc.collect()
+        assert not any(os.path.exists(spillDir) for spillDir in spillDirs)
+
+    @pytest.mark.parametrize("breshen", [True, False])
+    def test_ray_casting_into_grid(self, breshen):
+        """Test function to ensure a sweep written into a TiledGrid holds the
+        known cells of the dense map, shifted to grid_offset.
+        """
+        ox, oy = GetBundledSweepPoints([17])[0]
+        occupancyMap = lidar_to_grid_map.generate_ray_casting_grid_map(
+            ox, oy, 0.05, breshen=breshen
+        )[0]
+        minX, minY = lidar_to_grid_map.calc_grid_map_config(ox, oy, 0.05)[:2]
+        centerX, centerY = int(round(-minX / 0.05)), int(round(-minY / 0.05))
+
+        grid = tiled_grid.TiledGrid(tile_size=32)
+        lidar_to_grid_map.generate_ray_casting_grid_map(
+            ox, oy, 0.05, breshen=breshen, grid=grid, grid_offset=(1000, -1000)
+        )
+        knownX, knownY = numpy.nonzero(occupancyMap != 0.5)
+        numpy.testing.assert_array_equal(
+            grid.get(knownX - centerX + 1000, knownY - centerY - 1000),
+            occupancyMap[knownX, knownY],
+        )
+        dense = grid.to_dense()[0]
+        assert numpy.count_nonzero(dense != 0.5) == len(knownX)
+
+    def test_tiled_global_map_matches_dense(self):
+        """Test function to ensure the tiled global map fuses sweeps to the
+        same log-odds as the dense one.
+        """
+        sweeps = [
+            (numpy.array([0.0, 90.0, 200.0]), numpy.array([2.0, 3.0, 1.5]), (1, 1)),
+            (numpy.array([10.0, 45.0]), numpy.array([2.5, 1.0]), (0, 1)),
+        ]
+        denseMap = global_map.GlobalOccupancyMap(-5, -5, 5, 5, 0.1)
+        tiledMap = global_map.GlobalOccupancyMap(-5, -5, 5, 5, 0.1, tile_size=16)
+        for angles, distances, coordinates in sweeps:
+            assert denseMap.add_sweep(angles, distances, coordinates) == (
+                tiledMap.add_sweep(angles, distances, coordinates)
+            )
+        cellX, cellY = numpy.nonzero(denseMap.log_odds)
+        numpy.testing.assert_array_equal(
+            tiledMap.log_odds.get(cellX, cellY), denseMap.log_odds[cellX, cellY]
+        )
+        assert numpy.count_nonzero(tiledMap.dense_log_odds()[0]) == len(cellX)
+
+
+class TestBenchmark:
+    """Test class for the helpers of benchmark.py"""
+
+    def test_scaled_mission(self, tmp_path):
+        """Test function to ensure a scaled mission holds renumbered copies of
+        the recorded sweeps and poses.
+        """
+        lidarPoints, flightPath = WriteScaledMission(
+            LIDAR_POINTS, FLIGHT_PATH, 3, str(tmp_path)
+        )
+        angles, distances = GetLidarMeasurementsFromFile(lidarPoints)
+        lidarSweepsList = ExtractSweepsFromMeasurements(angles, distances)
+        numpy.testing.assert_array_equal(lidarSweepsList.sweepIDs, numpy.arange(102))
+        numpy.testing.assert_array_equal(
+            lidarSweepsList[70]["angles"], lidarSweepsList[2]["angles"]
+        )
+        sweepIDs, pathCoordinates = GetFlightPathFromFile(flightPath)
+        numpy.testing.assert_array_equal(sweepIDs, numpy.arange(102))
+        numpy.testing.assert_allclose(
+            pathCoordinates[70] - pathCoordinates[2], [60.0, 0.0]
+        )
+
+    def test_compare_with_baseline(self):
+        """Test function to ensure only changes beyond both the threshold and
+        the noise floor are reported as regressions.
+        """
+        baseline = {
+            "slow": {"seconds": 1.0, "peakBytes": 1 << 20},
+            "tiny": {"seconds": 0.0001, "peakBytes": 100},
+        }
+        results = {
+            "slow": {"seconds": 1.5, "peakBytes": 1 << 20},
+            "tiny": {"seconds": 0.0005, "peakBytes": 1000},
+            "new": {"seconds": 9.0, "peakBytes": 1 << 30},
+        }
+        assert CompareWithBaseline(results, baseline, 0.2) == [
+            ("slow", "seconds", 1.0, 1.5)
+        ]
+        assert CompareWithBaseline(results, baseline, 0.6) == []
+
+
+class TestSimulation:
+    """Test class for the synthetic missions of libs/simulation.py"""
+
+    def test_cast_sweep_in_one_room(self):
+        """Test function to ensure the beams hit the walls of a room at the
+        distances of its geometry, in the world frame convention.
+        """
+        layout = GenerateRoomLayout(1, 1, 5.0, 6.0, sizeJitter=0.0)
+        distances = CastSweep(
+            layout, (1.0, 2.0), numpy.array([0.0, 90.0, 180.0, 270.0, 45.0])
+        )
+        numpy.testing.assert_allclose(
+            distances, [4.0, 2.0, 1.0, 4.0, numpy.hypot(2.0, 2.0)]
+        )
+
+    def test_seeded_mission_is_repeatable(self):
+        """Test function to ensure the same seed gives the same mission and
+        every sweep is cast from inside the building.
+        """
+        first = GenerateMission(roomsX=3, roomsY=2, seed=7)
+        second = GenerateMission(roomsX=3, roomsY=2, seed=7)
+        for key in ("walls", "positions", "angles", "distances"):
+            numpy.testing.assert_array_equal(first[key], second[key])
+        assert not numpy.array_equal(
+            first["distances"], GenerateMission(roomsX=3, roomsY=2, seed=8)["distances"]
+        )
+        assert (first["distances"] > 0).all() and (first["distances"] < 20.0).all()
+
+    def test_format_rows(self):
+        """Test function to ensure the rows match those of the % operator."""
+        first = numpy.array([0.0, 1.5, 359.9999994, 12.0, 0.000001])
+        second = numpy.array([0, 8964, 12, 533, 1000000])
+        decimals = numpy.array([True, True, True, False, True])
+        expected = "".join(
+            ("%.6f,%d\n" if decimal else "%d,%d\n") % (value, count)
+            for value, count, decimal in zip(first, second, decimals)
+        )
+        assert FormatRows(first, second, decimals).decode() == expected
+
+    def test_written_mission_round_trip(self, tmp_path):
+        """Test function to ensure a written mission is read back by the
+        parsers of the recorded data.
+        """
+        mission = GenerateMission(roomsX=2, roomsY=2, numSamples=90, seed=1)
+        lidarPoints, flightPath = str(tmp_path / "L.csv"), str(tmp_path / "F.csv")
+        WriteMissionFiles(mission, lidarPoints, flightPath, chunkSize=1000)
+        angles, distances = GetLidarMeasurementsFromFile(lidarPoints)
+        lidarSweepsList = ExtractSweepsFromMeasurements(angles, distances)
+        numSweeps = len(mission["positions"])
+        numpy.testing.assert_array_equal(
+            lidarSweepsList.sweepIDs, numpy.arange(numSweeps)
+        )
+        numpy.testing.assert_allclose(
+            lidarSweepsList.angles, mission["angles"] % 360.0, atol=1e-6
+        )
+        numpy.testing.assert_allclose(
+            lidarSweepsList.distances, mission["distances"], atol=1e-3
+        )
+        sweepIDs, pathCoordinates = GetFlightPathFromFile(flightPath)
+        numpy.testing.assert_array_equal(sweepIDs, numpy.arange(numSweeps))
+        numpy.testing.assert_allclose(pathCoordinates, mission["positions"], atol=1e-6)
+
+
+class TestProfiling:
+    """Test class for the timers and counters of libs/profiling.py"""
+
+    def test_disabled_records_nothing(self):
+        """Test function to ensure a disabled profiler hands out one shared
+        no-op timer and ignores counters.
+        """
+        disabled = Profiler()
+        with disabled.Timer("stage", sweepID=1):
+            disabled.Count("samples", 10)
+        assert disabled.Timer("stage") is disabled.Timer("other")
+        assert disabled.GetReport()["stages"] == {}
+        assert disabled.GetReport()["counters"] == {}
+
+    def test_stages_counters_and_peaks(self):
+        """Test function to ensure stages and counters are recorded overall and
+        per sweep, and an enclosing stage peaks at least as high as its stages.
+        """
+        enabled = Profiler()
+        enabled.Enable(traceMemory=True)
+        try:
+            with enabled.Timer("outer"):
+                for sweepID in (3, 4):
+                    with enabled.Timer("inner", sweepID):
+                        buffer = numpy.ones(1 << 18)
+                        del buffer
+                    enabled.Count("beams", 5, sweepID)
+        finally:
+            enabled.Disable()
+        report = enabled.GetReport()
+        assert report["stages"]["inner"]["calls"] == 2
+        assert report["stages"]["inner"]["peakBytes"] >= 8 << 18
+        assert (
+            report["stages"]["outer"]["peakBytes"]
+            >= report["stages"]["inner"]["peakBytes"]
+        )
+        assert report["counters"] == {"beams": 10}
+        assert report["sweeps"]["4"]["counters"] == {"beams": 5}
+        assert set(report["sweeps"]["3"]["stages"]) == {"inner"}
+
+    def test_pipeline_report(self, tmp_path):
+        """Test function to ensure the instrumented pipeline reports its stages,
+        the ray casting of every sweep, and its counters into a JSON file.
+        """
+        profiler.Enable()
+        try:
+            angles, distances = GetLidarMeasurementsFromFile(LIDAR_POINTS)
+            lidarSweepsList = ExtractSweepsFromMeasurements(angles, distances)
+            ComputeGridMaps(lidarSweepsList[:3], xy_resolution=0.02)
+            profiler.WriteReport(str(tmp_path / "profile.json"))
+        finally:
+            profiler.Disable()
+        with open(tmp_path / "profile.json") as fileHandler:
+            report = json.load(fileHandler)
+        assert report["counters"]["samplesParsed"] == len(angles)
+        assert report["counters"]["sweepsSegmented"] == 34
+        assert report["counters"]["beamsCast"] == lidarSweepsList.numSamples[:3].sum()
+        assert report["stages"]["generate_ray_casting_grid_map"]["calls"] == 3
+        assert "ExtractSweepsFromMeasurements" in report["stages"]
+        assert sorted(report["sweeps"]) == ["0", "1", "2"]
+
+
+class TestLogHandler:
+    """Test class for the logger setup of libs/loghandler.py"""
+
+    def test_no_duplicate_handlers(self):
+        """Test function to ensure creating several LogHandler of the same
+        logger attaches a single console handler.
+        """
+        first = LogHandler("test_no_duplicate_handlers")
+        second = LogHandler("test_no_duplicate_handlers", level="warning")
+        assert first.log is second.log
+        assert len(second.log.handlers) == 1
+        assert second.consoleHandler is first.consoleHandler
+        assert second.log.level == logging.WARNING
+
+    def test_level_from_environment(self, monkeypatch):
+        """Test function to ensure the level defaults to the environment
+        variable, and an unknown level is rejected.
+        """
+        monkeypatch.setenv("LIDAR1D_LOG_LEVEL", "error")
+        assert LogHandler("test_level_from_environment").log.level == logging.ERROR
+        with pytest.raises(AssertionError):
+            LogHandler("test_level_from_environment", level="verbose")
+
+    def test_queue_mode_lazy_records(self):
+        """Test function to ensure queued records are formatted with their
+        level color and lazy arguments, and written once the queue stops.
+        """
+        logHandle = LogHandler("test_queue_mode_lazy_records", level="INFO")
+        stream = io.StringIO()
+        logHandle.consoleHandler.setStream(stream)
+        logHandle.StartQueue()
+        assert logHandle.log.handlers == [logHandle.queueHandler]
+        logHandle.log.info("sweep=%d numSamples=%d", 3, 533)
+        logHandle.log.debug("filtered %s", "out")
+        logHandle.StopQueue()
+        assert logHandle.log.handlers == [logHandle.consoleHandler]
+        output = stream.getvalue()
+        assert output.count("\n") == 1
+        assert "INFO - sweep=3 numSamples=533" in output
+        assert output.startswith(CustomFormatter.grey)
+
+
+class TestProjection:
+    """Test class for the batched projection of libs/projection.py"""
+
+    def test_trig_table_tolerance(self):
+        """Test function to ensure the projection is exact by default, and the
+        table lookup a caller opts in to stays within the angle tolerance of
+        the exact projection, and is exact on the table grid.
+        """
+        angles = numpy.random.RandomState(0).uniform(-360.0, 720.0, 1000)
+        distances = numpy.full(1000, 20.0)
+        radians = numpy.radians(angles)
+        exact = ProjectToLocalFrame(angles, distances)
+        numpy.testing.assert_array_equal(
+            exact,
+            numpy.column_stack((20.0 * numpy.sin(radians), 20.0 * numpy.cos(radians))),
+        )
+        tabled = ProjectToLocalFrame(angles, distances, tolerance=DATA_TOLERANCE)
+        assert numpy.hypot(*(tabled - exact).T).max() <= 20.0 * numpy.radians(
+            1.0 / 4096
+        )
+        onGrid = numpy.arange(0, 720) * 0.5
+        numpy.testing.assert_allclose(
+            ProjectToLocalFrame(onGrid, numpy.ones(720), tolerance=0.5),
+            ProjectToLocalFrame(onGrid, numpy.ones(720), tolerance=0),
+            atol=1e-12,
+        )
+        with pytest.raises(AssertionError):
+            GetTrigTable(0.7)
+
+    def test_sweep_set_frames(self):
+        """Test function to ensure a whole SweepSet is projected in the local
+        frame of each sweep and in the world frame along the flight path.
+        """
+        angles, distances = GetLidarMeasurementsFromFile(LIDAR_POINTS)
+        lidarSweepsList = ExtractSweepsFromMeasurements(angles, distances)
+        sweepIDs, pathCoordinates = GetFlightPathFromFile(FLIGHT_PATH)
+        lidarSweepsList.SetPoses(sweepIDs, pathCoordinates)
+        local = ProjectSweepSet(lidarSweepsList)
+        world = ProjectSweepSet(lidarSweepsList, "world")
+        sweep = lidarSweepsList[5]
+        start, end = lidarSweepsList.offsets[5:7]
+        radians = numpy.radians(sweep.angles)
+        numpy.testing.assert_allclose(
+            local[start:end],
+            numpy.column_stack(
+                (
+                    sweep.distances * numpy.sin(radians),
+                    sweep.distances * numpy.cos(radians),
+                )
+            ),
+            atol=1e-4,
+        )
+        # the local frame is the world frame turned by 90 degrees
+        numpy.testing.assert_allclose(
+            world[start:end] - sweep.coordinates,
+            numpy.column_stack((local[start:end, 1], -local[start:end, 0])),
+            atol=1e-12,
+        )
+
+    def test_preallocated_buffer(self):
+        """Test function to ensure the points are written into the given
+        buffer, reused from one call to the next.
+        """
+        buffer = numpy.empty((3, 2))
+        result = ProjectToLocalFrame([0.0, 90.0, 180.0], [1.0, 2.0, 3.0], out=buffer)
+        assert result is buffer
+        numpy.testing.assert_allclose(buffer, [[0, 1], [2, 0], [0, -3]], atol=1e-12)
+        ProjectToLocalFrame([270.0, 0.0, 0.0], [1.0, 1.0, 1.0], out=buffer)
+        numpy.testing.assert_allclose(buffer[0], [-1, 0], atol=1e-12)
+
+
+class TestDownsampling:
+    """Test class for the downsampling of the sweep end points"""
+
+    def test_unique_cells_keeps_last_point(self):
+        """Test function to ensure one index per distinct cell is kept, the
+        last point of the cell, in sample order.
+        """
+        ix = numpy.array([3, 5, 3, -2, 5, 7])
+        iy = numpy.array([1, 2, 1, -4, 2, 1])
+        numpy.testing.assert_array_equal(downsample.unique_cells(ix, iy), [2, 3, 4, 5])
+        ox, oy = downsample.cell_downsample([0.01, 0.02, 0.5], [0.0, 0.01, 0.5], 0.1)
+        numpy.testing.assert_array_equal(ox, [0.02, 0.5])
+        numpy.testing.assert_array_equal(oy, [0.01, 0.5])
+
+    def test_duplicate_end_points_match_bresenham(self):
+        """Test function to ensure casting one beam per distinct cell writes
+        the same map as casting every beam one at a time.
+        """
+        randomState = numpy.random.RandomState(2)
+        ox = randomState.uniform(-1.9, 1.9, 60)
+        oy = randomState.uniform(-1.9, 1.9, 60)
+        order = randomState.randint(0, 60, 400)
+        ox, oy = ox[order], oy[order]
+        batchMap = lidar_to_grid_map.generate_ray_casting_grid_map(
+            ox, oy, 0.05, batch=True
+        )[0]
+        loopMap = lidar_to_grid_map.generate_ray_casting_grid_map(
+            ox, oy, 0.05, batch=False
+        )[0]
+        numpy.testing.assert_array_equal(batchMap, loopMap)
+
+    def test_farthest_per_angular_bin(self):
+        """Test function to ensure the farthest return of every angular bin is
+        kept, the bins wrapping around 360 degrees.
+        """
+        angles = numpy.array([0.2, 0.7, 1.5, 359.9, 1.1, -0.5])
+        distances = numpy.array([2.0, 3.0, 1.0, 4.0, 1.0, 5.0])
+        keep = downsample.farthest_per_angular_bin(angles, distances, 1.0)
+        numpy.testing.assert_array_equal(keep, [1, 2, 5])
+
+    def test_global_map_casts_distinct_cells(self):
+        """Test function to ensure duplicated beams are cast once and leave the
+        global map unchanged.
+        """
+        angles = numpy.array([0.0, 90.0, 0.0, 90.0, 0.0])
+        distances = numpy.array([2.0, 3.0, 2.01, 3.0, 2.0])
+        single = global_map.GlobalOccupancyMap(-5, -5, 5, 5, 0.1)
+        single.add_sweep(angles[:2], distances[:2], (1, 1))
+        duplicated = global_map.GlobalOccupancyMap(-5, -5, 5, 5, 0.1)
+        profiler.Enable()
+        try:
+            duplicated.add_sweep(angles, distances, (1, 1))
+            assert profiler.GetReport()["counters"]["beamsCast"] == 2
+        finally:
+            profiler.Disable()
+        numpy.testing.assert_array_equal(single.log_odds, duplicated.log_odds)
+
+
+class TestFixedExtentGridMap:
+    """Test class for the fixed extent grid maps of a max range"""
+
+    @pytest.mark.parametrize("sweepID, xy_resolution", [(0, 0.05), (24, 0.02)])
+    def test_farthest_points_fit_in_map(self, sweepID, xy_resolution):
+        """Test function to ensure the extended occupied area of the farthest
+        points stays inside the map computed from the sweep.
+        """
+        ox, oy = GetBundledSweepPoints([sweepID])[0]
+        batchMap = lidar_to_grid_map.generate_ray_casting_grid_map(
+            ox, oy, xy_resolution
+        )[0]
+        loopMap = lidar_to_grid_map.generate_ray_casting_grid_map(
+            ox, oy, xy_resolution, batch=False
+        )[0]
+        numpy.testing.assert_array_equal(batchMap, loopMap)
+
+    def test_buffer_is_reused(self):
+        """Test function to ensure every sweep is written into the same buffer
+        of the same extent, with the same cells as casting one beam at a time.
+        """
+        shape = lidar_to_grid_map.calc_fixed_grid_map_config(4.0, 0.05)[4:]
+        buffer = numpy.empty(shape)
+        for ox, oy in GetBundledSweepPoints([3, 20]):
+            gridMap, minX, maxX, minY, maxY, _ = (
+                lidar_to_grid_map.generate_ray_casting_grid_map(
+                    ox, oy, 0.05, max_range=4.0, out=buffer
+                )
+            )
+            assert gridMap is buffer
+            assert minX == minY == -4.5 and maxX == maxY == 4.6
+            loopMap = lidar_to_grid_map.generate_ray_casting_grid_map(
+                ox, oy, 0.05, batch=False, max_range=4.0
+            )[0]
+            numpy.testing.assert_array_equal(buffer, loopMap)
+
+    def test_beams_past_max_range_are_clipped(self):
+        """Test function to ensure a beam past the max range clears free space
+        up to the max range without any occupied cell.
+        """
+        gridMap = lidar_to_grid_map.generate_ray_casting_grid_map(
+            numpy.array([0.0, 30.0]), numpy.array([1.0, 0.0]), 0.1, max_range=2.0
+        )[0]
+        center = 25
+        assert gridMap.shape == (52, 52)
+        assert gridMap[center, center + 10] == 1.0
+        numpy.testing.assert_array_equal(gridMap[center : center + 21, center], 0.0)
+        assert (gridMap == 1.0).sum() == 4
+
+    def test_compute_grid_maps_max_range(self):
+        """Test function to ensure the process pool returns the same fixed
+        extent maps as the serial computation.
+        """
+        angles, distances = GetLidarMeasurementsFromFile(LIDAR_POINTS)
+        lidarSweepsList = ExtractSweepsFromMeasurements(angles, distances)[:4]
+        serial = ComputeGridMaps(lidarSweepsList, 0.05, maxRange=6.0)
+        parallel = ComputeGridMaps(lidarSweepsList, 0.05, jobs=2, maxRange=6.0)
+        for serialMap, parallelMap in zip(serial, parallel):
+            assert serialMap["gridMap"].shape == (262, 262)
+            assert serialMap["extent"] == parallelMap["extent"]
+            numpy.testing.assert_array_equal(
+                serialMap["gridMap"], parallelMap["gridMap"]
+            )
+
+
+class TestScanMatching:
+    """Test class for the ICP scan matching of consecutive sweeps"""
+
+    @pytest.mark.parametrize("method", ["point", "line"])
+    def test_recovers_known_motion(self, method):
+        """Test function to ensure ICP recovers the motion between a sweep and
+        a moved copy of it.
+        """
+        angles, distances = GetLidarMeasurementsFromFile(LIDAR_POINTS)
+        sweep = ExtractSweepsFromMeasurements(angles, distances)[5]
+        source = GetScanPoints(sweep.angles, sweep.distances)
+        target = TransformPoints(source, (0.2, 0.15, -0.03))
+        result = MatchScans(source, target, method=method, maxIterations=100)
+        assert result["numCorrespondences"] > 0.9 * len(source)
+        numpy.testing.assert_allclose(result["pose"], (0.2, 0.15, -0.03), atol=0.02)
+
+    def test_consecutive_sweeps_follow_flight_path(self):
+        """Test function to ensure the chained sweep motions of a simulated
+        mission follow its flight path, in parallel as in serial.
+        """
+        mission = GenerateMission(roomsX=2, roomsY=2, step=0.8, noise=0.005, seed=4)
+        lidarSweepsList = SweepSet(
+            mission["angles"],
+            mission["distances"],
+            mission["offsets"],
+            poses=mission["positions"],
+        )
+        serial = MatchConsecutiveSweeps(lidarSweepsList, useFlightPath=True)
+        parallel = MatchConsecutiveSweeps(lidarSweepsList, useFlightPath=True, jobs=2)
+        poses = numpy.array([match["pose"] for match in serial])
+        numpy.testing.assert_array_equal(poses, [match["pose"] for match in parallel])
+        assert [match["sweepID"] for match in serial] == list(
+            range(1, len(lidarSweepsList))
+        )
+        path = EstimateFlightPath(poses, mission["positions"][0])
+        numpy.testing.assert_allclose(path[:, :2], mission["positions"], atol=0.1)
+
+    def test_bundled_pairs_stay_near_from_no_motion(self):
+        """Test function to ensure point to line ICP from no motion keeps the
+        poses of the bundled sweep pairs bounded, and reports the pairs it
+        could not match.
+        """
+        angles, distances = GetLidarMeasurementsFromFile(LIDAR_POINTS)
+        lidarSweepsList = ExtractSweepsFromMeasurements(angles, distances)
+        matches = MatchConsecutiveSweeps(lidarSweepsList, method="line")
+        poses = numpy.array([match["pose"] for match in matches])
+        assert numpy.isfinite(poses).all()
+        assert numpy.abs(poses[:, :2]).max() < 10.0
+        assert numpy.abs(poses[:, 2]).max() <= numpy.pi
+        for match in matches:
+            if match["numCorrespondences"] < 10:
+                assert match["rmse"] == numpy.inf and not match["converged"]
+        numpy.testing.assert_allclose(poses[6], (-0.03, 1.03, 0.0), atol=0.01)
+
+    def test_bundled_flight_path_is_recovered(self):
+        """Test function to ensure the refined motions of the bundled sweeps
+        follow the flight path motions in the world frame, and chain into the
+        flight path.
+        """
+        angles, distances = GetLidarMeasurementsFromFile(LIDAR_POINTS)
+        lidarSweepsList = ExtractSweepsFromMeasurements(angles, distances)
+        lidarSweepsList.SetPoses(*GetFlightPathFromFile(FLIGHT_PATH))
+        matches = MatchConsecutiveSweeps(
+            lidarSweepsList, method="line", useFlightPath=True
+        )
+        poses = numpy.array([match["pose"] for match in matches])
+        motions = numpy.diff(lidarSweepsList.poses, axis=0)
+        numpy.testing.assert_allclose(poses[:, :2], motions, atol=0.1)
+        numpy.testing.assert_allclose(poses[:, 2], 0.0, atol=0.01)
+        assert max(match["rmse"] for match in matches) < 0.15
+        path = EstimateFlightPath(poses, lidarSweepsList.poses[0])
+        numpy.testing.assert_allclose(path[:, :2], lidarSweepsList.poses, atol=0.1)
+
+    def test_estimate_flight_path_chains_headings(self):
+        """Test function to ensure every relative pose is applied in the frame
+        of the previous sweep.
+        """
+        path = EstimateFlightPath(
+            [(1.0, 0.0, numpy.pi / 2), (1.0, 0.0, 0.0)], start=(2.0, 3.0)
+        )
+        numpy.testing.assert_allclose(
+            path, [[2, 3, 0], [3, 3, numpy.pi / 2], [3, 4, numpy.pi / 2]], atol=1e-12
+        )
+
+    def test_method_must_be_known(self):
+        """Test function to ensure the function raises an AssertionError
+        for an unknown method.
+        """
+        with pytest.raises(AssertionError):
+            MatchScans(numpy.zeros((3, 2)), numpy.zeros((3, 2)), method="plane")
+
+
+class TestLocalization:
+    """Test class for the Monte Carlo localization against an occupancy map"""
+
+    @staticmethod
+    def _GetSweepField():
+        angles, distances = GetLidarMeasurementsFromFile(LIDAR_POINTS)
+        sweep = ExtractSweepsFromMeasurements(angles, distances)[10]
+        ox, oy = ProjectToLocalFrame(sweep.angles, sweep.distances).T
+        gridMap, minX, _, minY, _, resolution = (
+            lidar_to_grid_map.generate_ray_casting_grid_map(ox, oy, 0.05)
+        )
+        return sweep, LikelihoodField(gridMap, minX, minY, resolution)
+
+    def test_converges_to_sweep_pose(self):
+        """Test function to ensure the particles started away from the pose of
+        the sweep the map was built from converge back to it.
+        """
+        sweep, field = self._GetSweepField()
+        particleFilter = ParticleFilter(field, 2000, (0.4, -0.3, 6.0), seed=0)
+        for _ in range(4):
+            pose = particleFilter.Step(sweep.angles, sweep.distances, (0, 0, 0))
+        numpy.testing.assert_allclose(pose, (0.0, 0.0, 0.0), atol=0.1)
+
+    def test_parallel_scores_match_serial(self):
+        """Test function to ensure particles scored by worker processes get
+        the scores of the serial filter.
+        """
+        sweep, field = self._GetSweepField()
+        serial = ParticleFilter(field, 1500, (0, 0, 0), chunkSize=500, seed=1)
+        with ParticleFilter(
+            field, 1500, (0, 0, 0), chunkSize=500, seed=1, jobs=2
+        ) as parallel:
+            numpy.testing.assert_array_equal(
+                serial.Score(sweep.angles, sweep.distances),
+                parallel.Score(sweep.angles, sweep.distances),
+            )
+
+    def test_worker_pool_starts_on_first_parallel_score(self):
+        """Test function to ensure a parallel filter only starts its worker
+        processes on the first score split in chunks, and stops them at the
+        end of its with block.
+        """
+        sweep, field = self._GetSweepField()
+        with ParticleFilter(field, 100, (0, 0, 0), chunkSize=500, jobs=2) as pf:
+            assert pf.executor is None
+            pf.Score(sweep.angles, sweep.distances)
+            # a single chunk is scored in this process
+            assert pf.executor is None
+            pf.chunkSize = 50
+            pf.Score(sweep.angles, sweep.distances)
+            assert pf.executor is not None
+        assert pf.executor is None
+
+    def test_obstacle_distances_match_brute_force(self):
+        """Test function to ensure the distances to obstacles are the exact
+        euclidean ones, clamped to the maximum distance.
+        """
+        gridMap = numpy.full((30, 40), 0.5)
+        gridMap[numpy.random.RandomState(3).random_sample(gridMap.shape) > 0.97] = 1.0
+        distances = GetObstacleDistances(gridMap, 0.1, 0.6)
+        obstacles = numpy.argwhere(gridMap == 1.0)
+        cells = numpy.indices(gridMap.shape).reshape(2, -1).T
+        expected = numpy.hypot(*(cells[:, None] - obstacles).transpose(2, 0, 1))
+        expected = numpy.minimum(expected.min(axis=1) * 0.1, 0.6)
+        numpy.testing.assert_allclose(distances.ravel(), expected)
+
+    def test_motion_is_applied_along_heading(self):
+        """Test function to ensure a forward motion moves a particle along its
+        heading, in the frame of the beams.
+        """
+        _, field = self._GetSweepField()
+        particleFilter = ParticleFilter(
+            field, 3, (1.0, 2.0, 90.0), initialSpread=0, motionNoise=0
+        )
+        particleFilter.Predict((0.5, 0.0, 10.0))
+        numpy.testing.assert_allclose(
+            particleFilter.particles, [[1.5, 2.0, 100.0]] * 3, atol=1e-12
+        )
+
+
+class TestRayQuery:
+    """Test class for the batched expected range queries on a grid map"""
+
+    def test_ranges_of_a_wall(self):
+        """Test function to ensure a beam stops at the boundary of the first
+        occupied cell and the others read the maximum range.
+        """
+        gridMap = numpy.zeros((20, 20))
+        gridMap[10, :] = 1.0
+        ranges = ray_query.expected_ranges(
+            gridMap,
+            0.0,
+            0.0,
+            0.1,
+            [(0.0, 0.0, 0.0), (0.0, 0.5, 90.0)],
+            [0.0, 90.0],
+            5.0,
+        )
+        numpy.testing.assert_allclose(ranges, [[5.0, 0.95], [0.95, 5.0]])
+
+    def test_ranges_match_the_sweep(self):
+        """Test function to ensure the ranges read on the map of a sweep from
+        its own pose match its distances.
+        """
+        angles, distances = GetLidarMeasurementsFromFile(LIDAR_POINTS)
+        sweep = ExtractSweepsFromMeasurements(angles, distances)[10]
+        ox, oy = ProjectToLocalFrame(sweep.angles, sweep.distances).T
+        gridMap, minX, _, minY, _, resolution = (
+            lidar_to_grid_map.generate_ray_casting_grid_map(ox, oy, 0.05)
+        )
+        ranges = ray_query.expected_ranges(
+            gridMap, minX, minY, resolution, [(0, 0, 0)], sweep.angles, 20.0
+        )
+        errors = numpy.abs(ranges[0] - sweep.distances)
+        assert numpy.median(errors) < 0.05
+        assert numpy.mean(errors < 0.1) > 0.9
+
+    def test_distance_field_gives_same_ranges(self):
+        """Test function to ensure skipping the free space of a distance field
+        does not change the ranges.
+        """
+        gridMap = numpy.zeros((60, 80))
+        gridMap[numpy.random.RandomState(5).random_sample(gridMap.shape) > 0.98] = 1.0
+        poses = numpy.random.RandomState(6).uniform((0, 0, 0), (3, 4, 360), (20, 3))
+        angles = numpy.arange(0.0, 360.0, 7.0)
+        ranges = ray_query.expected_ranges(gridMap, 0.0, 0.0, 0.05, poses, angles, 4.0)
+        accelerated = ray_query.expected_ranges(
+            gridMap,
+            0.0,
+            0.0,
+            0.05,
+            poses,
+            angles,
+            4.0,
+            distance_field=GetObstacleDistances(gridMap, 0.05, 1.0),
+        )
+        assert ranges.shape == (20, len(angles))
+        numpy.testing.assert_allclose(accelerated, ranges, atol=1e-9)
+
+
+class TestDistanceField:
+    """Test class for the euclidean distance transform of grid maps"""
+
+    @staticmethod
+    def _BruteForce(gridMap, resolution):
+        obstacles = numpy.argwhere(gridMap > 0.5)
+        cells = numpy.indices(gridMap.shape).reshape(2, -1).T
+        squared = ((cells[:, None] - obstacles) ** 2).sum(axis=2).min(axis=1)
+        return numpy.sqrt(squared).reshape(gridMap.shape) * resolution
+
+    @pytest.mark.parametrize("shape", [(30, 40), (1, 17), (25, 1)])
+    def test_matches_brute_force(self, shape):
+        """Test function to ensure the transform gives the exact euclidean
+        distances to the nearest occupied cell.
+        """
+        gridMap = numpy.full(shape, 0.5)
+        gridMap[numpy.random.RandomState(7).random_sample(shape) > 0.9] = 1.0
+        gridMap[0, 0] = 1.0
+        numpy.testing.assert_allclose(
+            distance_field.distance_field(gridMap, 0.1),
+            self._BruteForce(gridMap, 0.1),
+        )
+
+    def test_no_obstacle_is_infinite(self):
+        """Test function to ensure the cells of a map without obstacle are
+        infinitely far from one.
+        """
+        assert numpy.isinf(
+            distance_field.distance_field(numpy.zeros((4, 5)), 0.1)
+        ).all()
+
+    def test_local_updates_match_full_transform(self):
+        """Test function to ensure updating the field after local changes of
+        the map gives the field of the whole new map, and leaves it untouched
+        without changes.
+        """
+        randomState = numpy.random.RandomState(8)
+        gridMap = numpy.where(randomState.random_sample((40, 50)) > 0.95, 1.0, 0.0)
+        field = distance_field.DistanceField(gridMap, 0.05)
+        for _ in range(6):
+            x, y = randomState.randint(0, 36), randomState.randint(0, 45)
+            gridMap[x : x + 4, y : y + 5] = randomState.random_sample((4, 5)) > 0.6
+            field.update(gridMap, (x, x + 4, y, y + 5))
+            numpy.testing.assert_array_equal(
+                field.squared, distance_field.DistanceField(gridMap, 0.05).squared
+            )
+        assert len(field.update(gridMap)) == 0
+
+    def test_small_updates_beat_the_full_transform(self):
+        """Test function to ensure a small change of a map is faster to
+        follow than a new transform, and a change of the whole map falls back
+        to a full transform, both matching the field of the new map.
+        """
+        randomState = numpy.random.RandomState(5)
+        gridMap = numpy.where(randomState.random_sample((200, 200)) > 0.99, 1.0, 0.0)
+        changed = gridMap.copy()
+        changed[100:104, 60:64] = 1.0 - changed[100:104, 60:64]
+        field = distance_field.DistanceField(gridMap, 0.05)
+        rows = field.update(changed, (100, 104, 60, 64))
+        assert 0 < len(rows) < 200
+        numpy.testing.assert_array_equal(
+            field.squared, distance_field.DistanceField(changed, 0.05).squared
+        )
+
+        # every timed update flips the changed cells back and forth
+        maps = itertools.cycle([gridMap, changed])
+        update = MeasureStage(lambda: field.update(next(maps), (100, 104, 60, 64)))
+        full = MeasureStage(lambda: distance_field.DistanceField(changed, 0.05))
+        assert update["seconds"] < full["seconds"]
+
+        changed = numpy.where(randomState.random_sample((200, 200)) > 0.99, 1.0, 0.0)
+        assert len(field.update(changed)) == 200
+        numpy.testing.assert_array_equal(
+            field.squared, distance_field.DistanceField(changed, 0.05).squared
+        )
+
+
+class TestSpatialIndex:
+    """Test class for the grid hash spatial index of world points"""
+
+    @staticmethod
+    def _GetPointsAndQueries():
+        randomState = numpy.random.RandomState(9)
+        points = randomState.uniform(-5, 5, (2000, 2))
+        points[:40] = points[40:80]
+        queries = randomState.uniform(-7, 7, (150, 2))
+        distances = numpy.hypot(*(queries[:, None] - points).transpose(2, 0, 1))
+        return points, queries, distances
+
+    def test_radius_query_matches_brute_force(self):
+        """Test function to ensure a radius query returns every point within
+        the radius, nearest first.
+        """
+        points, queries, expected = self._GetPointsAndQueries()
+        indices, distances, offsets = SpatialIndex(0.4, points).QueryRadius(
+            queries, 0.9
+        )
+        for query in range(len(queries)):
+            found = slice(offsets[query], offsets[query + 1])
+            assert set(indices[found]) == set(numpy.flatnonzero(expected[query] <= 0.9))
+            assert numpy.all(numpy.diff(distances[found]) >= 0)
+
+    @pytest.mark.parametrize("k, maxDistance", [(1, None), (4, None), (4, 0.5)])
+    def test_nearest_query_matches_brute_force(self, k, maxDistance):
+        """Test function to ensure the k nearest points are found past the
+        first window of cells, and none beyond maxDistance.
+        """
+        points, queries, expected = self._GetPointsAndQueries()
+        indices, distances = SpatialIndex(0.4, points).QueryNearest(
+            queries, k, maxDistance
+        )
+        expected = numpy.sort(expected, axis=1)[:, :k]
+        if maxDistance is not None:
+            expected[expected > maxDistance] = numpy.inf
+        numpy.testing.assert_allclose(distances, expected)
+        found = indices >= 0
+        numpy.testing.assert_allclose(
+            numpy.hypot(
+                *(points[indices[found]] - queries.repeat(k, 0)[found.ravel()]).T
+            ),
+            distances[found],
+        )
+
+    def test_far_queries_stay_within_the_index(self):
+        """Test function to ensure queries far from the points and large radii
+        only search the cells spanned by the index, and stay exact.
+        """
+        points, _, _ = self._GetPointsAndQueries()
+        queries = numpy.array([[400.0, 400.0], [-300.0, 2.0], [0.0, 0.0]])
+        expected = numpy.hypot(*(queries[:, None] - points).transpose(2, 0, 1))
+        index = SpatialIndex(0.1, points)
+        tracemalloc.start()
+        try:
+            indices, distances = index.QueryNearest(queries, 3)
+            _, _, offsets = index.QueryRadius(queries, 600.0)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        numpy.testing.assert_allclose(distances, numpy.sort(expected, axis=1)[:, :3])
+        numpy.testing.assert_array_equal(numpy.diff(offsets), len(points))
+        assert peak < 20 * 10**6
+
+    def test_insertion_matches_bulk_index(self):
+        """Test function to ensure inserting points in batches gives the index
+        built from all of them at once.
+        """
+        points, queries, _ = self._GetPointsAndQueries()
+        index = SpatialIndex(0.4)
+        for batch in numpy.array_split(numpy.arange(len(points)), 5):
+            numpy.testing.assert_array_equal(index.Insert(points[batch], batch), batch)
+        bulk = SpatialIndex(0.4, points)
+        numpy.testing.assert_array_equal(
+            index.QueryNearest(queries, 3)[0], bulk.QueryNearest(queries, 3)[0]
+        )
+        numpy.testing.assert_array_equal(index.labels, numpy.arange(len(points)))
+
+    def test_sweep_set_points_are_labelled(self):
+        """Test function to ensure the points of a sweep set are indexed in
+        the world frame with their sweep ID.
+        """
+        mission = GenerateMission(roomsX=1, roomsY=2, seed=2)
+        lidarSweepsList = SweepSet(
+            mission["angles"],
+            mission["distances"],
+            mission["offsets"],
+            poses=mission["positions"],
+        )
+        index = SpatialIndex.FromSweepSet(lidarSweepsList)
+        assert len(index) == lidarSweepsList.numSamples.sum()
+        numpy.testing.assert_array_equal(
+            numpy.bincount(index.labels), lidarSweepsList.numSamples
+        )
+
+    def test_sweep_set_points_are_in_the_world_frame(self):
+        """Test function to ensure a sweep with a known pose is indexed at
+        x + d*cos(a) and y - d*sin(a), and a sweep without pose is left out.
+        """
+        lidarSweepsList = SweepSet(
+            numpy.array([0.0, 90.0, 180.0, 0.0]),
+            numpy.array([1.5, 2.0, 0.5, 1.0]),
+            [0, 3, 4],
+            sweepIDs=[7, 9],
+            poses=[[2.0, 3.0], [numpy.nan, numpy.nan]],
+        )
+        index = SpatialIndex.FromSweepSet(lidarSweepsList)
+        numpy.testing.assert_allclose(
+            index.points, [[3.5, 3.0], [2.0, 1.0], [1.5, 3.0]], atol=1e-12
+        )
+        numpy.testing.assert_array_equal(index.labels, [7, 7, 7])
+        nearest, distances = index.QueryNearest(numpy.array([[2.1, 1.2]]))
+        assert nearest[0, 0] == 1
+        numpy.testing.assert_allclose(distances[0, 0], numpy.hypot(0.1, 0.2))
+
+
+class TestLiveService:
+    """Test class for the asyncio live map service and its replay client"""
+
+    @staticmethod
+    def _GetPoses():
+        sweepIDs, pathCoordinates = GetFlightPathFromFile(FLIGHT_PATH)
+        return dict(zip(sweepIDs.tolist(), pathCoordinates))
+
+    def test_replay_fuses_every_sweep(self):
+        """Test function to ensure a blocking service fuses every replayed
+        sweep into the map a sequential fusion gives, with the samples at
+        their world frame points, and serves it.
+        """
+        poses = self._GetPoses()
+
+        async def Run():
+            service = LiveMapService(poses, queueSize=2, overflow="block")
+            _, port = await service.Start()
+            reader, writer = await OpenServiceConnection(port=port)
+            numSweeps = await ReplayLidarPoints(LIDAR_POINTS, writer, speed=0)
+            stats = await SendRequest(reader, writer, {"command": "flush"})
+            snapshot = await RequestSnapshot(reader, writer)
+            await service.Stop()
+            return service, numSweeps, stats, snapshot
+
+        service, numSweeps, stats, (probability, extent, numFused) = asyncio.run(Run())
+        assert numSweeps == stats["sweepsReceived"] == stats["sweepsFused"] == numFused
+        assert stats["sweepsDropped"] == 0 and stats["queueDepth"] == 0
+
+        expected = global_map.GlobalOccupancyMap(
+            0.0, 0.0, 0.05, 0.05, 0.05, tile_size=64
+        )
+        angles, distances = GetLidarMeasurementsFromFile(LIDAR_POINTS)
+        lidarSweepsList = ExtractSweepsFromMeasurements(angles, distances)
+        for sweep in lidarSweepsList:
+            expected.add_sweep(sweep.angles, sweep.distances, poses[sweep.sweepID])
+        numpy.testing.assert_array_equal(
+            service.globalMap.probability(), expected.probability()
+        )
+        # most samples hit an occupied cell, unlike their mirror images
+        lidarSweepsList.SetPoses(*GetFlightPathFromFile(FLIGHT_PATH))
+        minX, _, minY, _ = service.globalMap.extent()
+        cells = numpy.floor(
+            (ProjectSweepSet(lidarSweepsList, "world") - (minX, minY)) / 0.05
+        ).astype(numpy.int64)
+        hits = service.globalMap.probability()[cells[:, 0], cells[:, 1]] > 0.5
+        assert hits.mean() > 0.6
+        numpy.testing.assert_allclose(
+            probability, expected.probability(), atol=0.5 / 255
+        )
+        assert extent == expected.extent()
+
+    def test_dropping_keeps_queue_bounded(self):
+        """Test function to ensure a burst into a dropping service accounts
+        every sweep as fused or dropped, with an empty queue once flushed.
+        """
+
+        async def Run():
+            service = LiveMapService(self._GetPoses(), queueSize=1, overflow="drop")
+            _, port = await service.Start()
+            reader, writer = await OpenServiceConnection(port=port)
+            numSweeps = await ReplayLidarPoints(LIDAR_POINTS, writer, speed=0)
+            stats = await SendRequest(reader, writer, {"command": "flush"})
+            await service.Stop()
+            return numSweeps, stats
+
+        numSweeps, stats = asyncio.run(Run())
+        assert stats["sweepsFused"] + stats["sweepsDropped"] == numSweeps
+        assert stats["sweepsFused"] >= 1 and stats["queueDepth"] == 0
+        assert stats["latencyMax"] < 10.0
+
+    @staticmethod
+    def _FormatSweep(sweepID, angles, distances):
+        rows = ["{},{}".format(sweepID, len(angles))]
+        rows += [
+            "{},{}".format(float(a), float(d) * 1000.0)
+            for a, d in zip(angles, distances)
+        ]
+        return ("\n".join(rows) + "\n").encode()
+
+    def test_ranges_follow_the_map_incrementally(self):
+        """Test function to ensure the ranges requests between sweeps march the
+        map fused so far, its distance field being kept in step with it.
+        """
+        poses = self._GetPoses()
+        angles, distances = GetLidarMeasurementsFromFile(LIDAR_POINTS)
+        sweeps = ExtractSweepsFromMeasurements(angles, distances)
+        request = {
+            "command": "ranges",
+            "poses": [[15.0, 6.0, 0.0], [17.2, 10.0, 30.0]],
+            "angles": list(range(0, 360, 15)),
+            "maxRange": 8.0,
+        }
+
+        async def Run():
+            service = LiveMapService(poses, overflow="block")
+            _, port = await service.Start()
+            reader, writer = await OpenServiceConnection(port=port)
+            answers = []
+            for sweep in list(sweeps)[:12]:
+                writer.write(
+                    self._FormatSweep(sweep.sweepID, sweep.angles, sweep.distances)
+                )
+                await SendRequest(reader, writer, {"command": "flush"})
+                # the map thread is idle until the next sweep
+                probability = service.globalMap.probability()
+                extent = service.globalMap.extent()
+                ranges = await SendRequest(reader, writer, request)
+                answers.append((probability, extent, ranges["ranges"]))
+            await service.Stop()
+            return service, answers
+
+        service, answers = asyncio.run(Run())
+        for probability, (minX, _, minY, _), ranges in answers:
+            poses = numpy.array(request["poses"], dtype=numpy.float64)
+            expected = ray_query.expected_ranges(
+                probability > 0.5,
+                minX,
+                minY,
+                0.05,
+                numpy.column_stack((poses[:, :2], 90.0 + poses[:, 2])),
+                numpy.array(request["angles"], dtype=numpy.float64),
+                8.0,
+            )
+            numpy.testing.assert_allclose(ranges, expected)
+        numpy.testing.assert_array_equal(
+            service._distanceField.distances,
+            distance_field.distance_field(service.globalMap.probability() > 0.5, 0.05),
+        )
+
+    def test_malformed_input_keeps_the_connection(self):
+        """Test function to ensure oversized headers, undecodable and over long
+        lines and a bad sample are skipped without losing the connection or the
+        next sweeps, and a sample line is not taken for a header.
+        """
+
+        async def Run():
+            service = LiveMapService({1: (0.0, 0.0), 3: (0.0, 0.0)})
+            _, port = await service.Start()
+            reader, writer = await OpenServiceConnection(port=port)
+            writer.write(self._FormatSweep(1, [0.0, 90.0], [1.0, 1.0]))
+            writer.write(b"2,1e12\n90,1000\n")
+            writer.write(b"\xff\xfe,1\n" + b"1" * (2**20 + 1) + b"\n")
+            writer.write(self._FormatSweep(3, [180.0, 270.0], [1.0, 1.0]))
+            writer.write(b"4,3\n0,1000\nbad\n5,1000\n")
+            writer.write(self._FormatSweep(5, [45.0], [1.0]))
+            flush = await SendRequest(reader, writer, {"command": "flush"})
+            await service.Stop()
+            return flush
+
+        flush = asyncio.run(Run())
+        assert flush["malformedLines"] == 4
+        assert flush["sweepsReceived"] == 3 and flush["sweepsFused"] == 2
+        assert flush["sweepsUnplaced"] == 1 and flush["lastSweepID"] == 3
+
+    @pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="no Unix sockets")
+    def test_requests_over_unix_socket(self, tmp_path):
+        """Test function to ensure malformed lines are skipped up to the next
+        header, sweeps without pose are not fused, and requests are answered.
+        """
+        path = str(tmp_path / "live.sock")
+
+        async def Run():
+            service = LiveMapService({1: (0.0, 0.0)})
+            await service.Start(path=path)
+            reader, writer = await OpenServiceConnection(path=path)
+            writer.write(b"not,a header\n0,2\n10,1000\n20,1000\n")
+            writer.write(b"1,2\n0,1000\n90,1000\n")
+            flush = await SendRequest(reader, writer, {"command": "flush"})
+            occupancy = await SendRequest(
+                reader, writer, {"command": "occupancy", "points": [[1.0, 0.0]]}
+            )
+            ranges = await SendRequest(
+                reader,
+                writer,
+                {
+                    "command": "ranges",
+                    "poses": [[0, 0, 0]],
+                    "angles": [0, 90, 180],
+                    "maxRange": 5,
+                },
+            )
+            unknown = await SendRequest(reader, writer, {"command": "fly"})
+            await service.Stop()
+            return flush, occupancy, ranges, unknown
+
+        flush, occupancy, ranges, unknown = asyncio.run(Run())
+        assert flush["malformedLines"] == 1
+        assert flush["sweepsUnplaced"] == 1 and flush["sweepsFused"] == 1
+        assert occupancy["probabilities"][0] > 0.5
+        numpy.testing.assert_allclose(ranges["ranges"], [[0.975, 0.975, 5.0]])
+        assert "error" in unknown